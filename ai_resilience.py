@@ -0,0 +1,291 @@
+"""
+AI 调用弹性层
+为任意 AI 服务增加并发限制、调用截止时间、重试、熔断与对冲请求
+"""
+import asyncio
+import logging
+import time
+from typing import List, Dict, Optional, AsyncIterator
+
+from .ai_service import BaseAIService
+
+logger = logging.getLogger(__name__)
+
+# 本地原因（排队过多、等待超时）放弃的请求，不计入服务端失败
+_REJECTED = object()
+# 流式输出结束标记
+_STREAM_END = object()
+
+
+class CircuitBreaker:
+    """
+    简单的三态熔断器：连续失败达到阈值后打开，冷却结束后放行一次探测请求
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def admit(self) -> Optional[bool]:
+        """
+        决定是否放行本次请求：拒绝时返回 None；放行时返回本次是否为半开状态下的探测请求，
+        只有探测请求在没有得出结果时需要 release_probe
+        """
+        if self.state == self.CLOSED:
+            return False
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return None
+
+    def allow_request(self) -> bool:
+        return self.admit() is not None
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"AI服务连续失败{self.failures}次，熔断{self.reset_timeout}秒")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """
+        归还探测名额：探测请求被本地放弃、取消或中途退出而没有得出结果时，
+        下一次调用可以重新探测，否则熔断器会一直停留在半开状态
+        """
+        self._probing = False
+
+
+class ResilientAIService(BaseAIService):
+    """
+    包装另一个 AI 服务：
+    - 信号量限制并发，排队数超过 max_queue 时直接放弃
+    - 每次调用都有截止时间，重试与排队都不会超过它
+    - 熔断打开期间直接返回 None，由上层走模板兜底
+    - 可选对冲请求：首个请求超过 hedge_delay 秒未返回时再发一个，取先返回的结果
+    - 流式请求在首个片段到达前同样受排队上限、截止时间（stream_timeout）、重试与熔断保护
+    """
+    stream_timeout = 30
+
+    def __init__(self, inner: BaseAIService, max_concurrency: int = 8, max_queue: int = 64,
+                 max_retries: int = 2, hedge_delay: Optional[float] = None,
+                 failure_threshold: int = 5, reset_timeout: float = 60):
+        super().__init__()
+        self.inner = inner
+        self.model = inner.model
+        self.configured = inner.configured
+        self.max_queue = max_queue
+        self.max_retries = max(0, max_retries)
+        self.hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queued = 0
+        self.stats = {"requests": 0, "succeeded": 0, "failed": 0, "retries": 0,
+                      "hedged": 0, "rejected": 0, "short_circuited": 0, "deadline_exceeded": 0}
+
+    async def _chat_completion(self, messages: List[Dict[str, str]], temperature: float,
+                               timeout: float) -> Optional[str]:
+        self.stats["requests"] += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+
+        for attempt in range(self.max_retries + 1):
+            probe = self.breaker.admit()
+            if probe is None:
+                self.stats["short_circuited"] += 1
+                return None
+            try:
+                if deadline - loop.time() <= 0:
+                    self.stats["deadline_exceeded"] += 1
+                    return None
+                if attempt:
+                    self.stats["retries"] += 1
+
+                result = await self._attempt(messages, temperature, deadline)
+                if result is _REJECTED:
+                    break
+                if result:
+                    self.breaker.record_success()
+                    self.stats["succeeded"] += 1
+                    return result
+                self.breaker.record_failure()
+            finally:
+                # 只归还本次持有的探测名额，其他请求结束时不能放进第二个探测请求
+                if probe:
+                    self.breaker.release_probe()
+
+            # 指数退避，但不超过剩余时间
+            backoff = min(0.5 * (2 ** attempt), deadline - loop.time())
+            if attempt < self.max_retries and backoff > 0:
+                await asyncio.sleep(backoff)
+
+        self.stats["failed"] += 1
+        return None
+
+    async def _acquire(self, deadline: float) -> bool:
+        """在截止时间前取得并发槽位；排队过多或等待超时返回 False"""
+        loop = asyncio.get_running_loop()
+        if self._queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            logger.warning("AI请求排队过多，已放弃本次请求")
+            return False
+
+        self._queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.stats["deadline_exceeded"] += 1
+            return False
+        finally:
+            self._queued -= 1
+        return True
+
+    async def _attempt(self, messages: List[Dict[str, str]], temperature: float,
+                       deadline: float):
+        loop = asyncio.get_running_loop()
+        if not await self._acquire(deadline):
+            return _REJECTED
+
+        primary = asyncio.ensure_future(
+            self.inner._chat_completion(messages, temperature, max(0.1, deadline - loop.time()))
+        )
+        try:
+            if self.hedge_delay is None:
+                return await primary
+            return await self._hedge(primary, messages, temperature, deadline)
+        finally:
+            if not primary.done():
+                primary.cancel()
+            self._semaphore.release()
+
+    async def _hedge(self, primary: "asyncio.Future", messages: List[Dict[str, str]],
+                     temperature: float, deadline: float) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay)
+        # 对冲请求只在有空闲并发槽位时发出，避免在服务变慢时放大负载
+        if done or self._semaphore.locked() or deadline - loop.time() <= 0:
+            return await primary
+
+        await self._semaphore.acquire()
+        self.stats["hedged"] += 1
+        secondary = asyncio.ensure_future(
+            self.inner._chat_completion(messages, temperature, max(0.1, deadline - loop.time()))
+        )
+        pending = {primary, secondary}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result():
+                        return task.result()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            self._semaphore.release()
+
+    async def chat_completion_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                                     max_tokens: int = 4096) -> AsyncIterator[str]:
+        """
+        流式请求：首个片段到达之前按非流式调用的策略排队、重试，已经开始输出后不再重试
+
+        上游由后台任务读取到队列中，并发槽位在上游输出结束时即释放，
+        不会在调用方处理片段（如等待发送消息）期间继续占用
+        """
+        self.stats["requests"] += 1
+        queue: "asyncio.Queue" = asyncio.Queue()
+        pump = asyncio.ensure_future(self._pump_stream(messages, temperature, max_tokens, queue))
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is _STREAM_END:
+                    break
+                yield delta
+        finally:
+            if not pump.done():
+                pump.cancel()
+
+    async def _pump_stream(self, messages: List[Dict[str, str]], temperature: float,
+                           max_tokens: int, queue: "asyncio.Queue"):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.stream_timeout
+        try:
+            for attempt in range(self.max_retries + 1):
+                probe = self.breaker.admit()
+                if probe is None:
+                    self.stats["short_circuited"] += 1
+                    return
+                try:
+                    if deadline - loop.time() <= 0:
+                        self.stats["deadline_exceeded"] += 1
+                        return
+                    if attempt:
+                        self.stats["retries"] += 1
+                    if not await self._acquire(deadline):
+                        return
+                    try:
+                        received = await self._stream_once(messages, temperature, max_tokens, deadline, queue)
+                    finally:
+                        self._semaphore.release()
+                    if received:
+                        self.breaker.record_success()
+                        self.stats["succeeded"] += 1
+                        return
+                    self.breaker.record_failure()
+                finally:
+                    if probe:
+                        self.breaker.release_probe()
+
+                backoff = min(0.5 * (2 ** attempt), deadline - loop.time())
+                if attempt < self.max_retries and backoff > 0:
+                    await asyncio.sleep(backoff)
+            self.stats["failed"] += 1
+        finally:
+            queue.put_nowait(_STREAM_END)
+
+    async def _stream_once(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                           deadline: float, queue: "asyncio.Queue") -> bool:
+        """发起一次流式请求；首个片段在截止时间前到达返回 True，之后的片段原样转发"""
+        loop = asyncio.get_running_loop()
+        stream = self.inner.chat_completion_stream(messages, temperature, max_tokens)
+
+        async def first():
+            return await stream.__anext__()
+
+        try:
+            try:
+                delta = await asyncio.wait_for(first(), max(0, deadline - loop.time()))
+            except StopAsyncIteration:
+                return False
+            except asyncio.TimeoutError:
+                self.stats["deadline_exceeded"] += 1
+                return False
+            except Exception as e:
+                logger.error(f"流式请求失败: {str(e)}")
+                return False
+            queue.put_nowait(delta)
+            try:
+                async for delta in stream:
+                    queue.put_nowait(delta)
+            except Exception as e:
+                logger.error(f"流式输出中断: {str(e)}")
+            return True
+        finally:
+            await stream.aclose()
@@ -0,0 +1,216 @@
+"""
+多 AI 服务商路由
+按各服务商的延迟（EWMA）与错误率选择当前最快的健康服务商，失败时自动切换
+"""
+import logging
+import random
+import time
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable
+
+from .ai_service import (BaseAIService, OpenAICompatibleService, PROVIDER_CLASSES,
+                         PARSE_CHUNK_CHARS, PARSE_CONCURRENCY)
+from .ai_resilience import ResilientAIService
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats:
+    """单个服务商的延迟/错误率统计"""
+    def __init__(self, initial_latency: float = 1.0, alpha: float = 0.3, half_life: float = 60):
+        self.alpha = alpha
+        self.half_life = half_life
+        self.latency = initial_latency
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self._error_rate = 0.0
+        self._error_at = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        """错误率随时间按半衰期衰减，一段时间没有请求的服务商会逐渐恢复原有的排名"""
+        elapsed = time.monotonic() - self._error_at
+        return self._error_rate * 0.5 ** (elapsed / self.half_life)
+
+    def record(self, ok: bool, latency: float, failure_threshold: int, cooldown: float):
+        self.requests += 1
+        self._error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+        self._error_at = time.monotonic()
+        if ok:
+            self.latency = self.alpha * latency + (1 - self.alpha) * self.latency
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold:
+            self.cooldown_until = time.monotonic() + cooldown
+
+    @property
+    def healthy(self) -> bool:
+        """
+        只由冷却期决定：冷却结束后重新参与排序，相当于半开状态下的探测；
+        探测仍失败时连续失败数已达阈值，会立即再次进入冷却
+        """
+        return time.monotonic() >= self.cooldown_until
+
+    @property
+    def score(self) -> float:
+        # 错误率越高，等效延迟越大
+        return self.latency * (1 + 4 * self.error_rate)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "latency": round(self.latency, 3),
+            "error_rate": round(self.error_rate, 3),
+            "healthy": self.healthy,
+            "requests": self.requests,
+        }
+
+
+class ProviderRouter(BaseAIService):
+    """
+    在多个服务商之间路由请求：
+    - 优先选择得分（EWMA 延迟 × 错误惩罚）最低的健康服务商
+    - 连续失败达到阈值的服务商进入冷却期，冷却期内仅在其他服务商都失败时才会尝试
+    - 以 explore_rate 的概率随机尝试其他健康服务商，保持延迟统计新鲜
+    """
+    model = "router"
+
+    def __init__(self, providers: List[OpenAICompatibleService], preferred: Optional[str] = None,
+                 failure_threshold: int = 3, cooldown: float = 30, explore_rate: float = 0.05):
+        super().__init__()
+        if not providers:
+            raise ValueError("至少需要配置一个AI服务商")
+        self.providers = providers
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.explore_rate = explore_rate
+        # 首选服务商的初始延迟更低，在没有统计数据时优先使用
+        self.stats = {
+            p.name: ProviderStats(initial_latency=0.5 if p.name == preferred else 1.0)
+            for p in providers
+        }
+
+    def ranked_providers(self) -> List[OpenAICompatibleService]:
+        healthy = sorted(
+            (p for p in self.providers if self.stats[p.name].healthy),
+            key=lambda p: self.stats[p.name].score
+        )
+        unhealthy = sorted(
+            (p for p in self.providers if not self.stats[p.name].healthy),
+            key=lambda p: self.stats[p.name].cooldown_until
+        )
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + unhealthy
+
+    def _record(self, provider: OpenAICompatibleService, ok: bool, started: float):
+        stats = self.stats[provider.name]
+        was_healthy = stats.healthy
+        stats.record(ok, time.monotonic() - started, self.failure_threshold, self.cooldown)
+        if was_healthy and not stats.healthy:
+            logger.warning(f"AI服务商{provider.name}暂不可用，切换到其他服务商")
+
+    async def _chat_completion(self, messages: List[Dict[str, str]], temperature: float,
+                               timeout: float) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        for provider in self.ranked_providers():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.monotonic()
+            result = await provider._chat_completion(messages, temperature, remaining)
+            self._record(provider, bool(result), started)
+            if result:
+                return result
+        return None
+
+    async def chat_completion_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                                     max_tokens: int = 4096) -> AsyncIterator[str]:
+        """
+        依次尝试各服务商，直到某个服务商开始输出；开始输出后不再切换
+        """
+        for provider in self.ranked_providers():
+            started = time.monotonic()
+            received = False
+            async for delta in provider.chat_completion_stream(messages, temperature, max_tokens):
+                if not received:
+                    # 以首个分片到达的时间作为流式请求的延迟
+                    self._record(provider, True, started)
+                    received = True
+                yield delta
+            if received:
+                return
+            self._record(provider, False, started)
+
+
+class UnconfiguredAIService(BaseAIService):
+    """
+    没有配置任何服务商密钥时使用：不在启动时报错，调用时记录错误并返回空结果，
+    由上层走本地解析与模板兜底
+    """
+    model = "unconfigured"
+    configured = False
+    message = ("未配置AI服务密钥，请在插件配置中填写 siliconflow_api_key、openai_api_key、"
+               "doubao_api_key 或 custom_api_key（需同时填写 custom_api_base）之一")
+
+    async def _chat_completion(self, messages: List[Dict[str, str]], temperature: float,
+                               timeout: float) -> Optional[str]:
+        logger.error(self.message)
+        return None
+
+    async def chat_completion_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                                     max_tokens: int = 4096) -> AsyncIterator[str]:
+        logger.error(self.message)
+        return
+        yield
+
+
+def build_ai_service(config: Dict[str, Any]) -> BaseAIService:
+    """
+    根据配置创建 AI 服务：配置了密钥的每个服务商都会加入路由，
+    ai_provider 指定的服务商作为首选。
+    每个服务商可通过 <name>_api_base / <name>_model 覆盖默认地址和模型（custom 必填 api_base）。
+    一个服务商都没有配置时返回 UnconfiguredAIService。
+    """
+    preferred = config.get("ai_provider", "siliconflow")
+    providers = []
+    for name, cls in PROVIDER_CLASSES.items():
+        api_key = config.get(f"{name}_api_key")
+        api_base = config.get(f"{name}_api_base") or cls.default_api_base
+        if not api_key or not api_base:
+            continue
+        provider = cls(api_key=api_key, api_base=api_base, model=config.get(f"{name}_model"))
+        provider.name = name
+        providers.append(provider)
+
+    if not providers:
+        logger.warning(UnconfiguredAIService.message)
+        return UnconfiguredAIService()
+    if len(providers) == 1:
+        return providers[0]
+    return ProviderRouter(providers, preferred=preferred)
+
+
+def create_ai_service(get_config: Callable[[str, Any], Any]) -> BaseAIService:
+    """
+    由配置创建完整的 AI 服务（服务商路由 + 弹性层）。
+    get_config(key, default) 读取配置项：AstrBot 插件传入插件配置，NoneBot 侧传入 CONFIG.get
+    """
+    config = {
+        f"{name}_{field}": get_config(f"{name}_{field}", "")
+        for name in PROVIDER_CLASSES for field in ("api_key", "api_base", "model")
+    }
+    config["ai_provider"] = get_config("ai_provider", "siliconflow")
+    service = build_ai_service(config)
+    if service.configured:
+        hedge_delay_ms = int(get_config("ai_hedge_delay_ms", 0) or 0)
+        service = ResilientAIService(
+            service,
+            max_concurrency=int(get_config("ai_max_concurrency", 8)),
+            max_retries=int(get_config("max_ai_retries", 2)),
+            hedge_delay=hedge_delay_ms / 1000 if hedge_delay_ms > 0 else None
+        )
+    # 长课程表切块并发解析
+    service.parse_chunk_chars = max(1, int(get_config("ai_parse_chunk_chars", PARSE_CHUNK_CHARS)))
+    service.parse_concurrency = max(1, int(get_config("ai_parse_concurrency", PARSE_CONCURRENCY)))
+    return service
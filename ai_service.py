@@ -1,55 +1,278 @@
 import aiohttp
+import asyncio
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import re
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Hashable, AsyncIterator
+
+from .metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-class SiliconFlowService:
-    def __init__(self, api_key: str, api_base: str = "https://api.siliconflow.cn/v1", model: str = "deepseek-ai/DeepSeek-V3"):
-        self.api_key = api_key
-        self.api_base = api_base
-        self.model = model
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+class SingleFlight:
+    """
+    合并相同的进行中请求：同一个 key 在结果返回前只会真正执行一次，
+    其余并发调用者共享该次执行的结果。
+    """
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.stats = {"calls": 0, "executed": 0, "deduplicated": 0, "cancelled": 0}
 
-    async def chat_completion(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> Optional[str]:
-        """
-        调用 SiliconFlow 聊天完成 API
-        """
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["executed"] += 1
+            metrics.inc("kccj_ai_singleflight_leader_total")
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _t, k=key: self._forget(k, _t))
+        else:
+            self.stats["deduplicated"] += 1
+            metrics.inc("kccj_ai_singleflight_follower_total")
+
+        self._waiters[key] += 1
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "model": self.model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "stream": False,
-                    "max_tokens": 1024
-                }
-                
-                async with session.post(
-                    f"{self.api_base}/chat/completions",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=30
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result["choices"][0]["message"]["content"]
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"API调用失败: {response.status} - {error_text}")
-                        return None
-        except Exception as e:
-            logger.error(f"调用AI服务时发生错误: {str(e)}")
-            return None
+            # shield 保证单个等待者被取消时不会连带取消共享的请求
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            # 所有等待者都已取消时，才取消底层请求；同时立即移除该 key，
+            # 避免新的调用者在取消完成前加入正在取消的请求
+            if self._inflight.get(key) is task and self._waiters.get(key) == 1 and not task.done():
+                del self._inflight[key]
+                del self._waiters[key]
+                task.cancel()
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
 
-    async def parse_course_schedule(self, text: str) -> Optional[List[Dict[str, Any]]]:
+    def _forget(self, key: Hashable, task: "asyncio.Future"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+
+def _normalize_prompt(messages: List[Dict[str, str]]) -> str:
+    """规范化消息内容（合并空白），用于判断两个请求是否相同"""
+    return json.dumps(
+        [(m.get("role", ""), re.sub(r"\s+", " ", m.get("content", "")).strip()) for m in messages],
+        ensure_ascii=False
+    )
+
+
+REQUIRED_COURSE_FIELDS = ["weekday", "time", "course", "classroom", "teacher"]
+
+
+def normalize_course(course: Dict[str, Any]) -> Dict[str, Any]:
+    """补齐缺失字段并把所有字段转换为字符串"""
+    if not isinstance(course, dict):
+        raise ValueError("课程数据格式错误")
+    for field in REQUIRED_COURSE_FIELDS:
+        if field not in course:
+            course[field] = ""
+        elif not isinstance(course[field], str):
+            course[field] = str(course[field])
+    return course
+
+
+# 长课程表按星期/节次切分成多段并发解析，每段的输入（以及模型输出）都较短
+PARSE_CHUNK_CHARS = 800
+PARSE_CONCURRENCY = 4
+WEEKDAY_LINE = re.compile(r"^\s*(?:周|星期)[一二三四五六日天]")
+WEEKDAY_HEADER = re.compile(r"^\s*(?:周|星期)[一二三四五六日天]\s*[:：]?\s*$")
+SECTION_LINE = re.compile(r"^\s*第?\s*\d+\s*(?:-\s*\d+)?\s*节")
+
+
+def _split_block(lines: List[str], max_chars: int) -> List[List[str]]:
+    """
+    把超长的一段切开：优先在以节次开头的行前切分，避免把同一节课拆到两段；
+    单独一行的星期标题会重复放到每一段开头
+    """
+    header = lines[0] if WEEKDAY_HEADER.match(lines[0]) else None
+    has_sections = any(SECTION_LINE.match(line) for line in lines)
+    pieces: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        if current and current != [header] and size + len(line) > max_chars \
+                and (SECTION_LINE.match(line) or not has_sections):
+            pieces.append(current)
+            current = [header] if header else []
+            size = len(header) + 1 if header else 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_schedule_text(text: str, max_chars: int = PARSE_CHUNK_CHARS) -> List[str]:
+    """
+    按星期（以及空行）把课程表文本分段，再把相邻的段合并到不超过 max_chars 的块中；
+    单个星期仍然过长时按节次继续切分。短文本原样返回一个块
+    """
+    if len(text) <= max_chars:
+        return [text] if text.strip() else []
+    blocks: List[List[str]] = []
+    current: List[str] = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            if current:
+                blocks.append(current)
+                current = []
+            continue
+        if current and WEEKDAY_LINE.match(line):
+            blocks.append(current)
+            current = []
+        current.append(line)
+    if current:
+        blocks.append(current)
+
+    chunks: List[str] = []
+    pending: List[str] = []
+    size = 0
+    for block in blocks:
+        block_size = sum(len(line) + 1 for line in block)
+        if pending and size + block_size > max_chars:
+            chunks.append("\n".join(pending))
+            pending, size = [], 0
+        if block_size > max_chars:
+            pieces = _split_block(block, max_chars)
+            chunks.extend("\n".join(piece) for piece in pieces[:-1])
+            block = pieces[-1]
+            block_size = sum(len(line) + 1 for line in block)
+        pending.extend(block)
+        size += block_size
+    if pending:
+        chunks.append("\n".join(pending))
+    return chunks
+
+
+def _course_key(course: Dict[str, Any]) -> str:
+    return json.dumps(
+        sorted((k, re.sub(r"\s+", "", str(v))) for k, v in course.items()),
+        ensure_ascii=False
+    )
+
+
+def merge_courses(parts: List[Optional[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    """按分块顺序合并各块的解析结果，去掉在相邻块中重复出现的相同课程"""
+    seen = set()
+    merged = []
+    for courses in parts:
+        for course in courses or []:
+            key = _course_key(course)
+            if key not in seen:
+                seen.add(key)
+                merged.append(course)
+    return merged
+
+
+class CourseStreamExtractor:
+    """
+    从不断增长的 JSON 数组文本中增量提取完整的课程对象。
+
+    只跟踪花括号深度和字符串状态，因此可以容忍前后的 ```json 代码块标记，
+    并在输出被截断时保留已经闭合的对象。
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._start = -1
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._buffer += chunk
+        courses = []
+        buf = self._buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        courses.append(normalize_course(json.loads(buf[self._start:i + 1])))
+                    except ValueError as e:
+                        logger.error(f"解析AI响应时发生错误: {str(e)}")
+                    self._start = -1
+        # 丢弃已消费的内容，只保留未闭合对象
+        if self._depth == 0:
+            self._buffer, self._pos = "", 0
+        else:
+            self._buffer = buf[self._start:]
+            self._pos = len(self._buffer)
+            self._start = 0
+        return courses
+
+    @property
+    def pending(self) -> bool:
+        return self._depth > 0
+
+
+REMINDER_FALLBACK = "课程提醒：请准时上课！"
+# 流式解析结束标记
+_STREAM_END = object()
+
+
+class BaseAIService:
+    """
+    AI 服务基类：提示词构造与结果解析都在这里实现，
+    子类只需要提供 _chat_completion 与 chat_completion_stream 两个传输层方法。
+    """
+    model = ""
+    # 是否配置了可用的服务商
+    configured = True
+    parse_chunk_chars = PARSE_CHUNK_CHARS
+    parse_concurrency = PARSE_CONCURRENCY
+
+    def __init__(self):
+        self.single_flight = SingleFlight()
+
+    async def chat_completion(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                              timeout: float = 30) -> Optional[str]:
         """
-        使用 AI 解析课程表文本
+        调用聊天完成 API
+
+        相同模型、相同（规范化后）提示词的并发调用会合并为一次 HTTP 请求。
         """
+        key = (self.model, temperature, _normalize_prompt(messages))
+        return await self.single_flight.do(key, lambda: self._chat_completion(messages, temperature, timeout))
+
+    async def _chat_completion(self, messages: List[Dict[str, str]], temperature: float,
+                               timeout: float) -> Optional[str]:
+        raise NotImplementedError
+
+    def chat_completion_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                               max_tokens: int = 4096) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def _build_parse_messages(self, text: str) -> List[Dict[str, str]]:
         prompt = f"""请帮我解析以下课程表文本，提取每节课的以下信息：
 1. 星期几
 2. 上课时间（第几节）
@@ -73,45 +296,149 @@ class SiliconFlowService:
 
 请确保返回的是合法的JSON格式。如果无法解析某些信息，请将对应字段设为空字符串。"""
 
-        messages = [
+        return [
             {"role": "system", "content": "你是一个专业的课程表解析助手，请准确提取课程信息。如果某些信息无法确定，请将对应字段设为空字符串。"},
             {"role": "user", "content": prompt}
         ]
 
-        response = await self.chat_completion(messages, temperature=0.3)
-        if not response:
-            return None
+    async def _parse_chunk_stream(self, text: str) -> AsyncIterator[Dict[str, Any]]:
+        extractor = CourseStreamExtractor()
+        async for delta in self.chat_completion_stream(self._build_parse_messages(text), temperature=0.3):
+            for course in extractor.feed(delta):
+                yield course
+        if extractor.pending:
+            logger.warning("AI响应在课程对象中途结束，已保留此前解析出的课程")
+
+    async def _parse_chunk(self, text: str) -> List[Dict[str, Any]]:
+        return [course async for course in self._parse_chunk_stream(text)]
 
+    def _parse_key(self, text: str) -> Hashable:
+        return ("parse", self.model, _normalize_prompt([{"content": text}]))
+
+    async def parse_course_schedule_stream(self, text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式解析课程表：模型每输出一个完整的课程对象就立即产出
+
+        与 parse_course_schedule 共用同一个合并键：同一份课程表（如全班同学同时粘贴）只发出一次请求，
+        首个调用者边解析边产出，其余调用者等待解析完成后一次性得到完整的课程列表
+        """
+        queue: "asyncio.Queue" = asyncio.Queue()
+        leader = False
+
+        async def produce() -> Optional[List[Dict[str, Any]]]:
+            nonlocal leader
+            leader = True
+            courses = []
+            try:
+                async for course in self._parse_stream(text):
+                    courses.append(course)
+                    queue.put_nowait(course)
+            finally:
+                queue.put_nowait(_STREAM_END)
+            return courses or None
+
+        shared = asyncio.ensure_future(self.single_flight.do(self._parse_key(text), produce))
+        getter: Optional["asyncio.Future"] = None
         try:
-            # 尝试从响应中提取JSON部分
-            json_str = response.strip()
-            if "```json" in json_str:
-                json_str = json_str.split("```json")[1].split("```")[0].strip()
-            elif "```" in json_str:
-                json_str = json_str.split("```")[1].strip()
-            
-            courses = json.loads(json_str)
-            
-            # 验证课程数据
-            for course in courses:
-                if not isinstance(course, dict):
-                    raise ValueError("课程数据格式错误")
-                required_fields = ["weekday", "time", "course", "classroom", "teacher"]
-                for field in required_fields:
-                    if field not in course:
-                        course[field] = ""
-                    elif not isinstance(course[field], str):
-                        course[field] = str(course[field])
-            
-            return courses
-        except Exception as e:
-            logger.error(f"解析AI响应时发生错误: {str(e)}")
-            return None
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, shared}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    course = getter.result()
+                    if course is _STREAM_END:
+                        break
+                    yield course
+                elif not leader:
+                    # 合并到了进行中的相同请求
+                    for course in shared.result() or []:
+                        yield course
+                    return
+        finally:
+            if getter is not None and not getter.done():
+                getter.cancel()
+            # 提前停止消费时退出合并；只有所有调用者都离开时底层请求才会被取消
+            if not shared.done():
+                shared.cancel()
+
+    async def _parse_stream(self, text: str) -> AsyncIterator[Dict[str, Any]]:
+        """长课程表切分为多块，最多 parse_concurrency 块同时解析，按到达顺序产出并去重"""
+        chunks = split_schedule_text(text, self.parse_chunk_chars)
+        if len(chunks) <= 1:
+            async for course in self._parse_chunk_stream(text):
+                yield course
+            return
+
+        metrics.inc("kccj_ai_parse_chunks_total", len(chunks))
+        queue: "asyncio.Queue" = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.parse_concurrency)
+        done = object()
 
-    async def generate_reminder_message(self, course: Dict[str, Any]) -> str:
+        async def worker(chunk: str):
+            try:
+                async with semaphore:
+                    async for course in self._parse_chunk_stream(chunk):
+                        queue.put_nowait(course)
+            except Exception as e:
+                logger.error(f"分块解析课程表时发生错误: {str(e)}")
+            finally:
+                queue.put_nowait(done)
+
+        tasks = [asyncio.ensure_future(worker(chunk)) for chunk in chunks]
+        seen = set()
+        remaining = len(tasks)
+        try:
+            while remaining:
+                course = await queue.get()
+                if course is done:
+                    remaining -= 1
+                    continue
+                key = _course_key(course)
+                if key not in seen:
+                    seen.add(key)
+                    yield course
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def parse_course_schedule(self, text: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        使用 AI 解析课程表文本
+
+        内部使用流式接口；即使输出被截断，也会返回已完整解析出的课程。
+        """
+        return await self.single_flight.do(self._parse_key(text), lambda: self._parse_course_schedule(text))
+
+    async def _parse_course_schedule(self, text: str) -> Optional[List[Dict[str, Any]]]:
+        chunks = split_schedule_text(text, self.parse_chunk_chars)
+        if len(chunks) <= 1:
+            return await self._parse_chunk(text) or None
+
+        # 总耗时取决于最慢的一块而不是整份课程表的输出长度；结果按原文顺序合并
+        metrics.inc("kccj_ai_parse_chunks_total", len(chunks))
+        semaphore = asyncio.Semaphore(self.parse_concurrency)
+
+        async def parse(chunk: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self._parse_chunk(chunk)
+
+        parts = await asyncio.gather(*(parse(chunk) for chunk in chunks), return_exceptions=True)
+        for part in parts:
+            if isinstance(part, Exception):
+                logger.error(f"分块解析课程表时发生错误: {str(part)}")
+        return merge_courses([part for part in parts if not isinstance(part, BaseException)]) or None
+
+    async def generate_reminder_message(self, course: Dict[str, Any], deadline: Optional[datetime] = None) -> str:
         """
         生成课程提醒消息
+
+        deadline 为提醒最晚的发送时间（通常是上课时间）；来不及时直接使用模板消息。
         """
+        timeout = 30
+        if deadline is not None:
+            timeout = min(timeout, (deadline - datetime.now()).total_seconds())
+            if timeout <= 0:
+                return REMINDER_FALLBACK
+
         prompt = f"""请生成一条友好的课程提醒消息，包含以下课程信息：
 - 课程：{course['course']}
 - 时间：{course['weekday']} {course['time']}
@@ -130,5 +457,152 @@ class SiliconFlowService:
             {"role": "user", "content": prompt}
         ]
 
-        response = await self.chat_completion(messages, temperature=0.7)
-        return response if response else "课程提醒：请准时上课！" 
\ No newline at end of file
+        response = await self.chat_completion(messages, temperature=0.7, timeout=timeout)
+        return response if response else REMINDER_FALLBACK
+
+
+class OpenAICompatibleService(BaseAIService):
+    """
+    兼容 OpenAI /chat/completions 协议的服务，SiliconFlow、OpenAI、豆包（火山方舟）均属此类
+    """
+    name = "custom"
+    default_api_base = ""
+    default_model = ""
+
+    def __init__(self, api_key: str, api_base: Optional[str] = None, model: Optional[str] = None):
+        super().__init__()
+        api_base = api_base or self.default_api_base
+        model = model or self.default_model
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.model = model
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def _chat_completion(self, messages: List[Dict[str, str]], temperature: float,
+                               timeout: float) -> Optional[str]:
+        """
+        调用聊天完成 API
+        """
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with aiohttp.ClientSession() as session:
+                payload = {
+                    "model": self.model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "stream": False,
+                    "max_tokens": 1024
+                }
+                
+                async with session.post(
+                    f"{self.api_base}/chat/completions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        status = "ok"
+                        self._record_usage(result.get("usage"))
+                        return result["choices"][0]["message"]["content"]
+                    else:
+                        error_text = await response.text()
+                        logger.error(f"API调用失败: {response.status} - {error_text}")
+                        return None
+        except Exception as e:
+            logger.error(f"调用AI服务时发生错误: {str(e)}")
+            return None
+        finally:
+            metrics.observe("kccj_ai_request_seconds", time.perf_counter() - started,
+                            provider=self.name, mode="blocking", status=status)
+
+    def _record_usage(self, usage: Optional[Dict[str, Any]]):
+        if not usage:
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                metrics.inc("kccj_ai_tokens_total", usage[kind], provider=self.name, kind=kind)
+
+    async def chat_completion_stream(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                                     max_tokens: int = 4096) -> AsyncIterator[str]:
+        """
+        以流式（SSE）方式调用聊天完成 API，逐段产出模型输出的文本
+        """
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async with aiohttp.ClientSession() as session:
+                payload = {
+                    "model": self.model,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "stream": True,
+                    "max_tokens": max_tokens,
+                    "stream_options": {"include_usage": True}
+                }
+
+                async with session.post(
+                    f"{self.api_base}/chat/completions",
+                    headers=self.headers,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=None, sock_read=30)
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"API调用失败: {response.status} - {error_text}")
+                        return
+
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8", errors="ignore").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except ValueError:
+                            continue
+                        self._record_usage(chunk.get("usage"))
+                        choices = chunk.get("choices") or [{}]
+                        delta = choices[0].get("delta", {}).get("content")
+                        if delta:
+                            yield delta
+                        if choices[0].get("finish_reason") == "length":
+                            logger.warning("AI输出达到max_tokens上限，结果可能被截断")
+                    status = "ok"
+        except Exception as e:
+            logger.error(f"调用AI服务时发生错误: {str(e)}")
+        finally:
+            metrics.observe("kccj_ai_request_seconds", time.perf_counter() - started,
+                            provider=self.name, mode="stream", status=status)
+
+
+class SiliconFlowService(OpenAICompatibleService):
+    name = "siliconflow"
+    default_api_base = "https://api.siliconflow.cn/v1"
+    default_model = "deepseek-ai/DeepSeek-V3"
+
+
+class OpenAIService(OpenAICompatibleService):
+    name = "openai"
+    default_api_base = "https://api.openai.com/v1"
+    default_model = "gpt-4o-mini"
+
+
+class DoubaoService(OpenAICompatibleService):
+    name = "doubao"
+    default_api_base = "https://ark.cn-beijing.volces.com/api/v3"
+    default_model = "doubao-1-5-pro-32k-250115"
+
+
+PROVIDER_CLASSES = {
+    "siliconflow": SiliconFlowService,
+    "openai": OpenAIService,
+    "doubao": DoubaoService,
+    "custom": OpenAICompatibleService,
+}
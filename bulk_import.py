@@ -0,0 +1,204 @@
+"""
+按班级批量导入课程表
+花名册（CSV/XLSX）给出 用户ID -> 班级，课程表工作簿每个工作表一个班级（或一个目录，每个班级一个
+Word/Excel 文件）。每个班级的课程表只解析、写入一次，用户文件只记录引用，按批写入
+"""
+import csv
+import logging
+import os
+import re
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import openpyxl
+
+from .parser import parse_word, parse_xlsx, parse_xlsx_sheets
+from .metrics import metrics
+from .storage import ScheduleStore
+
+logger = logging.getLogger(__name__)
+
+# 花名册表头 -> 字段，大小写与前后空白不敏感
+ROSTER_COLUMNS = {
+    "user_id": "user_id", "userid": "user_id", "qq": "user_id", "用户id": "user_id", "qq号": "user_id",
+    "class": "class_code", "class_code": "class_code", "班级": "class_code", "班级代码": "class_code",
+    "group_id": "group_id", "群号": "group_id",
+}
+
+BATCH_SIZE = 500
+
+# 用户ID与群号都是QQ号，只允许数字，也避免拼接文件路径时出现 "../" 之类的内容
+ID_PATTERN = re.compile(r"[0-9]{1,20}")
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.classes: Dict[str, int] = {}  # 班级 -> 导入人数
+        self.schedules = 0  # 写入的不同课程表数
+        self.errors: List[Tuple[int, str, str]] = []  # (行号, 用户ID, 原因)
+        self.elapsed = 0.0
+
+    def error(self, row: int, user_id: str, reason: str):
+        self.errors.append((row, user_id, reason))
+
+    def summary(self, max_errors: int = 10) -> str:
+        lines = [
+            f"📥 批量导入完成：共 {self.rows} 行，成功 {self.imported} 人，失败 {len(self.errors)} 行，"
+            f"{len(self.classes)} 个班级 / {self.schedules} 份不同课程表，耗时 {self.elapsed:.2f}s"
+        ]
+        for row, user_id, reason in self.errors[:max_errors]:
+            lines.append(f"• 第{row}行 {user_id or '-'}：{reason}")
+        if len(self.errors) > max_errors:
+            lines.append(f"……其余 {len(self.errors) - max_errors} 条错误见错误报告文件")
+        return "\n".join(lines)
+
+    def write_errors(self, path: str) -> Optional[str]:
+        if not self.errors:
+            return None
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["行号", "用户ID", "原因"])
+            writer.writerows(self.errors)
+        return path
+
+
+def _iter_rows(path: str) -> Iterator[List[str]]:
+    """逐行读取花名册，不把整个文件载入内存"""
+    ext = os.path.splitext(path)[-1].lower()
+    if ext == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.reader(f):
+                yield [cell.strip() for cell in row]
+    elif ext in (".xlsx", ".xlsm"):
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            for row in wb.active.iter_rows(values_only=True):
+                yield [_cell_text(cell) for cell in row]
+        finally:
+            wb.close()
+    else:
+        raise ValueError(f"不支持的花名册格式：{ext}，请使用 CSV 或 XLSX")
+
+
+def _cell_text(cell: Any) -> str:
+    if cell is None:
+        return ""
+    # Excel 中的QQ号常被存为数字
+    if isinstance(cell, float) and cell.is_integer():
+        return str(int(cell))
+    return str(cell).strip()
+
+
+def iter_roster(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """返回 (行号, {user_id, class_code[, group_id]})，第一行必须是表头"""
+    rows = _iter_rows(path)
+    header = next(rows, None)
+    if not header:
+        raise ValueError("花名册为空")
+    columns = [ROSTER_COLUMNS.get(name.strip().lower()) for name in header]
+    if "user_id" not in columns or "class_code" not in columns:
+        raise ValueError("花名册表头需要包含 user_id（或 QQ/用户ID）与 class（或 班级）两列")
+    for row_number, row in enumerate(rows, start=2):
+        if not any(row):
+            continue
+        yield row_number, {
+            field: row[i] for i, field in enumerate(columns) if field and i < len(row) and row[i]
+        }
+
+
+def load_timetables(path: str) -> Dict[str, List[Dict]]:
+    """
+    读取班级课程表：XLSX 工作簿每个工作表对应一个班级（工作表名即班级代码），
+    或一个目录，其中每个 Word/Excel 文件对应一个班级（文件名即班级代码）
+    """
+    if os.path.isdir(path):
+        result = {}
+        for fname in sorted(os.listdir(path)):
+            class_code, ext = os.path.splitext(fname)
+            ext = ext.lower()
+            file_path = os.path.join(path, fname)
+            if ext in (".docx", ".doc"):
+                result[class_code.strip()] = parse_word(file_path)
+            elif ext in (".xlsx", ".xls"):
+                result[class_code.strip()] = parse_xlsx(file_path)
+        return result
+    if os.path.splitext(path)[-1].lower() in (".xlsx", ".xlsm"):
+        return parse_xlsx_sheets(path)
+    raise ValueError("课程表需要是每个班级一个工作表的 XLSX 工作簿，或每个班级一个文件的目录")
+
+
+def import_roster(store: ScheduleStore, roster_path: str, timetable_path: str,
+                  enable_reminders: bool = False,
+                  convert: Optional[Callable[[Dict], Dict]] = None,
+                  batch_size: int = BATCH_SIZE) -> ImportReport:
+    """
+    批量导入。convert 可以把解析结果转换为存储使用的课程格式；
+    enable_reminders 为 True 时直接为导入的用户开启提醒，否则保留用户原有设置。
+    在线程池中运行时应传入单独的 ScheduleStore 实例，存储实例的缓存不是线程安全的
+    """
+    report = ImportReport()
+    started = time.perf_counter()
+
+    digests: Dict[str, Optional[str]] = {}
+    for class_code, courses in load_timetables(timetable_path).items():
+        if not courses:
+            digests[class_code] = None
+            continue
+        digests[class_code] = store.put_schedule([convert(c) for c in courses] if convert else courses)
+    report.schedules = len({d for d in digests.values() if d})
+
+    seen = set()
+    batch: List[Tuple[str, str, Dict[str, Any]]] = []
+    for row_number, row in iter_roster(roster_path):
+        report.rows += 1
+        user_id = row.get("user_id", "")
+        class_code = row.get("class_code", "")
+        if not user_id:
+            report.error(row_number, "", "缺少用户ID")
+            continue
+        if not ID_PATTERN.fullmatch(user_id):
+            report.error(row_number, user_id, "用户ID只能包含数字")
+            continue
+        if row.get("group_id") and not ID_PATTERN.fullmatch(row["group_id"]):
+            report.error(row_number, user_id, "群号只能包含数字")
+            continue
+        if user_id in seen:
+            report.error(row_number, user_id, "用户ID重复，已忽略该行")
+            continue
+        if not class_code:
+            report.error(row_number, user_id, "缺少班级")
+            continue
+        if class_code not in digests:
+            report.error(row_number, user_id, f"找不到班级 {class_code} 的课程表")
+            continue
+        if digests[class_code] is None:
+            report.error(row_number, user_id, f"班级 {class_code} 的课程表为空或解析失败")
+            continue
+        seen.add(user_id)
+
+        fields: Dict[str, Any] = {}
+        if enable_reminders:
+            fields["reminder_enabled"] = True
+        if row.get("group_id"):
+            fields["group_id"] = row["group_id"]
+        batch.append((user_id, digests[class_code], fields))
+        report.classes[class_code] = report.classes.get(class_code, 0) + 1
+        if len(batch) >= batch_size:
+            report.imported += _flush(store, batch)
+    report.imported += _flush(store, batch)
+
+    report.elapsed = time.perf_counter() - started
+    metrics.inc("kccj_import_users_total", report.imported)
+    logger.info(f"批量导入完成：{report.imported}/{report.rows}，{len(report.errors)} 行错误")
+    return report
+
+
+def _flush(store: ScheduleStore, batch: List[Tuple[str, str, Dict[str, Any]]]) -> int:
+    if not batch:
+        return 0
+    with metrics.timer("kccj_storage_seconds", op="bulk_write"):
+        count = store.assign_schedules(batch)
+    batch.clear()
+    return count
@@ -0,0 +1,293 @@
+"""
+Word 课程表流式解析
+直接从 .docx 压缩包中增量解析 word/document.xml，不构建完整的文档对象：每处理完一个顶层段落或表格
+就把它从树上移除，内存占用与文档大小无关；课程边解析边产出。
+
+支持两种表格：
+- 列表式：每行一门课程，按表头（课程/时间/教室/教师/星期/周次）识别列，无表头时按
+  课程名 | 时间 | 教室 | 教师 的固定顺序
+- 网格式：表头为星期，每行一个节次，单元格内是课程信息；横向合并（gridSpan）按所覆盖的列处理，
+  纵向合并（vMerge）的连堂课合并为一门课程，节次范围取所跨的各行
+"""
+import re
+import zipfile
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_BODY, _TBL, _TR, _TC, _P = W + "body", W + "tbl", W + "tr", W + "tc", W + "p"
+_T, _TAB, _BR, _CR = W + "t", W + "tab", W + "br", W + "cr"
+_GRID_SPAN, _V_MERGE, _GRID_BEFORE, _VAL = W + "gridSpan", W + "vMerge", W + "gridBefore", W + "val"
+
+WEEKDAY_HEADER = re.compile(r"^(?:星期|周)?([一二三四五六日天])$")
+WEEKS_PATTERN = re.compile(r"\d+(?:\s*[-~至]\s*\d+)?(?:\s*[,，]\s*\d+(?:\s*[-~至]\s*\d+)?)*\s*周(?:\s*[（(]?[单双][）)]?)?")
+ROOM_MARKERS = re.compile(r"[楼室馆厅场]|\d")
+TEACHER_MARKERS = re.compile(r"老师|教师|教授")
+CLOCK_PATTERN = re.compile(r"\d{1,2}[:：]\d{2}")
+CHINESE_NUMBERS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9,
+                   "十": 10, "十一": 11, "十二": 12, "十三": 13}
+
+# 列表式表头关键词 -> 字段
+LIST_HEADERS = (
+    ("course", ("课程", "科目")),
+    ("time", ("时间", "节次")),
+    ("classroom", ("教室", "地点", "上课地点")),
+    ("teacher", ("教师", "老师", "任课")),
+    ("weekday", ("星期",)),
+    ("weeks", ("周次",)),
+)
+LEGACY_COLUMNS = {"course": 0, "time": 1, "classroom": 2, "teacher": 3}
+
+# 单元格内带标签的字段，如 "教师：张三"
+CELL_LABELS = (
+    ("teacher", ("教师", "老师", "任课教师")),
+    ("classroom", ("教室", "地点", "上课地点")),
+    ("weeks", ("周次",)),
+)
+
+
+class _Cell:
+    __slots__ = ("paragraphs", "span", "vmerge")
+
+    def __init__(self):
+        self.paragraphs: List[str] = []
+        self.span = 1
+        self.vmerge: Optional[str] = None  # None / "restart" / "continue"
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.paragraphs).strip()
+
+
+def _normalize_weekday(text: str) -> Optional[str]:
+    m = WEEKDAY_HEADER.match(re.sub(r"\s+", "", text))
+    return "周" + m.group(1).replace("天", "日") if m else None
+
+
+def section_range(label: str) -> Optional[Tuple[int, int]]:
+    """从节次列的文字（"第1-2节"、"1\n2"、"第一节" 等）取出节次范围，忽略其中的钟点时间"""
+    label = CLOCK_PATTERN.sub("", label)
+    numbers = [int(n) for n in re.findall(r"\d+", label)]
+    if not numbers:
+        numbers = [CHINESE_NUMBERS[n] for n in re.findall(r"十[一二三]?|[一二三四五六七八九]", label)]
+    if not numbers:
+        return None
+    return min(numbers), max(numbers)
+
+
+def format_sections(start: int, end: int) -> str:
+    return f"第{start}-{end}节" if end > start else f"第{start}节"
+
+
+def parse_cell_courses(text: str) -> List[Dict[str, str]]:
+    """
+    网格单元格中的课程：空行分隔多门课程（如单双周不同的课），每门课程第一项为课程名，
+    其余各项按标签或形态识别为教师、教室、周次
+    """
+    courses = []
+    for block in re.split(r"\n\s*\n", text):
+        tokens = [t.strip() for line in block.splitlines()
+                  for t in re.split(r"[◇@;；\t]+|\s{2,}", line) if t.strip()]
+        if not tokens:
+            continue
+        course = {"course": tokens[0], "classroom": "", "teacher": "", "weeks": ""}
+        for token in tokens[1:]:
+            for field, labels in CELL_LABELS:
+                m = re.match(rf"(?:{'|'.join(labels)})\s*[:：]\s*(.*)", token)
+                if m:
+                    course[field] = m.group(1).strip()
+                    break
+            else:
+                if not course["weeks"] and WEEKS_PATTERN.search(token):
+                    course["weeks"] = token.strip("[]【】()（）")
+                elif not course["classroom"] and ROOM_MARKERS.search(token) and not TEACHER_MARKERS.search(token):
+                    course["classroom"] = token
+                elif not course["teacher"]:
+                    course["teacher"] = token
+        courses.append(course)
+    return courses
+
+
+class _TableState:
+    """逐行处理一个顶层表格，第一行有效内容决定表格类型"""
+    def __init__(self):
+        self.layout: Optional[str] = None  # "list" / "grid"
+        self.columns: Dict[str, int] = {}
+        self.weekdays: Dict[int, str] = {}
+        self.above: List[str] = []  # 每一网格列最近一个非续接单元格的文字，供 vMerge 续接使用
+        self.pending: Dict[int, List] = {}  # 网格列 -> [星期, 起始节, 结束节, 文字]
+        self.last_section = 0
+
+    def _expand(self, cells: List[_Cell], before: int) -> List[Tuple[str, bool, int]]:
+        """按 gridSpan 展开为网格列，返回 (文字, 是否为纵向续接, 所属单元格序号)"""
+        columns: List[Tuple[str, bool, int]] = [("", False, -1)] * before
+        for index, cell in enumerate(cells):
+            for _ in range(max(1, cell.span)):
+                col = len(columns)
+                if cell.vmerge == "continue":
+                    columns.append((self.above[col] if col < len(self.above) else "", True, index))
+                else:
+                    columns.append((cell.text, False, index))
+        self.above = [text for text, _, _ in columns]
+        return columns
+
+    def add_row(self, cells: List[_Cell], before: int = 0) -> Iterator[Dict[str, str]]:
+        columns = self._expand(cells, before)
+        texts = [text for text, _, _ in columns]
+        if self.layout is None:
+            self._detect(texts, cells)
+            return
+        if self.layout == "list":
+            yield from self._list_row(texts)
+        elif self.layout == "grid":
+            yield from self._grid_row(columns)
+
+    def _detect(self, texts: List[str], cells: List[_Cell]):
+        weekdays = {i: day for i, day in ((i, _normalize_weekday(t)) for i, t in enumerate(texts)) if day}
+        if len(set(weekdays.values())) >= 2:
+            self.layout, self.weekdays = "grid", weekdays
+            return
+        columns = {}
+        for i, text in enumerate(texts):
+            for field, keywords in LIST_HEADERS:
+                if field not in columns and any(k in text for k in keywords):
+                    columns[field] = i
+                    break
+        if "course" in columns and len(columns) >= 2:
+            self.layout, self.columns = "list", columns
+        elif len(cells) <= 1:
+            return  # 整行合并的标题行，继续看下一行
+        else:
+            # 旧格式：没有可识别的表头，第一行视为表头，按固定列顺序解析
+            self.layout, self.columns = "list", dict(LEGACY_COLUMNS)
+
+    def _list_row(self, texts: List[str]) -> Iterator[Dict[str, str]]:
+        def get(field: str) -> str:
+            i = self.columns.get(field)
+            return texts[i] if i is not None and i < len(texts) else ""
+
+        if not any(texts) or (self.columns == LEGACY_COLUMNS and len(texts) < 4):
+            return
+        course, time_str = get("course"), get("time")
+        if not course:
+            return
+        weekday = _normalize_weekday(get("weekday")) if "weekday" in self.columns else None
+        if weekday is None:
+            m = re.search(r"(?:周|星期)([一二三四五六日天])", time_str)
+            weekday = "周" + m.group(1).replace("天", "日") if m else ""
+        result = {
+            "weekday": weekday,
+            "time": time_str,
+            "course": course,
+            "classroom": get("classroom"),
+            "teacher": get("teacher"),
+        }
+        if "weeks" in self.columns:
+            result["weeks"] = get("weeks")
+        yield result
+
+    def _grid_row(self, columns: List[Tuple[str, bool, int]]) -> Iterator[Dict[str, str]]:
+        label = " ".join(text for i, (text, _, _) in enumerate(columns) if i not in self.weekdays and text)
+        sections = section_range(label)
+        if sections is None:
+            day_cells = {columns[i][2] for i in self.weekdays if i < len(columns) and columns[i][0]}
+            if len(day_cells) <= 1 and len(self.weekdays) > 1:
+                # 午休等整行合并的分隔行，不属于任何节次，连堂到此中断
+                yield from self.finish()
+                return
+            sections = (self.last_section + 1, self.last_section + 1)
+        self.last_section = sections[1]
+
+        seen = set()
+        for i, weekday in self.weekdays.items():
+            if i >= len(columns):
+                yield from self._flush(i)
+                continue
+            text, continued, cell_index = columns[i]
+            # 横向合并的单元格在同一星期下只处理一次
+            if (cell_index, weekday) in seen:
+                continue
+            seen.add((cell_index, weekday))
+            pending = self.pending.get(i)
+            if continued and pending is not None:
+                pending[2] = sections[1]
+                continue
+            yield from self._flush(i)
+            if text:
+                self.pending[i] = [weekday, sections[0], sections[1], text]
+
+    def _flush(self, column: int) -> Iterator[Dict[str, str]]:
+        pending = self.pending.pop(column, None)
+        if pending is None:
+            return
+        weekday, start, end, text = pending
+        for course in parse_cell_courses(text):
+            yield {"weekday": weekday, "time": format_sections(start, end), **course}
+
+    def finish(self) -> Iterator[Dict[str, str]]:
+        for column in sorted(self.pending):
+            yield from self._flush(column)
+
+
+def iter_word_courses(file_path: str) -> Iterator[Dict[str, str]]:
+    """逐个产出 .docx 中所有顶层表格里的课程；嵌套表格的文字并入外层单元格"""
+    with zipfile.ZipFile(file_path) as zf, zf.open("word/document.xml") as f:
+        body = None
+        level = 0
+        depth = 0  # 表格嵌套深度
+        table: Optional[_TableState] = None
+        row: Optional[List[_Cell]] = None
+        before = 0
+        cell: Optional[_Cell] = None
+        runs: List[str] = []
+        for event, elem in ElementTree.iterparse(f, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                level += 1
+                if tag == _BODY:
+                    body = elem
+                elif tag == _TBL:
+                    depth += 1
+                    if depth == 1:
+                        table = _TableState()
+                elif depth == 1:
+                    if tag == _TR:
+                        row, before = [], 0
+                    elif tag == _TC:
+                        cell = _Cell()
+                continue
+
+            level -= 1
+            if tag == _TBL:
+                if depth == 1 and table is not None:
+                    yield from table.finish()
+                    table = None
+                depth -= 1
+            elif cell is not None:
+                if tag == _T:
+                    runs.append(elem.text or "")
+                elif tag == _TAB:
+                    runs.append(" ")
+                elif tag in (_BR, _CR):
+                    runs.append("\n")
+                elif tag == _P:
+                    cell.paragraphs.append("".join(runs))
+                    runs = []
+                elif depth == 1 and tag == _GRID_SPAN:
+                    cell.span = int(elem.get(_VAL, "1") or 1)
+                elif depth == 1 and tag == _V_MERGE:
+                    cell.vmerge = "restart" if elem.get(_VAL) == "restart" else "continue"
+                elif depth == 1 and tag == _TC:
+                    row.append(cell)
+                    cell = None
+            elif tag == _P:
+                runs = []
+            elif depth == 1 and tag == _GRID_BEFORE and row is not None:
+                before = int(elem.get(_VAL, "0") or 0)
+            elif depth == 1 and tag == _TR and row is not None:
+                yield from table.add_row(row, before)
+                row = None
+
+            # 顶层段落/表格处理完后从树上移除，保持内存占用平稳
+            if level == 2 and body is not None:
+                body.remove(elem)
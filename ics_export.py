@@ -0,0 +1,292 @@
+"""
+iCalendar (.ics) 课程表导出
+按周重复的课程生成 RRULE，周次来自课程的"周次"字段，节次时间按作息表换算。
+导出文件以课程表内容与导出设置的哈希命名（即 ETag），同一份课程表只生成一次，
+同班同学与重复请求直接复用已生成的文件
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .scheduler import SECTION_TIMES, WEEKDAY_MAP
+from .storage import ScheduleStore, canonical_course, normalize_schedule, schedule_hash
+
+logger = logging.getLogger(__name__)
+
+# 导出格式变化时递增，使旧缓存失效
+ICS_FORMAT_VERSION = 1
+# 每节课时长（分钟），作息表只记录每节的开始时间
+CLASS_MINUTES = 45
+TIMEZONE = "Asia/Shanghai"
+
+VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    f"TZID:{TIMEZONE}",
+    "BEGIN:STANDARD",
+    "DTSTART:19700101T000000",
+    "TZOFFSETFROM:+0800",
+    "TZOFFSETTO:+0800",
+    "TZNAME:CST",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+def _field(course: Dict[str, Any], *names: str) -> str:
+    for name in names:
+        value = course.get(name)
+        if value:
+            return str(value)
+    return ""
+
+
+def _weekday_index(course: Dict[str, Any]) -> Optional[int]:
+    weekday = _field(course, "weekday", "day")
+    if not weekday:
+        return None
+    return WEEKDAY_MAP.get("周" + weekday[-1].replace("天", "日"))
+
+
+def resolve_course_times(time_str: str) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    """
+    上课的开始与结束时间 ((时, 分), (时, 分))：优先使用写明的"08:00-09:40"，
+    否则按"第1-2节"查作息表，结束时间为最后一节开始后 CLASS_MINUTES 分钟
+    """
+    m = re.search(r"(\d{1,2})[:：](\d{2})\s*[-~至]\s*(\d{1,2})[:：](\d{2})", time_str)
+    if m:
+        h1, m1, h2, m2 = map(int, m.groups())
+        return (h1, m1), (h2, m2)
+    m = re.search(r"(\d+)(?:\s*-\s*(\d+))?\s*节", time_str)
+    if not m:
+        return None
+    first = int(m.group(1))
+    last = int(m.group(2) or first)
+    if first not in SECTION_TIMES or last not in SECTION_TIMES:
+        return None
+    start = datetime.strptime(SECTION_TIMES[first], "%H:%M")
+    end = datetime.strptime(SECTION_TIMES[last], "%H:%M") + timedelta(minutes=CLASS_MINUTES)
+    return (start.hour, start.minute), (end.hour, end.minute)
+
+
+def parse_weeks(weeks_str: str, default_weeks: int) -> List[int]:
+    """
+    "1-16周"、"1-8,10-16周"、"1-15周(单)"、"2,4,6周" 等写法转换为周次列表；
+    无法识别时视为第 1 周到第 default_weeks 周
+    """
+    text = (weeks_str or "").replace("，", ",").replace("、", ",")
+    odd = "单" in text
+    even = "双" in text
+    weeks = set()
+    for a, b in re.findall(r"(\d+)(?:\s*[-~至]\s*(\d+))?", text):
+        start, end = int(a), int(b or a)
+        weeks.update(range(min(start, end), max(start, end) + 1))
+    if not weeks:
+        weeks = set(range(1, default_weeks + 1))
+    if odd and not even:
+        weeks = {w for w in weeks if w % 2 == 1}
+    elif even and not odd:
+        weeks = {w for w in weeks if w % 2 == 0}
+    return sorted(w for w in weeks if w > 0)
+
+
+def week_runs(weeks: List[int]) -> List[Tuple[int, int, int]]:
+    """把周次列表切分为等差的连续段 (起始周, 间隔, 次数)，每段对应一条 RRULE"""
+    runs = []
+    i = 0
+    while i < len(weeks):
+        start = weeks[i]
+        step = weeks[i + 1] - start if i + 1 < len(weeks) and weeks[i + 1] - start in (1, 2) else 1
+        count = 1
+        while i + count < len(weeks) and weeks[i + count] - weeks[i + count - 1] == step:
+            count += 1
+        runs.append((start, step, count))
+        i += count
+    return runs
+
+
+def _write_text(path: str, text: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _escape(text: str) -> str:
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> str:
+    """按 RFC 5545 每行不超过 75 个字节折行"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts, current, size = [], "", 0
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += ch
+        size += n
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def build_ics(courses: List[Any], semester_start: date, default_weeks: int = 16,
+              alarm_minutes: int = 0, name: str = "课程表") -> str:
+    """生成完整的 VCALENDAR 文本；无法识别星期或上课时间的课程会被跳过"""
+    monday = semester_start - timedelta(days=semester_start.weekday())
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//kccj//course reminder//CN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_escape(name)}",
+        f"X-WR-TIMEZONE:{TIMEZONE}",
+    ] + VTIMEZONE
+
+    for raw in courses:
+        course = canonical_course(raw)
+        weekday = _weekday_index(course)
+        times = resolve_course_times(_field(course, "time"))
+        if weekday is None or times is None:
+            continue
+        (sh, sm), (eh, em) = times
+        title = _field(course, "course", "name")
+        location = _field(course, "classroom", "location")
+        teacher = _field(course, "teacher")
+        for first_week, step, count in week_runs(parse_weeks(_field(course, "weeks"), default_weeks)):
+            day = monday + timedelta(days=(first_week - 1) * 7 + weekday)
+            start = datetime(day.year, day.month, day.day, sh, sm)
+            end = datetime(day.year, day.month, day.day, eh, em)
+            uid = hashlib.sha1(
+                f"{weekday}|{course.get('time')}|{title}|{first_week}".encode("utf-8")
+            ).hexdigest()
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{uid}@kccj",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;TZID={TIMEZONE}:{start.strftime('%Y%m%dT%H%M%S')}",
+                f"DTEND;TZID={TIMEZONE}:{end.strftime('%Y%m%dT%H%M%S')}",
+                f"SUMMARY:{_escape(title)}",
+            ]
+            if count > 1:
+                lines.append(f"RRULE:FREQ=WEEKLY;INTERVAL={step};COUNT={count}")
+            if location:
+                lines.append(f"LOCATION:{_escape(location)}")
+            if teacher:
+                lines.append(f"DESCRIPTION:{_escape('教师：' + teacher)}")
+            if alarm_minutes > 0:
+                lines += [
+                    "BEGIN:VALARM",
+                    "ACTION:DISPLAY",
+                    f"DESCRIPTION:{_escape(title)}",
+                    f"TRIGGER:-PT{alarm_minutes}M",
+                    "END:VALARM",
+                ]
+            lines.append("END:VEVENT")
+
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+
+class IcsExporter:
+    """
+    以 (课程表内容, 导出设置) 的哈希为 ETag 缓存导出结果：
+        <out_dir>/<etag>.ics          按内容命名的导出文件，同一份课程表的用户共用
+        <out_dir>/users/<token>.ics   每个用户固定的订阅文件名，内容变化时才更新
+        <out_dir>/subscribers.json    导出过日历的用户，课程表变化后由 refresh 更新其订阅文件
+    token 由用户ID与本地密钥派生，订阅地址不会暴露用户ID
+    """
+    def __init__(self, store: ScheduleStore, out_dir: str, semester_start: date,
+                 default_weeks: int = 16, alarm_minutes: int = 0):
+        self.store = store
+        self.out_dir = out_dir
+        self.users_dir = os.path.join(out_dir, "users")
+        os.makedirs(self.users_dir, exist_ok=True)
+        self.semester_start = semester_start
+        self.default_weeks = default_weeks
+        self.alarm_minutes = alarm_minutes
+        self._settings = f"{ICS_FORMAT_VERSION}|{semester_start.isoformat()}|{default_weeks}|{alarm_minutes}"
+        self._secret = self._load_secret()
+        self._subscribers_path = os.path.join(out_dir, "subscribers.json")
+        self._user_etags: Dict[str, str] = {}
+
+    def _load_secret(self) -> bytes:
+        path = os.path.join(self.out_dir, ".secret")
+        if not os.path.exists(path):
+            _write_text(path, os.urandom(16).hex())
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip().encode("utf-8")
+
+    def _read_subscribers(self) -> Set[str]:
+        if not os.path.exists(self._subscribers_path):
+            return set()
+        try:
+            with open(self._subscribers_path, "r", encoding="utf-8") as f:
+                return set(json.load(f))
+        except Exception as e:
+            logger.error(f"读取日历订阅列表失败: {str(e)}")
+            return set()
+
+    def subscription_name(self, user_id: str) -> str:
+        token = hashlib.blake2b(str(user_id).encode("utf-8"), key=self._secret, digest_size=12).hexdigest()
+        return f"{token}.ics"
+
+    def etag(self, user_id: str) -> Optional[str]:
+        """只读取用户文件中的课程表引用即可得到，不需要解析课程"""
+        ref = self.store.schedule_ref(user_id)
+        if ref is None:
+            data = self.store.load_user(user_id)
+            if not data or not data.get("courses"):
+                return None
+            ref = schedule_hash(normalize_schedule(data["courses"]))
+        return hashlib.sha256(f"{ref}|{self._settings}".encode("utf-8")).hexdigest()[:20]
+
+    def export(self, user_id: str) -> Optional[str]:
+        """返回用户的订阅文件路径；没有课程表时返回 None"""
+        etag = self.etag(user_id)
+        if etag is None:
+            return None
+        path = os.path.join(self.out_dir, f"{etag}.ics")
+        if not os.path.exists(path):
+            data = self.store.load_user(user_id) or {}
+            _write_text(path, build_ics(
+                data.get("courses", []), self.semester_start, self.default_weeks, self.alarm_minutes
+            ))
+            logger.info(f"已生成日历文件 {etag}.ics")
+        user_path = os.path.join(self.users_dir, self.subscription_name(user_id))
+        if self._user_etags.get(user_id) != etag or not os.path.exists(user_path):
+            # 订阅文件是内容文件的硬链接，不支持硬链接时复制
+            tmp_path = f"{user_path}.{os.getpid()}.tmp"
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                    dst.write(src.read())
+            os.replace(tmp_path, user_path)
+            self._user_etags[user_id] = etag
+        subscribers = self._read_subscribers()
+        if user_id not in subscribers:
+            _write_text(self._subscribers_path, json.dumps(sorted(subscribers | {user_id})))
+        return user_path
+
+    def refresh(self, user_ids: Optional[Iterable[str]] = None):
+        """
+        课程表变化后更新导出过日历的用户（默认全部）的订阅文件；
+        课程表内容没有变化的用户只读取用户文件，不会重新生成
+        """
+        subscribers = self._read_subscribers()
+        if user_ids is not None:
+            subscribers &= set(user_ids)
+        for user_id in sorted(subscribers):
+            try:
+                self.export(user_id)
+            except Exception as e:
+                logger.error(f"更新用户 {user_id} 的日历失败: {str(e)}")
@@ -0,0 +1,601 @@
+"""
+离线压测工具
+用假的 OneBot Bot 与本地桩 AI/OCR 服务驱动 handle_message 与提醒分发循环，
+统计消息吞吐量、群聊闲聊消息的处理开销、提醒送达延迟分位数、内存增长与事件循环延迟，不需要真实的 QQ 流量与大模型额度。
+AstrBot 插件（KCCJPlugin）同样用假的 Context 驱动一遍，覆盖 Context.send_message 的发送路径。
+
+    python -m kccj.loadtest --users 2000 --ai-share 0.1 --ai-latency-ms 200 --ai-error-rate 0.05
+
+--max-p99-lateness-ms / --max-loop-lag-ms 超出时以非零状态退出，可直接放进 CI；
+群聊闲聊消息得到回复或触发了AI请求时同样以非零状态退出。
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from .ai_router import create_ai_service
+from .metrics import metrics
+from .scheduler import LocalClaims, ReminderDispatcher
+from .storage import ScheduleStore
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# ---------- 桩服务 ----------
+def _stub_courses(text: str) -> List[Dict[str, str]]:
+    """桩模型的"解析"结果：每一行带星期的文本返回一门课程"""
+    courses = []
+    for line in text.splitlines():
+        weekday = re.search(r"周[一二三四五六日]", line)
+        if not weekday:
+            continue
+        section = re.search(r"第?\d+-\d+节", line)
+        courses.append({
+            "weekday": weekday.group(0),
+            "time": section.group(0) if section else "",
+            "course": "桩课程",
+            "classroom": "桩教室",
+            "teacher": "桩老师"
+        })
+    return courses
+
+
+class StubAIServer:
+    """
+    兼容 /chat/completions（普通与 SSE 流式）以及 OCR 接口的本地桩服务，
+    可配置响应延迟、抖动与错误率（随机返回 429/500）
+    """
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 50, error_rate: float = 0.0,
+                 ocr_text: str = "", seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.ocr_text = ocr_text
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat)
+        app.router.add_post("/ocr", self._ocr)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _delay(self) -> Optional[web.Response]:
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            status = self._random.choice((429, 500))
+            return web.Response(status=status, text="stub error")
+        return None
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        error = await self._delay()
+        if error is not None:
+            return error
+        prompt = payload["messages"][-1]["content"]
+        if "课程表文本：" in prompt:
+            text = prompt.split("课程表文本：", 1)[1].split("请确保返回的是合法的JSON格式", 1)[0]
+            content = json.dumps(_stub_courses(text), ensure_ascii=False)
+        else:
+            content = "📚 同学你好，马上要上课啦，记得提前到教室哦！"
+        usage = {"prompt_tokens": len(prompt), "completion_tokens": len(content)}
+
+        if not payload.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": content}}], "usage": usage})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(content), 16):
+            chunk = {"choices": [{"delta": {"content": content[i:i + 16]}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _ocr(self, request: web.Request) -> web.Response:
+        error = await self._delay()
+        if error is not None:
+            return error
+        return web.json_response({"text": self.ocr_text})
+
+
+# ---------- 假的 OneBot 对象 ----------
+class FakeSegment:
+    def __init__(self, type_: str, data: Optional[Dict[str, Any]] = None):
+        self.type = type_
+        self.data = data or {}
+
+
+class FakeEvent:
+    def __init__(self, user_id: str, text: str, group_id: Optional[str] = None):
+        self.user_id = user_id
+        self.text = text
+        if group_id:
+            self.group_id = int(group_id)
+
+    def get_user_id(self) -> str:
+        return self.user_id
+
+    def get_plaintext(self) -> str:
+        return self.text
+
+    def get_message(self) -> List[FakeSegment]:
+        return [FakeSegment("text", {"text": self.text})]
+
+
+class FakeBot:
+    """记录每条发出的消息 (类型, 目标, 完成时刻)，可模拟发送延迟"""
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.sent: List[Tuple[str, str, float]] = []
+
+    async def _deliver(self, kind: str, target: Any):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((kind, str(target), time.perf_counter()))
+
+    async def send(self, event: FakeEvent, message: Any):
+        await self._deliver("reply", event.get_user_id())
+
+    async def send_private_msg(self, user_id: Any, message: Any):
+        await self._deliver("private", user_id)
+
+    async def send_group_msg(self, group_id: Any, message: Any):
+        await self._deliver("group", group_id)
+
+    async def call_api(self, api: str, **kwargs):
+        await self._deliver(api, kwargs.get("user_id") or kwargs.get("group_id"))
+
+
+class FakeAstrEvent:
+    """AstrBot 消息事件的替身，只实现插件用到的属性与方法"""
+    def __init__(self, user_id: str, text: str, group_id: Optional[str] = None):
+        self.user_id = user_id
+        self.group_id = group_id
+        self.message_str = text
+        self.message_obj = SimpleNamespace(message=[FakeSegment("plain", {"text": text})])
+        kind = f"GroupMessage:{group_id}" if group_id else f"FriendMessage:{user_id}"
+        self.unified_msg_origin = f"aiocqhttp:{kind}"
+        self.stopped = False
+
+    def get_sender_id(self) -> str:
+        return self.user_id
+
+    def is_private_chat(self) -> bool:
+        return self.group_id is None
+
+    def stop_event(self):
+        self.stopped = True
+
+
+class FakeContext:
+    """AstrBot Context 的替身：send_message 记录 (会话, 完成时刻)，可模拟发送延迟"""
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.sent: List[Tuple[str, float]] = []
+
+    async def send_message(self, session: str, message_chain: Any) -> bool:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((str(session), time.perf_counter()))
+        return True
+
+
+class LoopLagSampler:
+    """周期性 sleep，记录实际唤醒时间相对预期的延迟"""
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+# ---------- 压测流程 ----------
+# 群聊中常见的闲聊消息，包含会触发子串预筛选但不是课程表的内容
+NOISE_MESSAGES = (
+    "今天食堂的饭真好吃",
+    "哈哈哈哈",
+    "下周有人一起去图书馆吗",
+    "这节课老师点名了吗",
+    "[图片]",
+    "收到",
+    # 提到星期、节次的闲聊，会通过子串预筛选，但群聊中不足以认定为课程表
+    "周五交作业",
+    "周三第3-4节在哪上课",
+    "星期一早八谁帮我签到",
+    "周末一起去图书馆吗",
+    "周二第5-6节的实验课换到周四了\n大家别走错",
+)
+
+
+def build_schedule_text(class_index: int, messy: bool) -> str:
+    """每个班级一份课程表；所有课程表都包含周一第1-2节，便于集中压测 07:30 的提醒高峰"""
+    lines = [
+        f"周一 第1-2节 高等数学{class_index} A{class_index % 50:03d} 张老师",
+        f"周二 第3-4节 大学英语{class_index} B{class_index % 30:03d} 李老师",
+        f"周四 第5-6节 程序设计{class_index} C{class_index % 20:03d} 王老师",
+    ]
+    if messy:
+        # 本地解析器无法识别的写法，会被交给桩AI
+        lines.append(f"周三第7-8节 大学物理{class_index}在D{class_index % 10:03d}上课，赵老师")
+    return "\n".join(lines)
+
+
+def _next_monday_morning() -> datetime:
+    today = datetime.now().date()
+    monday = today + timedelta(days=7 - today.weekday())
+    return datetime.combine(monday, datetime.min.time()).replace(hour=7, minute=30)
+
+
+# 插件模块（main.py），由 load_plugin 在压测目录中导入
+plugin = None
+
+
+def load_plugin(workdir: str):
+    """
+    导入插件模块。AstrBot 框架与插件在导入时会在工作目录下创建 data/ 等运行时文件，
+    因此先切换到压测目录再导入，不污染调用方的工作目录
+    """
+    global plugin
+    if plugin is None:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            plugin = importlib.import_module(".main", __package__)
+        finally:
+            os.chdir(cwd)
+    return plugin
+
+
+async def run_astrbot_frontend(workdir: str, base_url: str, server: StubAIServer, users: int, class_size: int,
+                               noise_per_user: int, send_latency_ms: float, rng: random.Random) -> Dict[str, Any]:
+    """
+    用假的 Context 驱动 AstrBot 插件：每位同学私聊发送课程表并回复"确认"，再在群里发送闲聊消息。
+    插件的数据目录是相对于工作目录的路径，运行期间切换到压测目录；插件创建的后台任务在结束时取消
+    """
+    context = FakeContext(send_latency_ms)
+    config = {
+        "ai_provider": "siliconflow",
+        "siliconflow_api_key": "stub",
+        "siliconflow_api_base": f"{base_url}/v1",
+    }
+    cwd = os.getcwd()
+    saved_report_dir = plugin.profiler.report_dir
+    existing = asyncio.all_tasks()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    astr = None
+    background = set()
+    try:
+        astr = plugin.KCCJPlugin(context, config)
+        background = asyncio.all_tasks() - existing
+
+        latencies: List[float] = []
+        for index in range(users):
+            user_id = str(20_000_000 + index)
+            for message in (build_schedule_text(index // class_size, False), "确认"):
+                started = time.perf_counter()
+                await astr.handle_message(FakeAstrEvent(user_id, message))
+                latencies.append(time.perf_counter() - started)
+        replies = len(context.sent)
+
+        context.sent.clear()
+        requests_before = server.requests
+        noise_latencies: List[float] = []
+        for index in range(users * noise_per_user):
+            event = FakeAstrEvent(str(20_000_000 + index % users), rng.choice(NOISE_MESSAGES), str(900_000))
+            started = time.perf_counter()
+            await astr.handle_message(event)
+            noise_latencies.append(time.perf_counter() - started)
+        return {
+            "messages": len(latencies),
+            "replies": replies,
+            "active_users": sum(1 for state in astr.user_state.values() if state == plugin.UserState.ACTIVE),
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "noise": {
+                "messages": len(noise_latencies),
+                "replies": len(context.sent),
+                "ai_requests": server.requests - requests_before,
+                "p50_us": percentile(noise_latencies, 0.5) * 1e6,
+                "p99_us": percentile(noise_latencies, 0.99) * 1e6,
+            },
+        }
+    finally:
+        if astr is not None:
+            await astr.terminate()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        plugin.profiler.report_dir = saved_report_dir
+        os.chdir(cwd)
+
+
+def _rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def run_loadtest(users: int = 2000, class_size: int = 40, concurrency: int = 200,
+                       ai_share: float = 0.1, group_share: float = 0.5,
+                       ai_latency_ms: float = 200, ai_jitter_ms: float = 50, ai_error_rate: float = 0.0,
+                       send_latency_ms: float = 5, noise_per_user: int = 5, astrbot_users: int = 200,
+                       trace_memory: bool = True, keep_data: bool = False, seed: int = 0) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="kccj_loadtest_")
+    load_plugin(workdir)
+    server = StubAIServer(ai_latency_ms, ai_jitter_ms, ai_error_rate, ocr_text=build_schedule_text(0, False), seed=seed)
+    base_url = await server.start()
+    bot = FakeBot(send_latency_ms)
+    sampler = LoopLagSampler()
+
+    # 把插件的全局依赖替换为压测用的实现，结束后恢复
+    saved = {name: getattr(plugin, name) for name in
+             ("schedule_store", "DATA_DIR", "ai_service", "reminder_dispatcher")}
+    saved_get_bot = plugin.nonebot.get_bot
+    saved_metrics = metrics.enabled
+    saved_ocr = plugin.CONFIG.get("ocr_api_url")
+    report: Dict[str, Any] = {"users": users}
+    try:
+        plugin.DATA_DIR = workdir
+        plugin.schedule_store = ScheduleStore(workdir)
+        plugin.ai_service = create_ai_service({
+            **plugin.CONFIG,
+            "ai_provider": "siliconflow",
+            "siliconflow_api_key": "stub",
+            "siliconflow_api_base": f"{base_url}/v1",
+        }.get)
+        plugin.CONFIG["ocr_api_url"] = f"{base_url}/ocr"
+        dispatcher = ReminderDispatcher(
+            list_users=plugin.list_user_ids,
+            load_user=plugin.load_user_data,
+            send_reminder=plugin.send_course_reminder,
+            send_summary=plugin.send_user_summary,
+            send_group_reminder=plugin.send_group_course_reminder,
+            claims=LocalClaims(),
+            group_index=plugin.schedule_store.user_groups,
+            advance_minutes=30
+        )
+        plugin.reminder_dispatcher = dispatcher
+        plugin.nonebot.get_bot = lambda *args, **kwargs: bot
+        metrics.enabled = True
+
+        if trace_memory:
+            tracemalloc.start(1)
+        memory_before = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        rss_before = _rss_kb()
+        sampler.start()
+
+        # 阶段一：每位同学发送课程表并回复"是"，两条消息都经过全部 on_message 处理器
+        handlers = [plugin.handle_message]
+        semaphore = asyncio.Semaphore(concurrency)
+        message_latencies: List[float] = []
+
+        async def simulate_user(index: int):
+            user_id = str(10_000_000 + index)
+            class_index = index // class_size
+            group_id = str(900_000 + class_index) if rng.random() < group_share else None
+            text = build_schedule_text(class_index, rng.random() < ai_share)
+            async with semaphore:
+                for message in (text, "是"):
+                    event = FakeEvent(user_id, message, group_id)
+                    started = time.perf_counter()
+                    for handler in handlers:
+                        await handler(bot, event, {})
+                    message_latencies.append(time.perf_counter() - started)
+
+        ingest_started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(i) for i in range(users)))
+        ingest_seconds = time.perf_counter() - ingest_started
+        report["ingest"] = {
+            "messages": len(message_latencies),
+            "seconds": ingest_seconds,
+            "messages_per_second": len(message_latencies) / ingest_seconds if ingest_seconds else 0.0,
+            "p50_ms": percentile(message_latencies, 0.5) * 1000,
+            "p99_ms": percentile(message_latencies, 0.99) * 1000,
+            "ai_requests": server.requests,
+            "ai_errors": server.errors,
+        }
+
+        # 阶段1.5：群聊闲聊消息，应在路由预筛选阶段直接忽略，不读取用户数据也不回复
+        bot.sent.clear()
+        requests_before = server.requests
+        noise_latencies: List[float] = []
+        for index in range(users * noise_per_user):
+            event = FakeEvent(str(10_000_000 + index % users), rng.choice(NOISE_MESSAGES), str(900_000))
+            started = time.perf_counter()
+            for handler in handlers:
+                await handler(bot, event, {})
+            noise_latencies.append(time.perf_counter() - started)
+        report["noise"] = {
+            "messages": len(noise_latencies),
+            "replies": len(bot.sent),
+            "ai_requests": server.requests - requests_before,
+            "p50_us": percentile(noise_latencies, 0.5) * 1e6,
+            "p99_us": percentile(noise_latencies, 0.99) * 1e6,
+        }
+
+        # 阶段二：周一 07:30 的提醒高峰，统计从本轮开始到每条提醒发出的延迟
+        bot.sent.clear()
+        requests_before = server.requests
+        tick_started = time.perf_counter()
+        await dispatcher.tick(_next_monday_morning())
+        tick_seconds = time.perf_counter() - tick_started
+        lateness = [t - tick_started for kind, _, t in bot.sent if kind in ("private", "group")]
+        report["reminders"] = {
+            "private": sum(1 for kind, _, _ in bot.sent if kind == "private"),
+            "group": sum(1 for kind, _, _ in bot.sent if kind == "group"),
+            "tick_seconds": tick_seconds,
+            "p50_ms": percentile(lateness, 0.5) * 1000,
+            "p95_ms": percentile(lateness, 0.95) * 1000,
+            "p99_ms": percentile(lateness, 0.99) * 1000,
+            "max_ms": max(lateness, default=0.0) * 1000,
+            "ai_requests": server.requests - requests_before,
+        }
+
+        # 阶段三：AstrBot 插件，回复经 Context.send_message 发出
+        report["astrbot"] = await run_astrbot_frontend(
+            os.path.join(workdir, "astrbot"), base_url, server, astrbot_users, class_size,
+            noise_per_user, send_latency_ms, rng
+        )
+
+        await sampler.stop()
+        memory = {"rss_growth_kb": _rss_kb() - rss_before}
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            memory.update({
+                "traced_growth_kb": (current - memory_before) / 1024,
+                "traced_peak_kb": peak / 1024,
+                "bytes_per_user": (current - memory_before) / users if users else 0,
+            })
+        report["memory"] = memory
+        report["loop_lag"] = {
+            "samples": len(sampler.samples),
+            "p50_ms": percentile(sampler.samples, 0.5) * 1000,
+            "p99_ms": percentile(sampler.samples, 0.99) * 1000,
+            "max_ms": max(sampler.samples, default=0.0) * 1000,
+        }
+        return report
+    finally:
+        await sampler.stop()
+        if tracemalloc.is_tracing() and trace_memory:
+            tracemalloc.stop()
+        for name, value in saved.items():
+            setattr(plugin, name, value)
+        plugin.nonebot.get_bot = saved_get_bot
+        plugin.CONFIG["ocr_api_url"] = saved_ocr
+        if saved_ocr is None:
+            plugin.CONFIG.pop("ocr_api_url", None)
+        metrics.enabled = saved_metrics
+        await server.stop()
+        if keep_data:
+            report["data_dir"] = workdir
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    ingest, noise, reminders = report["ingest"], report["noise"], report["reminders"]
+    astrbot, memory, lag = report["astrbot"], report["memory"], report["loop_lag"]
+    lines = [
+        f"用户数：{report['users']}",
+        f"消息处理：{ingest['messages']} 条 / {ingest['seconds']:.2f}s = {ingest['messages_per_second']:.0f} 条/s，"
+        f"p50 {ingest['p50_ms']:.1f}ms，p99 {ingest['p99_ms']:.1f}ms，AI请求 {ingest['ai_requests']}（错误 {ingest['ai_errors']}）",
+        f"闲聊消息：{noise['messages']} 条，回复 {noise['replies']} 条，AI请求 {noise['ai_requests']}，"
+        f"p50 {noise['p50_us']:.0f}µs，p99 {noise['p99_us']:.0f}µs",
+        f"提醒高峰：私聊 {reminders['private']} 条，群聊 {reminders['group']} 条，本轮 {reminders['tick_seconds']:.2f}s，"
+        f"送达延迟 p50 {reminders['p50_ms']:.0f}ms / p95 {reminders['p95_ms']:.0f}ms / "
+        f"p99 {reminders['p99_ms']:.0f}ms / max {reminders['max_ms']:.0f}ms，AI请求 {reminders['ai_requests']}",
+        f"AstrBot：{astrbot['messages']} 条消息，send_message {astrbot['replies']} 次，开启提醒 {astrbot['active_users']} 人，"
+        f"p50 {astrbot['p50_ms']:.1f}ms，p99 {astrbot['p99_ms']:.1f}ms；闲聊 {astrbot['noise']['messages']} 条，"
+        f"回复 {astrbot['noise']['replies']} 条，AI请求 {astrbot['noise']['ai_requests']}",
+        f"内存：RSS 增长 {memory['rss_growth_kb'] / 1024:.1f}MB"
+        + (f"，tracemalloc 增长 {memory['traced_growth_kb'] / 1024:.1f}MB（峰值 {memory['traced_peak_kb'] / 1024:.1f}MB，"
+           f"每用户 {memory['bytes_per_user']:.0f}B）" if "traced_growth_kb" in memory else ""),
+        f"事件循环延迟：p50 {lag['p50_ms']:.1f}ms，p99 {lag['p99_ms']:.1f}ms，max {lag['max_ms']:.1f}ms（{lag['samples']} 次采样）",
+    ]
+    if "data_dir" in report:
+        lines.append(f"压测数据保留在：{report['data_dir']}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="kccj 离线压测")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--class-size", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--ai-share", type=float, default=0.1, help="需要AI解析的课程表比例")
+    parser.add_argument("--group-share", type=float, default=0.5, help="在群里开启提醒的比例")
+    parser.add_argument("--ai-latency-ms", type=float, default=200)
+    parser.add_argument("--ai-jitter-ms", type=float, default=50)
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--send-latency-ms", type=float, default=5)
+    parser.add_argument("--noise-per-user", type=int, default=5, help="每位同学在群里发送的闲聊消息数")
+    parser.add_argument("--astrbot-users", type=int, default=200, help="通过 AstrBot 插件发送课程表的同学数")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="不跟踪内存分配（大规模压测时更快）")
+    parser.add_argument("--keep-data", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    parser.add_argument("--max-p99-lateness-ms", type=float, default=None)
+    parser.add_argument("--max-loop-lag-ms", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_loadtest(
+        users=args.users, class_size=args.class_size, concurrency=args.concurrency,
+        ai_share=args.ai_share, group_share=args.group_share,
+        ai_latency_ms=args.ai_latency_ms, ai_jitter_ms=args.ai_jitter_ms, ai_error_rate=args.ai_error_rate,
+        send_latency_ms=args.send_latency_ms, noise_per_user=args.noise_per_user, astrbot_users=args.astrbot_users,
+        trace_memory=not args.no_tracemalloc, keep_data=args.keep_data, seed=args.seed
+    ))
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+    failed = False
+    for frontend, noise in (("NoneBot", report["noise"]), ("AstrBot", report["astrbot"]["noise"])):
+        if noise["replies"] or noise["ai_requests"]:
+            print(f"{frontend} 群聊闲聊消息得到 {noise['replies']} 条回复、触发 {noise['ai_requests']} 次AI请求", file=sys.stderr)
+            failed = True
+    if args.max_p99_lateness_ms is not None and report["reminders"]["p99_ms"] > args.max_p99_lateness_ms:
+        print(f"提醒送达延迟 p99 超过 {args.max_p99_lateness_ms}ms", file=sys.stderr)
+        failed = True
+    if args.max_loop_lag_ms is not None and report["loop_lag"]["max_ms"] > args.max_loop_lag_ms:
+        print(f"事件循环最大延迟超过 {args.max_loop_lag_ms}ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+事件循环卡顿监测
+事件循环中的心跳协程每隔 interval 秒醒来一次，醒来时间比预期晚多少就是循环调度延迟；
+另一个守护线程盯着心跳，超过阈值仍未醒来时抓取事件循环线程当前的调用栈——也就是正在
+阻塞循环的同步代码（文件读写、Word/Excel 解析等），卡顿结束后连同时长一起记录
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 调用栈中属于事件循环本身的帧，展示时略去
+_LOOP_INTERNALS = (os.sep + "asyncio" + os.sep, os.sep + "selectors.py", os.sep + "threading.py")
+
+
+class Stall:
+    def __init__(self, started: datetime, duration: float, stack: List[str], site: str, task: str):
+        self.started = started
+        self.duration = duration
+        self.stack = stack
+        self.site = site  # 调用栈最内层的插件/业务代码位置
+        self.task = task
+
+    def describe(self, max_frames: int = 6) -> str:
+        lines = [f"{self.started.strftime('%m-%d %H:%M:%S')} 阻塞 {self.duration * 1000:.0f}ms"
+                 + (f"（任务 {self.task}）" if self.task else "")]
+        lines.extend(self.stack[-max_frames:] or ["（卡顿期间未抓到调用栈）"])
+        return "\n".join(lines)
+
+
+def _format_stack(frame) -> Tuple[List[str], str]:
+    """返回 (调用栈各帧描述, 最内层非事件循环代码的位置)"""
+    frames = [f for f in traceback.extract_stack(frame)
+              if not any(part in f.filename for part in _LOOP_INTERNALS)]
+    lines = [f"  {os.path.basename(f.filename)}:{f.lineno} {f.name}" + (f"  | {f.line}" if f.line else "")
+             for f in frames]
+    site = ""
+    if frames:
+        f = frames[-1]
+        site = f"{os.path.basename(f.filename)}:{f.lineno} {f.name}"
+    return lines, site
+
+
+class LoopWatchdog:
+    """
+    interval：心跳间隔；threshold：超过该延迟视为卡顿并抓取调用栈。
+    recent 保留最近 window 次心跳的延迟用于计算分位数，stalls 保留最近 max_stalls 次卡顿
+    """
+    def __init__(self, interval: float = 0.1, threshold: float = 0.2,
+                 window: int = 3000, max_stalls: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.recent: Deque[float] = deque(maxlen=window)
+        self.stalls: Deque[Stall] = deque(maxlen=max_stalls)
+        self.sites: Dict[str, List[float]] = {}  # 位置 -> [次数, 总时长, 最长]
+        self.samples = 0
+        self.max_lag = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional["asyncio.Task"] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._beat = 0.0
+        # 守护线程抓到的调用栈，等卡顿结束后由心跳协程取走： (调用栈, 位置, 任务名)
+        self._captured: Optional[Tuple[List[str], str, str]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """在事件循环中调用；重复调用无副作用"""
+        if self.running or self.threshold <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name="kccj-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - started - self.interval)
+            self.recent.append(lag)
+            self.samples += 1
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("kccj_loop_lag_seconds", lag)
+            captured, self._captured = self._captured, None
+            if lag >= self.threshold:
+                self._record(lag, captured)
+
+    def _monitor(self):
+        """守护线程：心跳超时即抓取事件循环线程的调用栈，每次卡顿只抓一次"""
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(poll):
+            if self._captured is not None:
+                continue
+            if time.monotonic() - self._beat < self.interval + self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack, site = _format_stack(frame)
+            task = asyncio.current_task(self._loop) if self._loop is not None else None
+            self._captured = (stack, site, task.get_name() if task is not None else "")
+
+    def _record(self, lag: float, captured: Optional[Tuple[List[str], str, str]]):
+        stack, site, task = captured or ([], "", "")
+        started = datetime.fromtimestamp(time.time() - lag)
+        stall = Stall(started, lag, stack, site or "未知位置", task)
+        self.stalls.append(stall)
+        entry = self.sites.setdefault(stall.site, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += lag
+        entry[2] = max(entry[2], lag)
+        metrics.inc("kccj_loop_stalls_total")
+        logger.warning(f"事件循环被阻塞 {lag * 1000:.0f}ms，阻塞位置：{stall.site}\n" + "\n".join(stack[-10:]))
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self, top_n: int = 5) -> str:
+        if not self.samples:
+            return "事件循环监测未运行。"
+        lines = [
+            f"⏱ 事件循环延迟（最近 {len(self.recent)} 次心跳）：p50 {self.percentile(0.5) * 1000:.1f}ms，"
+            f"p99 {self.percentile(0.99) * 1000:.1f}ms，历史最大 {self.max_lag * 1000:.0f}ms",
+            f"超过 {self.threshold * 1000:.0f}ms 的卡顿：{sum(int(e[0]) for e in self.sites.values())} 次",
+        ]
+        if self.sites:
+            lines.append("阻塞最多的位置：")
+            top = sorted(self.sites.items(), key=lambda item: item[1][1], reverse=True)[:top_n]
+            for site, (count, total, longest) in top:
+                lines.append(f"• {site}：{int(count)} 次，共 {total * 1000:.0f}ms，最长 {longest * 1000:.0f}ms")
+        if self.stalls:
+            lines.append("最近一次卡顿：")
+            lines.append(self.stalls[-1].describe())
+        return "\n".join(lines)
+
+
+# 全局监测器，由插件启动
+loop_watchdog = LoopWatchdog()
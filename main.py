@@ -9,7 +9,7 @@ from datetime import datetime, timedelta
 import re
 from dateutil import parser
 from enum import Enum
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import httpx
 import nonebot
 from nonebot.adapters.onebot.v11 import Adapter as ONEBOT_V11Adapter
@@ -20,8 +20,22 @@ from nonebot.typing import T_State
 from nonebot import on_message, on_command
 from nonebot.rule import to_me
 from nonebot.permission import SUPERUSER
-from .ai_service import SiliconFlowService
-from .parser import parse_word, parse_xlsx, parse_image, parse_text_schedule
+from .ai_router import create_ai_service
+from .parser import parse_word, parse_xlsx, parse_image, cascade_parse, ingest_schedule
+from .metrics import metrics
+from .profiling import profiler, PROFILE_TARGETS
+from .loop_watchdog import loop_watchdog
+from .templates import TemplateEngine, CompiledTemplate
+from .scheduler import ReminderDispatcher, LocalClaims, ShardCoordinator, system_clock, seconds_until_next_tick
+from .storage import ScheduleStore, canonical_course, course_identity
+from .schedule_diff import diff_schedules, ScheduleDiff
+from .bulk_import import import_roster
+from .ics_export import IcsExporter
+from .router import (
+    MessageRouter, classify, asked_for_schedule,
+    ROUTE_MEDIA, ROUTE_CONFIRM, ROUTE_CANCEL, EXPECT_SCHEDULE, EXPECT_CONFIRM
+)
+import time
 import aiohttp
 
 # ========== 数据结构 ==========
@@ -36,12 +50,31 @@ class Course:
     def to_dict(self):
         return self.__dict__
 
+    @classmethod
+    def from_parsed(cls, course: Dict[str, Any]) -> "Course":
+        """由解析结果字典（weekday/course/classroom 字段）构造"""
+        weekday = course.get("weekday", "")
+        return cls(
+            weekday[-1:] if weekday else "",
+            course.get("time", ""),
+            course.get("course", ""),
+            course.get("teacher", ""),
+            course.get("classroom", ""),
+            course.get("weeks", "")
+        )
+
 class UserState(Enum):
     WAIT_SCHEDULE = 1
     PARSING = 2
     WAIT_CONFIRM = 3
     ACTIVE = 4
 
+# 会话状态 -> 消息路由期待的回复
+STATE_EXPECTATIONS = {
+    UserState.WAIT_SCHEDULE: EXPECT_SCHEDULE,
+    UserState.WAIT_CONFIRM: EXPECT_CONFIRM,
+}
+
 # ========== 主插件注册 ==========
 @register(
     "kccj",
@@ -56,20 +89,63 @@ class KCCJPlugin(Star):
         self.config = config
         self.data_dir = os.path.join("data", "course_reminder")
         os.makedirs(self.data_dir, exist_ok=True)
+        self.store = ScheduleStore(self.data_dir, prefix="user_", wrap=lambda c: Course(**c))
         self.user_state = {}  # user_id: UserState
+        self.pending_schedules = {}  # user_id: 已解析、等待确认后才保存的课程列表
         self.reminder_tasks = {}
+        # 提醒循环通过时钟读取时间与等待，仿真时可替换为虚拟时钟
+        self.clock = system_clock
+        # AI 服务由插件配置创建；未配置密钥时不报错，解析时再给出提示
+        self.ai_service = create_ai_service(self.get_config)
+        metrics.enabled = bool(self.get_config("enable_metrics", False))
+        profiler.report_dir = self.data_dir
+        self.templates = TemplateEngine(self.get_config)
+        loop_watchdog.threshold = int(self.get_config("loop_lag_threshold_ms", 200)) / 1000
+        loop_watchdog.start()
         asyncio.create_task(self.reminder_service())
 
     # ========== 消息类型处理 ==========
     @filter.event_message_type(filter.EventMessageType.ALL)
+    @profiler.profiled("message")
     async def handle_message(self, event: AstrMessageEvent, *args, **kwargs):
         user_id = event.get_sender_id()
-        if self.has_media(event):
+        has_media = self.has_media(event)
+        text = "" if has_media else (event.message_str or "").strip()
+        # 先按会话状态与文本预筛选路由，普通聊天消息不读取数据、不解析
+        private = event.is_private_chat()
+        expecting = STATE_EXPECTATIONS.get(self.user_state.get(user_id))
+        route = classify(
+            text, has_media,
+            private=private,
+            expecting=expecting,
+            confirm_words=("确认", "是"),
+            cancel_words=("取消",)
+        )
+        metrics.inc("kccj_messages_total", route=route or "ignored")
+        if route is None:
+            return
+        if route == ROUTE_MEDIA:
             await self.send_msg(event, self.get_media_tip())
             event.stop_event()
+        elif route == ROUTE_CONFIRM:
+            await self.confirm_schedule(event, user_id)
+        elif route == ROUTE_CANCEL:
+            self.pending_schedules.pop(user_id, None)
+            self.user_state[user_id] = UserState.WAIT_SCHEDULE
+            await self.send_msg(event, "已取消，请重新发送课程表。")
+        else:
+            # 进入课程表解析流程
+            await self.parse_course_schedule(event, quiet=not asked_for_schedule(private, expecting))
+
+    async def confirm_schedule(self, event: AstrMessageEvent, user_id: str):
+        courses = self.pending_schedules.pop(user_id, None)
+        if courses is not None:
+            self.update_user_data(user_id, courses)
+        elif not self.load_user_data(user_id):
+            await self.send_msg(event, "请先发送课程表。")
             return
-        # 进入课程表解析流程
-        await self.parse_course_schedule(event)
+        self.user_state[user_id] = UserState.ACTIVE
+        await self.send_msg(event, "已开启课程提醒。")
 
     def has_media(self, event: AstrMessageEvent) -> bool:
         return any(getattr(seg, 'type', None) in ("image", "file") for seg in event.message_obj.message)
@@ -94,32 +170,33 @@ class KCCJPlugin(Star):
         )
 
     # ========== 课程表解析 ==========
-    async def parse_course_schedule(self, event: AstrMessageEvent):
+    @profiler.profiled("parse")
+    async def parse_course_schedule(self, event: AstrMessageEvent, quiet: bool = False):
+        """quiet 为 True（群聊中自动识别的课程表）时解析失败不回复，也不进入等待课程表状态"""
         user_id = event.get_sender_id()
         text = event.message_str
-        courses = self._parse_schedule(text)
+        # 本地解析器优先，只有无法识别的部分才交给AI
+        parsed = await ingest_schedule(text, self.ai_service)
+        courses = [Course.from_parsed(c) for c in parsed.courses]
         if not courses:
-            await self.send_msg(event, "课程表解析失败，请检查格式。")
+            if quiet:
+                return
+            if not self.ai_service.configured:
+                await self.send_msg(event, "课程表解析失败：未配置AI服务密钥，请联系管理员在插件配置中填写。")
+            else:
+                await self.send_msg(event, "课程表解析失败，请检查格式。")
             self.user_state[user_id] = UserState.WAIT_SCHEDULE
             return
-        # 格式化并返回用户确认
-        confirm_text = self.format_courses_for_confirm(courses)
+        # 确认后才保存（重新上传时只应用变更），这里只展示变更摘要
+        diff = diff_schedules(self.load_user_data(user_id), courses)
+        self.pending_schedules[user_id] = courses
+        if diff.unchanged or diff.removed or diff.changed:
+            confirm_text = diff.summary() + "\n\n回复'确认'保存，回复'取消'放弃。"
+        else:
+            confirm_text = self.format_courses_for_confirm(courses)
         await self.send_msg(event, confirm_text)
-        self.save_user_data(user_id, courses)
         self.user_state[user_id] = UserState.WAIT_CONFIRM
 
-    def _parse_schedule(self, text: str) -> List[Course]:
-        # 简单正则解析，支持自定义扩展
-        course_pattern = re.compile(
-            r"星期([一二三四五六日])[^\n]*\n上课时间：([^\n]+)\n课程名称：([^\n]+)\n教师：([^\n]+)\n上课地点：([^\n]+)\n周次：([^\n]+)",
-            re.MULTILINE
-        )
-        courses = []
-        for match in course_pattern.finditer(text):
-            day, time, name, teacher, location, weeks = match.groups()
-            courses.append(Course(day, time, name, teacher, location, weeks))
-        return courses
-
     def format_courses_for_confirm(self, courses: List[Course]) -> str:
         lines = ["已为您解析出如下课程信息，请确认："]
         for c in courses:
@@ -130,31 +207,39 @@ class KCCJPlugin(Star):
     # ========== 提醒服务管理 ==========
     async def reminder_service(self):
         while True:
-            now = datetime.now()
+            await self._reminder_tick(self.clock.now())
+            await self.clock.sleep(seconds_until_next_tick(self.clock))
+
+    @profiler.profiled("tick")
+    async def _reminder_tick(self, now: datetime):
+        tick_started = time.perf_counter()
+        for user_id, courses in self.load_all_user_data().items():
+            # 只对已激活用户提醒
+            if self.user_state.get(user_id) != UserState.ACTIVE:
+                continue
+            for c in courses:
+                remind_time = self.calculate_remind_time(c)
+                if remind_time and now >= remind_time and not self.is_task_sent(user_id, c):
+                    metrics.inc("kccj_reminders_total", status="due")
+                    metrics.observe("kccj_scheduler_lag_seconds", (self.clock.now() - remind_time).total_seconds())
+                    await self.send_reminder(user_id, c)
+                    self.mark_task_sent(user_id, c)
+        metrics.observe("kccj_scheduler_tick_seconds", time.perf_counter() - tick_started, loop="plugin")
+        await metrics.write_prometheus(self.data_dir)
+        # 每天23:00发送次日课程汇总
+        if now.hour == 23 and now.minute == 0:
             for user_id, courses in self.load_all_user_data().items():
-                # 只对已激活用户提醒
-                if self.user_state.get(user_id) != UserState.ACTIVE:
-                    continue
-                for c in courses:
-                    remind_time = self.calculate_remind_time(c)
-                    if remind_time and now >= remind_time and not self.is_task_sent(user_id, c):
-                        await self.send_reminder(user_id, c)
-                        self.mark_task_sent(user_id, c)
-            # 每天23:00发送次日课程汇总
-            if now.hour == 23 and now.minute == 0:
-                for user_id, courses in self.load_all_user_data().items():
-                    if self.user_state.get(user_id) == UserState.ACTIVE:
-                        preview_msg = self.format_daily_preview(courses)
-                        if preview_msg:
-                            await self.context.send_message(
-                                user_id,
-                                [{"type": "plain", "text": preview_msg}]
-                            )
-                            await self.context.send_message(
-                                user_id,
-                                [{"type": "plain", "text": "是否开启明日课程提醒？回复'是'开启提醒。"}]
-                            )
-            await asyncio.sleep(60)
+                if self.user_state.get(user_id) == UserState.ACTIVE:
+                    preview_msg = self.format_daily_preview(courses)
+                    if preview_msg:
+                        await self.context.send_message(
+                            user_id,
+                            [{"type": "plain", "text": preview_msg}]
+                        )
+                        await self.context.send_message(
+                            user_id,
+                            [{"type": "plain", "text": "是否开启明日课程提醒？回复'是'开启提醒。"}]
+                        )
 
     def calculate_remind_time(self, course: Course):
         advance = self.config.get("remind_advance_minutes", 30)
@@ -169,54 +254,48 @@ class KCCJPlugin(Star):
 
     async def send_reminder(self, user_id, course: Course):
         try:
-            msg = (
-                "同学你好，待会有课哦\n"
-                f"上课时间（节次和时间）：{course.time}\n"
-                f"课程名称：{course.name}\n"
-                f"教师：{course.teacher}\n"
-                f"上课地点：{course.location}"
-            )
-            await self.context.send_message(
+            msg = self.templates.render_reminder(course)
+            await tracked_send(self.context.send_message(
                 user_id,
                 [{"type": "plain", "text": msg}]
-            )
+            ))
+            metrics.inc("kccj_reminders_total", status="sent")
         except Exception as e:
+            metrics.inc("kccj_reminders_total", status="failed")
             logger.error(f"send_reminder error: {e}")
 
     def format_daily_preview(self, courses: List[Course]) -> str:
         # 只预览明天的课程
-        tomorrow = datetime.now() + timedelta(days=1)
+        tomorrow = self.clock.now() + timedelta(days=1)
         weekday_map = {0: "一", 1: "二", 2: "三", 3: "四", 4: "五", 5: "六", 6: "日"}
         tomorrow_weekday = weekday_map[tomorrow.weekday()]
-        lines = [f"明天（星期{tomorrow_weekday}）课程预览："]
-        found = False
-        for c in courses:
-            if c.day == tomorrow_weekday:
-                found = True
-                lines.append(f"{c.time} {c.name} {c.teacher} {c.location} {c.weeks}")
-        return "\n".join(lines) if found else ""
+        tomorrow_courses = [c for c in courses if c.day == tomorrow_weekday]
+        if not tomorrow_courses:
+            return ""
+        return self.templates.render_preview(tomorrow_weekday, tomorrow_courses)
 
     # ========== 持久化存储 ==========
+    @metrics.timed("kccj_storage_seconds", op="write")
     def save_user_data(self, user_id, courses: List[Course]):
-        path = os.path.join(self.data_dir, f"user_{user_id}.json")
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump([c.to_dict() for c in courses], f, ensure_ascii=False, indent=2)
+        self.store.save_user(user_id, {"courses": courses})
 
+    @metrics.timed("kccj_storage_seconds", op="read")
     def load_user_data(self, user_id) -> List[Course]:
-        path = os.path.join(self.data_dir, f"user_{user_id}.json")
-        if not os.path.exists(path):
-            return []
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return [Course(**c) for c in data]
+        # 同一份课程表的 Course 对象在用户之间共享，不要原地修改
+        data = self.store.load_user(user_id)
+        return data["courses"] if data else []
+
+    @metrics.timed("kccj_storage_seconds", op="write")
+    def update_user_data(self, user_id, courses: List[Course]) -> ScheduleDiff:
+        """与已保存的课程表对比，只写入新增/删除/变更的课程"""
+        data = self.store.load_user(user_id) or {"courses": []}
+        diff = diff_schedules(data["courses"], courses)
+        if not diff.is_empty:
+            self.store.save_user_diff(user_id, data, diff)
+        return diff
 
     def load_all_user_data(self) -> Dict[str, List[Course]]:
-        result = {}
-        for fname in os.listdir(self.data_dir):
-            if fname.startswith("user_") and fname.endswith(".json"):
-                user_id = fname[5:-5]
-                result[user_id] = self.load_user_data(user_id)
-        return result
+        return {user_id: self.load_user_data(user_id) for user_id in self.store.list_users()}
 
     # ========== 指令 ==========
     @filter.command("reminder")
@@ -245,10 +324,10 @@ class KCCJPlugin(Star):
 
     async def send_msg(self, event: AstrMessageEvent, text: str):
         try:
-            await self.context.send_message(
+            await tracked_send(self.context.send_message(
                 event.unified_msg_origin,
                 [{"type": "plain", "text": text}]
-            )
+            ))
         except Exception as e:
             logger.error(f"send_msg error: {e}")
 
@@ -363,7 +442,7 @@ class KCCJPlugin(Star):
         
         async def reminder_task():
             while True:
-                now = datetime.now()
+                now = self.clock.now()
                 # 检查是否需要发送提醒
                 for day, courses in course_info["weekly_courses"].items():
                     # 检查是否周末
@@ -382,15 +461,7 @@ class KCCJPlugin(Star):
                             
                             if now.hour == reminder_time.hour and now.minute == reminder_time.minute:
                                 # 发送提醒
-                                reminder_msg = self.get_config(
-                                    'message_templates.reminder_template',
-                                    "【课程提醒】\n上课时间：{time}\n课程名称：{name}\n教师：{teacher}\n上课地点：{location}"
-                                ).format(
-                                    time=course["time"],
-                                    name=course["name"],
-                                    teacher=course["teacher"],
-                                    location=course["location"]
-                                )
+                                reminder_msg = self.templates.render_reminder(course)
                                 await self.context.send_message(unified_msg_origin, [{"type": "plain", "text": reminder_msg}])
                 
                 # 检查晚间课程
@@ -404,25 +475,17 @@ class KCCJPlugin(Star):
                             reminder_time = now.replace(hour=start_hour, minute=start_minute) - timedelta(minutes=self.get_config('reminder_settings.reminder_time', 30))
                             
                             if now.hour == reminder_time.hour and now.minute == reminder_time.minute:
-                                reminder_msg = self.get_config(
-                                    'message_templates.reminder_template',
-                                    "【课程提醒】\n上课时间：{time}\n课程名称：{name}\n教师：{teacher}\n上课地点：{location}"
-                                ).format(
-                                    time=course["time"],
-                                    name=course["name"],
-                                    teacher=course["teacher"],
-                                    location=course["location"]
-                                )
+                                reminder_msg = self.templates.render_reminder(course)
                                 await self.context.send_message(unified_msg_origin, [{"type": "plain", "text": reminder_msg}])
                 
-                await asyncio.sleep(60)  # 每分钟检查一次
+                await self.clock.sleep(seconds_until_next_tick(self.clock))  # 每个整分钟检查一次
         
         self.reminder_tasks[unified_msg_origin] = asyncio.create_task(reminder_task())
 
     async def daily_preview_task(self):
         """每日预览任务"""
         while True:
-            now = datetime.now()
+            now = self.clock.now()
             preview_time = datetime.strptime(self.get_config('reminder_settings.daily_preview_time', '23:00'), "%H:%M").time()
             
             if (now.hour == preview_time.hour and 
@@ -437,7 +500,7 @@ class KCCJPlugin(Star):
                             await self.context.send_message(user_id, [{"type": "plain", "text": preview_msg}])
                             # 询问是否开启明日提醒
                             await self.context.send_message(user_id, [{"type": "plain", "text": "是否开启明日课程提醒？回复'是'开启提醒。"}])
-            await asyncio.sleep(60)  # 每分钟检查一次
+            await self.clock.sleep(seconds_until_next_tick(self.clock))  # 每个整分钟检查一次
 
     async def terminate(self):
         '''插件被卸载/停用时调用，安全取消所有异步任务并保存数据'''
@@ -445,6 +508,7 @@ class KCCJPlugin(Star):
             for task in getattr(self, 'reminder_tasks', {}).values():
                 if task and not task.done():
                     task.cancel()
+            await loop_watchdog.stop()
             for user_id, state in self.user_state.items():
                 if state == UserState.ACTIVE:
                     self.save_user_data(user_id, self.load_user_data(user_id))
@@ -452,6 +516,46 @@ class KCCJPlugin(Star):
         except Exception as e:
             logger.error(f"terminate error: {e}")
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("metrics")
+    async def metrics_command(self, event: AstrMessageEvent, *args, **kwargs):
+        '''查看运行指标（管理员）'''
+        if not metrics.enabled:
+            yield event.plain_result("指标统计未启用，请在配置中开启 enable_metrics。")
+            return
+        path = await metrics.write_prometheus(self.data_dir)
+        yield event.plain_result(metrics.summary() + (f"\n\nPrometheus 指标已写入：{path}" if path else ""))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("profile")
+    async def profile_command(self, event: AstrMessageEvent, target: str = None, count: int = 10, *args, **kwargs):
+        '''按需性能剖析（管理员）：/profile tick|message|parse [次数]，/profile status|report|stop'''
+        if target == "status":
+            yield event.plain_result(profiler.status())
+        elif target == "stop":
+            cancelled = profiler.disarm()
+            yield event.plain_result(
+                "已取消：" + "、".join(PROFILE_TARGETS[t] for t in cancelled) if cancelled else "当前没有进行中的性能剖析。"
+            )
+        elif target == "report":
+            reports = list(profiler.last_reports.values())
+            yield event.plain_result("\n\n".join(reports) if reports else "还没有生成过剖析报告。")
+        elif target in PROFILE_TARGETS:
+            profiler.arm(target, int(count))
+            yield event.plain_result(
+                f"已开启{PROFILE_TARGETS[target]}剖析，将记录接下来的 {int(count)} 次调用"
+                f"（{profiler.arm_timeout // 60} 分钟内未完成则自动结束），完成后使用 /profile report 查看结果，"
+                "/profile stop 取消。"
+            )
+        else:
+            yield event.plain_result("用法：/profile tick|message|parse [次数]，/profile status|report|stop")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("looplag")
+    async def looplag_command(self, event: AstrMessageEvent, *args, **kwargs):
+        '''查看事件循环延迟与阻塞位置（管理员）'''
+        yield event.plain_result(loop_watchdog.summary())
+
     @filter.command("testremind")
     async def test_remind_command(self, event: AstrMessageEvent, *args, **kwargs):
         '''课程提醒测试指令'''
@@ -468,142 +572,249 @@ class KCCJPlugin(Star):
             logger.error(f"test_remind_command error: {e}")
             yield event.plain_result("课程提醒测试失败，请联系管理员。")
 
+async def tracked_send(coro):
+    """发送消息并记录正在发送中的消息数"""
+    metrics.add("kccj_send_queue_depth", 1)
+    try:
+        return await coro
+    finally:
+        metrics.add("kccj_send_queue_depth", -1)
+
 # 初始化插件
 nonebot.init()
 driver = nonebot.get_driver()
 driver.register_adapter(ONEBOT_V11Adapter)
 
-# 配置
+# 配置；AI 服务密钥从 NoneBot 配置（.env 中的 SILICONFLOW_API_KEY 等）读取，不写在代码里
 CONFIG = {
-    "api_key": "sk-zxtmadhtngzchfjeuoasxfyjbvxnvunyqgyrusdwentlbjxo",
-    "api_base": "https://api.siliconflow.cn/v1",
-    "model": "deepseek-ai/DeepSeek-V3",
+    "ai_provider": getattr(driver.config, "ai_provider", "siliconflow"),
+    "siliconflow_api_key": getattr(driver.config, "siliconflow_api_key", ""),
+    "siliconflow_model": "deepseek-ai/DeepSeek-V3",
+    "openai_api_key": getattr(driver.config, "openai_api_key", ""),
+    "doubao_api_key": getattr(driver.config, "doubao_api_key", ""),
+    "custom_api_key": getattr(driver.config, "custom_api_key", ""),
+    "custom_api_base": getattr(driver.config, "custom_api_base", ""),
     "remind_advance_minutes": 30,
     "daily_summary_hour": 23,
-    "daily_summary_minute": 0
+    "daily_summary_minute": 0,
+    "max_ai_retries": 2,
+    "ai_max_concurrency": 8,
+    "ai_hedge_delay_ms": 0,
+    # 超过该长度的课程表按星期/节次切块，最多 ai_parse_concurrency 块同时交给AI解析
+    "ai_parse_chunk_chars": 800,
+    "ai_parse_concurrency": 4,
+    "enable_metrics": False,
+    # 事件循环被阻塞超过该时长（毫秒）时记录阻塞位置的调用栈，0 为关闭监测
+    "loop_lag_threshold_ms": 200,
+    # 多进程/多实例部署时指向同一个 SQLite 文件即可自动分片，留空为单进程模式
+    "shard_db_path": getattr(driver.config, "shard_db_path", ""),
+    "worker_id": getattr(driver.config, "worker_id", ""),
+    "shard_lease_seconds": int(getattr(driver.config, "shard_lease_seconds", 180)),
+    # 群聊中相同课程、时间、地点的提醒合并为一条群消息，并可 @ 相关同学
+    "group_reminder_fanin": True,
+    "group_reminder_mention": True,
+    # 日历导出：学期第一周的任意一天（如 "2025-09-01"），留空则不提供导出
+    "semester_start": getattr(driver.config, "semester_start", ""),
+    "semester_weeks": int(getattr(driver.config, "semester_weeks", 16)),
+    # 日历订阅文件所在目录（数据目录下的 ics/users）对外提供访问时的地址前缀
+    "ics_base_url": getattr(driver.config, "ics_base_url", "")
 }
 
-# 初始化 AI 服务
-ai_service = SiliconFlowService(
-    api_key=CONFIG["api_key"],
-    api_base=CONFIG["api_base"],
-    model=CONFIG["model"]
-)
+metrics.enabled = metrics.enabled or CONFIG["enable_metrics"]
+
+# 初始化 AI 服务；未配置密钥时不报错，解析时再给出提示
+ai_service = create_ai_service(CONFIG.get)
 
 # 数据存储
 DATA_DIR = "data/plugins/kccj/data"
 os.makedirs(DATA_DIR, exist_ok=True)
-
-def get_user_data_path(user_id: str) -> str:
-    return os.path.join(DATA_DIR, f"{user_id}.json")
-
+# 课程表按内容哈希共享存储，用户文件只保存引用
+schedule_store = ScheduleStore(DATA_DIR)
+
+# 日历导出按课程表内容缓存，同一份课程表只生成一次
+ics_exporter = IcsExporter(
+    schedule_store,
+    os.path.join(DATA_DIR, "ics"),
+    datetime.strptime(CONFIG["semester_start"], "%Y-%m-%d").date(),
+    default_weeks=CONFIG["semester_weeks"],
+    alarm_minutes=CONFIG["remind_advance_minutes"]
+) if CONFIG["semester_start"] else None
+
+def refresh_calendars(user_ids: Optional[List[str]] = None):
+    """课程表变化后更新已导出日历的同学的订阅文件，默认检查全部已订阅的同学"""
+    if ics_exporter is not None:
+        ics_exporter.refresh(user_ids)
+
+@metrics.timed("kccj_storage_seconds", op="read")
 def load_user_data(user_id: str) -> Dict:
-    file_path = get_user_data_path(user_id)
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"加载用户数据失败: {str(e)}")
+    try:
+        data = schedule_store.load_user(user_id)
+        if data is not None:
+            data.setdefault("courses", [])
+            data.setdefault("reminder_enabled", False)
+            return data
+    except Exception as e:
+        logger.error(f"加载用户数据失败: {str(e)}")
     return {"courses": [], "reminder_enabled": False}
 
+@metrics.timed("kccj_storage_seconds", op="write")
 def save_user_data(user_id: str, data: Dict):
-    file_path = get_user_data_path(user_id)
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        schedule_store.save_user(user_id, data)
+    except Exception as e:
+        logger.error(f"保存用户数据失败: {str(e)}")
+
+@metrics.timed("kccj_storage_seconds", op="write")
+async def update_user_schedule(user_id: str, courses: List[Dict[str, Any]]):
+    """
+    重新上传课程表时与已保存的课程表对比，只写入新增/删除/变更的课程；
+    未变化课程的提醒认领保留，变更课程撤销当天认领以便按新信息提醒
+    """
+    user_data = load_user_data(user_id)
+    diff = diff_schedules(user_data["courses"], courses)
+    if diff.is_empty:
+        return user_data, diff
+    try:
+        user_data["courses"] = schedule_store.save_user_diff(user_id, user_data, diff)
     except Exception as e:
         logger.error(f"保存用户数据失败: {str(e)}")
+        return user_data, diff
+    await reminder_dispatcher.forget(user_id, [canonical_course(new) for _, new in diff.changed], reminder_dispatcher.clock.now().date())
+    await asyncio.get_running_loop().run_in_executor(None, refresh_calendars, [user_id])
+    return user_data, diff
+
+def format_schedule_reply(user_data: Dict, diff: ScheduleDiff, confirm_entries: str) -> str:
+    """首次上传展示完整课程列表，重新上传只展示变更摘要"""
+    if diff.unchanged or diff.removed or diff.changed:
+        msg = diff.summary()
+        if user_data.get("reminder_enabled"):
+            return msg
+        return msg + "\n\n是否开启课程提醒？回复'是'开启提醒。"
+    return "已解析到以下课程：\n\n" + confirm_entries + "是否开启课程提醒？回复'是'开启提醒。"
+
+# 会话路由：普通聊天消息在读取用户数据、运行解析器之前就被过滤掉
+message_router = MessageRouter(confirm_words=("是",))
+
+def chat_of(event: Event) -> Optional[str]:
+    """消息所在的群号，私聊为 None"""
+    group_id = getattr(event, "group_id", None)
+    return str(group_id) if group_id else None
 
 # 消息处理器
-@on_message()
+# 处理函数先定义为普通协程再注册到 matcher，便于压测等场景直接调用
+@profiler.profiled("message")
 async def handle_message(bot: Bot, event: Event, state: T_State):
     user_id = str(event.get_user_id())
+    segments = event.get_message()
+    has_media = any(seg.type in ("image", "file") for seg in segments)
+    text = "" if has_media else event.get_plaintext().strip()
+    chat_id = chat_of(event)
+    asked = asked_for_schedule(chat_id is None, message_router.state(user_id, chat_id))
+    route = message_router.route(user_id, text, has_media, chat_id=chat_id)
+    if route is None:
+        return
+    if route == ROUTE_MEDIA:
+        await handle_file_message(bot, event, user_id)
+    elif route == ROUTE_CONFIRM:
+        await handle_confirmation(bot, event, state)
+    else:
+        await handle_schedule_text(bot, event, user_id, text, quiet=not asked)
+
+async def handle_file_message(bot: Bot, event: Event, user_id: str):
+    # 获取文件信息
+    file_seg = next(seg for seg in event.get_message() if seg.type in ["image", "file"])
+    file_url = file_seg.data.get("url", "")
+    file_name = file_seg.data.get("name", "")
     
-    # 检查是否为图片/文件消息
-    if any(seg.type in ["image", "file"] for seg in event.get_message()):
-        # 获取文件信息
-        file_seg = next(seg for seg in event.get_message() if seg.type in ["image", "file"])
-        file_url = file_seg.data.get("url", "")
-        file_name = file_seg.data.get("name", "")
+    if not file_url:
+        await bot.send(event, Message([MessageSegment.text("无法获取文件，请重试。")]))
+        return
         
-        if not file_url:
-            await bot.send(event, Message([MessageSegment.text("无法获取文件，请重试。")]))
-            return
-            
-        # 下载文件
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(file_url) as resp:
-                    if resp.status != 200:
-                        await bot.send(event, Message([MessageSegment.text("文件下载失败，请重试。")]))
-                        return
-                    file_data = await resp.read()
-        except Exception as e:
-            logger.error(f"下载文件失败: {str(e)}")
-            await bot.send(event, Message([MessageSegment.text("文件下载失败，请重试。")]))
+    # 下载文件
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(file_url) as resp:
+                if resp.status != 200:
+                    await bot.send(event, Message([MessageSegment.text("文件下载失败，请重试。")]))
+                    return
+                file_data = await resp.read()
+    except Exception as e:
+        logger.error(f"下载文件失败: {str(e)}")
+        await bot.send(event, Message([MessageSegment.text("文件下载失败，请重试。")]))
+        return
+        
+    # 保存文件
+    ext = os.path.splitext(file_name)[-1].lower()
+    save_path = os.path.join(DATA_DIR, f"{user_id}{ext}")
+    try:
+        with open(save_path, "wb") as f:
+            f.write(file_data)
+    except Exception as e:
+        logger.error(f"保存文件失败: {str(e)}")
+        await bot.send(event, Message([MessageSegment.text("文件保存失败，请重试。")]))
+        return
+        
+    # 根据文件类型解析
+    try:
+        if ext in [".docx", ".doc"]:
+            courses = parse_word(save_path)
+        elif ext in [".xlsx", ".xls"]:
+            courses = parse_xlsx(save_path)
+        elif ext in [".jpg", ".jpeg", ".png", ".bmp"]:
+            courses = await parse_image(save_path, CONFIG.get("ocr_api_url", ""), CONFIG.get("ocr_api_key", ""))
+        else:
+            await bot.send(event, Message([MessageSegment.text("暂不支持该文件类型，请发送Word、Excel或图片格式的课程表。")]))
             return
             
-        # 保存文件
-        ext = os.path.splitext(file_name)[-1].lower()
-        save_path = os.path.join(DATA_DIR, f"{user_id}{ext}")
-        try:
-            with open(save_path, "wb") as f:
-                f.write(file_data)
-        except Exception as e:
-            logger.error(f"保存文件失败: {str(e)}")
-            await bot.send(event, Message([MessageSegment.text("文件保存失败，请重试。")]))
+        if not courses:
+            await bot.send(event, Message([MessageSegment.text("未能从文件中识别出课程信息，请检查文件格式是否正确。")]))
             return
             
-        # 根据文件类型解析
+        # 保存课程数据
+        user_data, diff = await update_user_schedule(user_id, courses)
+        message_router.expect(user_id, EXPECT_CONFIRM, chat_of(event), group_id=chat_of(event))
+        
+        # 生成确认消息
+        confirm_msg = format_schedule_reply(user_data, diff, CONFIRM_ENTRY.render_courses(courses))
+        
+        await bot.send(event, Message([MessageSegment.text(confirm_msg)]))
+        
+    except Exception as e:
+        logger.error(f"解析文件失败: {str(e)}")
+        await bot.send(event, Message([MessageSegment.text("解析文件失败，请检查文件格式是否正确。")]))
+    finally:
+        # 清理临时文件
         try:
-            if ext in [".docx", ".doc"]:
-                courses = parse_word(save_path)
-            elif ext in [".xlsx", ".xls"]:
-                courses = parse_xlsx(save_path)
-            elif ext in [".jpg", ".jpeg", ".png", ".bmp"]:
-                courses = await parse_image(save_path, CONFIG.get("ocr_api_url", ""), CONFIG.get("ocr_api_key", ""))
-            else:
-                await bot.send(event, Message([MessageSegment.text("暂不支持该文件类型，请发送Word、Excel或图片格式的课程表。")]))
-                return
-                
-            if not courses:
-                await bot.send(event, Message([MessageSegment.text("未能从文件中识别出课程信息，请检查文件格式是否正确。")]))
-                return
-                
-            # 保存课程数据
-            user_data = load_user_data(user_id)
-            user_data["courses"] = courses
-            save_user_data(user_id, user_data)
-            
-            # 生成确认消息
-            confirm_msg = "已解析到以下课程：\n\n"
-            for course in courses:
-                confirm_msg += f"{course['weekday']} {course['time']} {course['course']}\n"
-                confirm_msg += f"教室：{course['classroom']} 教师：{course['teacher']}\n\n"
-            confirm_msg += "是否开启课程提醒？回复'是'开启提醒。"
-            
-            await bot.send(event, Message([MessageSegment.text(confirm_msg)]))
-            
-        except Exception as e:
-            logger.error(f"解析文件失败: {str(e)}")
-            await bot.send(event, Message([MessageSegment.text("解析文件失败，请检查文件格式是否正确。")]))
-        finally:
-            # 清理临时文件
-            try:
-                os.remove(save_path)
-            except:
-                pass
-        return
-
-    # 处理文本消息
-    text = event.get_plaintext().strip()
-    if not text:
-        return
-
-    # 尝试解析课程表
-    courses = parse_text_schedule(text)
+            os.remove(save_path)
+        except:
+            pass
+
+async def handle_schedule_text(bot: Bot, event: Event, user_id: str, text: str, quiet: bool = False):
+    """quiet 为 True（群聊中自动识别的课程表）时解析失败不回复"""
+    # 尝试解析课程表：先用本地解析器，再把无法识别的剩余部分交给AI
+    parsed = cascade_parse(text)
+    courses = parsed.courses
+    confirm_entries = [format_confirm_entry(course) for course in courses]
+    if not parsed.needs_ai:
+        metrics.inc("kccj_parse_ai_skipped_total")
+    else:
+        # 使用AI流式解析，边生成边组装确认消息
+        ai_started = False
+        async for course in ai_service.parse_course_schedule_stream(parsed.take_remainder()):
+            parsed.add("ai", course)
+            metrics.inc("kccj_parse_tier_total", tier="ai")
+            confirm_entries.append(format_confirm_entry(course))
+            if not ai_started:
+                ai_started = True
+                await bot.send(event, Message([MessageSegment.text(
+                    f"正在使用AI解析课程表，已识别：{course['weekday']} {course['time']} {course['course']}……"
+                )]))
     if not courses:
+        if quiet:
+            return
+        if not ai_service.configured:
+            await bot.send(event, Message([MessageSegment.text("抱歉，我无法解析课程表：未配置AI服务密钥，请联系管理员。")]))
+            return
         await bot.send(event, Message([
             MessageSegment.text("抱歉，我无法解析课程表。\n"),
             MessageSegment.text("请确保课程表格式正确，包含：星期、时间、课程名称、教室、教师等信息。")
@@ -611,21 +822,24 @@ async def handle_message(bot: Bot, event: Event, state: T_State):
         return
 
     # 保存课程数据
-    user_data = load_user_data(user_id)
-    user_data["courses"] = courses
-    save_user_data(user_id, user_data)
+    user_data, diff = await update_user_schedule(user_id, courses)
+    message_router.expect(user_id, EXPECT_CONFIRM, chat_of(event), group_id=chat_of(event))
 
     # 生成确认消息
-    confirm_msg = "已解析到以下课程：\n\n"
-    for course in courses:
-        confirm_msg += f"{course['weekday']} {course['time']} {course['course']}\n"
-        confirm_msg += f"教室：{course['classroom']} 教师：{course['teacher']}\n\n"
-    confirm_msg += "是否开启课程提醒？回复'是'开启提醒。"
+    confirm_msg = format_schedule_reply(user_data, diff, "".join(confirm_entries))
 
     await bot.send(event, Message([MessageSegment.text(confirm_msg)]))
 
+# 各类课程列表消息中单门课程的格式
+CONFIRM_ENTRY = CompiledTemplate("{weekday} {time} {course}\n教室：{classroom} 教师：{teacher}\n\n")
+SUMMARY_ENTRY = CompiledTemplate("⏰ {time} {course}\n📍 教室：{classroom}\n👨‍🏫 教师：{teacher}\n\n")
+SCHEDULE_ENTRY = CompiledTemplate("📅 {weekday} {time}\n📖 {course}\n📍 {classroom}\n👨‍🏫 {teacher}\n\n")
+TODAY_ENTRY = CompiledTemplate("⏰ {time} {course}\n📍 {classroom}\n👨‍🏫 {teacher}\n\n")
+
+def format_confirm_entry(course: Dict[str, Any]) -> str:
+    return CONFIRM_ENTRY.render_course(course)
+
 # 确认开启提醒
-@on_message()
 async def handle_confirmation(bot: Bot, event: Event, state: T_State):
     user_id = str(event.get_user_id())
     text = event.get_plaintext().strip()
@@ -639,96 +853,81 @@ async def handle_confirmation(bot: Bot, event: Event, state: T_State):
         return
 
     user_data["reminder_enabled"] = True
+    # 在群里发送课程表并确认的同学，提醒会合并发送到该群；
+    # 没有对应的课程表会话（如每日汇总后或重启后在私聊中确认）时保留原来的设置
+    chat_id = chat_of(event)
+    context = message_router.context(user_id, chat_id) or {}
+    if "group_id" in context:
+        if context["group_id"]:
+            user_data["group_id"] = context["group_id"]
+        else:
+            user_data.pop("group_id", None)
     save_user_data(user_id, user_data)
-
-    # 启动提醒服务
-    asyncio.create_task(start_reminder_service(bot, user_id))
+    message_router.clear(user_id, chat_id)
 
     await bot.send(event, Message([MessageSegment.text("已开启课程提醒服务！")]))
 
+# 只注册一个消息 matcher，由 handle_message 按会话状态分发
+message_matcher = on_message()
+message_matcher.handle()(handle_message)
+
 # 提醒服务
-async def start_reminder_service(bot: Bot, user_id: str):
-    while True:
-        try:
-            user_data = load_user_data(user_id)
-            if not user_data["reminder_enabled"]:
-                break
+def list_user_ids() -> List[str]:
+    return schedule_store.list_users()
+
+async def send_course_reminder(user_id: str, course: Dict[str, Any], start_time: datetime):
+    bot = nonebot.get_bot()
+    # 最晚要在上课前发出，AI来不及时直接使用模板消息
+    reminder_msg = await ai_service.generate_reminder_message(course, deadline=start_time)
+    await tracked_send(bot.send_private_msg(user_id=user_id, message=Message([MessageSegment.text(reminder_msg)])))
+
+async def send_group_course_reminder(group_id: str, course: Dict[str, Any], user_ids: List[str], start_time: datetime):
+    bot = nonebot.get_bot()
+    reminder_msg = await ai_service.generate_reminder_message(course, deadline=start_time)
+    segments = []
+    if CONFIG["group_reminder_mention"]:
+        segments = [MessageSegment.at(uid) for uid in user_ids] + [MessageSegment.text("\n")]
+    segments.append(MessageSegment.text(reminder_msg))
+    await tracked_send(bot.send_group_msg(group_id=int(group_id), message=Message(segments)))
+
+async def send_user_summary(user_id: str, courses: List[Dict[str, Any]]):
+    await send_daily_summary(nonebot.get_bot(), user_id, courses)
+    # 汇总消息询问是否开启明日提醒
+    message_router.expect(user_id, EXPECT_CONFIRM)
+
+reminder_dispatcher = ReminderDispatcher(
+    list_users=list_user_ids,
+    load_user=load_user_data,
+    send_reminder=send_course_reminder,
+    send_summary=send_user_summary,
+    send_group_reminder=send_group_course_reminder if CONFIG["group_reminder_fanin"] else None,
+    claims=ShardCoordinator(
+        CONFIG["shard_db_path"],
+        worker_id=CONFIG["worker_id"] or None,
+        lease_seconds=CONFIG["shard_lease_seconds"]
+    ) if CONFIG["shard_db_path"] else LocalClaims(),
+    group_index=schedule_store.user_groups,
+    advance_minutes=CONFIG["remind_advance_minutes"],
+    summary_time=(CONFIG["daily_summary_hour"], CONFIG["daily_summary_minute"])
+)
 
-            now = datetime.now()
-            
-            # 检查是否需要发送每日汇总
-            if now.hour == CONFIG["daily_summary_hour"] and now.minute == CONFIG["daily_summary_minute"]:
-                await send_daily_summary(bot, user_id, user_data["courses"])
-            
-            # 检查是否需要发送课程提醒
-            for course in user_data["courses"]:
-                if should_send_reminder(course):
-                    reminder_msg = await ai_service.generate_reminder_message(course)
-                    await bot.send_private_msg(user_id=user_id, message=Message([MessageSegment.text(reminder_msg)]))
-                    # 添加延时，避免重复提醒
-                    await asyncio.sleep(60)
-
-            await asyncio.sleep(60)  # 每分钟检查一次
-        except Exception as e:
-            logger.error(f"提醒服务发生错误: {str(e)}")
-            await asyncio.sleep(60)
+@driver.on_startup
+async def start_reminder_dispatcher():
+    loop_watchdog.threshold = CONFIG["loop_lag_threshold_ms"] / 1000
+    loop_watchdog.start()
+    asyncio.create_task(reminder_dispatcher.run())
 
-def should_send_reminder(course: Dict[str, Any]) -> bool:
-    """
-    判断是否需要发送课程提醒
-    """
-    try:
-        now = datetime.now()
-        
-        # 解析星期几
-        weekday_map = {"周一": 0, "周二": 1, "周三": 2, "周四": 3, "周五": 4, "周六": 5, "周日": 6}
-        course_weekday = weekday_map.get(course["weekday"])
-        if course_weekday is None:
-            return False
-            
-        # 如果今天不是课程日，不发送提醒
-        if now.weekday() != course_weekday:
-            return False
-            
-        # 解析上课时间
-        time_str = course["time"]
-        if "节" in time_str:
-            # 处理"1-2节"这样的格式
-            start_section = int(time_str.split("-")[0])
-        else:
-            # 处理"8:00-9:40"这样的格式
-            start_time = datetime.strptime(time_str.split("-")[0], "%H:%M").time()
-            current_time = now.time()
-            time_diff = datetime.combine(now.date(), start_time) - datetime.combine(now.date(), current_time)
-            return 0 <= time_diff.total_seconds() <= CONFIG["remind_advance_minutes"] * 60
-            
-        # 根据节次判断时间
-        section_times = {
-            1: "8:00", 2: "8:55", 3: "10:00", 4: "10:55",
-            5: "14:00", 6: "14:55", 7: "16:00", 8: "16:55",
-            9: "19:00", 10: "19:55", 11: "20:50"
-        }
-        
-        if start_section not in section_times:
-            return False
-            
-        start_time = datetime.strptime(section_times[start_section], "%H:%M").time()
-        current_time = now.time()
-        time_diff = datetime.combine(now.date(), start_time) - datetime.combine(now.date(), current_time)
-        
-        # 在提前提醒时间内发送提醒
-        return 0 <= time_diff.total_seconds() <= CONFIG["remind_advance_minutes"] * 60
-        
-    except Exception as e:
-        logger.error(f"判断提醒时间时发生错误: {str(e)}")
-        return False
+@driver.on_shutdown
+async def stop_reminder_dispatcher():
+    await loop_watchdog.stop()
+    await reminder_dispatcher.claims.release()
 
 async def send_daily_summary(bot: Bot, user_id: str, courses: List[Dict[str, Any]]):
     """
     发送每日课程汇总
     """
     try:
-        now = datetime.now()
+        now = reminder_dispatcher.clock.now()
         tomorrow = now + timedelta(days=1)
         tomorrow_weekday = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"][tomorrow.weekday()]
         
@@ -738,21 +937,26 @@ async def send_daily_summary(bot: Bot, user_id: str, courses: List[Dict[str, Any
         if not tomorrow_courses:
             summary_msg = "明天没有课程安排，可以好好休息啦！😊"
         else:
-            summary_msg = "📚 明日课程安排：\n\n"
-            for course in tomorrow_courses:
-                summary_msg += f"⏰ {course['time']} {course['course']}\n"
-                summary_msg += f"📍 教室：{course['classroom']}\n"
-                summary_msg += f"👨‍🏫 教师：{course['teacher']}\n\n"
-            
-            summary_msg += "是否需要开启明日课程提醒？回复'是'开启提醒。"
+            summary_msg = "".join([
+                "📚 明日课程安排：\n\n",
+                SUMMARY_ENTRY.render_courses(tomorrow_courses),
+                "是否需要开启明日课程提醒？回复'是'开启提醒。"
+            ])
         
-        await bot.send_private_msg(user_id=user_id, message=Message([MessageSegment.text(summary_msg)]))
+        await tracked_send(bot.send_private_msg(user_id=user_id, message=Message([MessageSegment.text(summary_msg)])))
         
     except Exception as e:
         logger.error(f"发送每日汇总时发生错误: {str(e)}")
 
+# 查看事件循环延迟与阻塞位置
+looplag_matcher = on_command("looplag", permission=SUPERUSER)
+@looplag_matcher.handle()
+async def looplag(bot: Bot, event: Event, state: T_State):
+    await bot.send(event, Message([MessageSegment.text(loop_watchdog.summary())]))
+
 # 测试提醒指令
-@on_command("test_reminder", permission=SUPERUSER)
+test_reminder_matcher = on_command("test_reminder", permission=SUPERUSER)
+@test_reminder_matcher.handle()
 async def test_reminder(bot: Bot, event: Event, state: T_State):
     user_id = str(event.get_user_id())
     user_data = load_user_data(user_id)
@@ -768,7 +972,8 @@ async def test_reminder(bot: Bot, event: Event, state: T_State):
         await asyncio.sleep(1)
 
 # 停止提醒指令
-@on_command("stop_reminder", permission=SUPERUSER)
+stop_reminder_matcher = on_command("stop_reminder", permission=SUPERUSER)
+@stop_reminder_matcher.handle()
 async def stop_reminder(bot: Bot, event: Event, state: T_State):
     user_id = str(event.get_user_id())
     user_data = load_user_data(user_id)
@@ -777,12 +982,90 @@ async def stop_reminder(bot: Bot, event: Event, state: T_State):
     await bot.send(event, Message([MessageSegment.text("已停止课程提醒服务。")]))
 
 # 更新课程表指令
-@on_command("update_schedule", permission=SUPERUSER)
+update_schedule_matcher = on_command("update_schedule", permission=SUPERUSER)
+@update_schedule_matcher.handle()
 async def update_schedule(bot: Bot, event: Event, state: T_State):
+    message_router.expect(str(event.get_user_id()), EXPECT_SCHEDULE, chat_of(event))
     await bot.send(event, Message([MessageSegment.text("请发送新的课程表。")]))
 
+# 批量导入课程表指令：/import_schedule <花名册CSV/XLSX> <班级课程表工作簿或目录> [enable]
+import_schedule_matcher = on_command("import_schedule", permission=SUPERUSER)
+@import_schedule_matcher.handle()
+async def import_schedule(bot: Bot, event: Event, state: T_State):
+    args = event.get_plaintext().split()[1:]
+    if len(args) < 2:
+        await bot.send(event, Message([MessageSegment.text(
+            "用法：/import_schedule <花名册路径> <课程表路径> [enable]\n"
+            "花名册为 CSV/XLSX，表头包含 user_id（或 QQ）与 class（或 班级），可选 group_id；\n"
+            "课程表为每个班级一个工作表的 XLSX，或每个班级一个 Word/Excel 文件的目录；\n"
+            "加上 enable 会直接为导入的同学开启提醒。"
+        )]))
+        return
+
+    roster_path, timetable_path = args[0], args[1]
+    enable = len(args) > 2 and args[2].lower() in ("enable", "开启")
+    await bot.send(event, Message([MessageSegment.text("开始批量导入，请稍候……")]))
+    try:
+        # 文件解析与大量写入放到线程池，避免阻塞事件循环；
+        # 导入使用单独的存储实例，不与事件循环中的 schedule_store 共享缓存
+        loop = asyncio.get_running_loop()
+        report = await loop.run_in_executor(
+            None, lambda: import_roster(ScheduleStore(DATA_DIR), roster_path, timetable_path, enable_reminders=enable)
+        )
+        await loop.run_in_executor(None, refresh_calendars)
+    except Exception as e:
+        logger.error(f"批量导入失败: {str(e)}")
+        await bot.send(event, Message([MessageSegment.text(f"批量导入失败：{str(e)}")]))
+        return
+
+    msg = report.summary()
+    error_path = report.write_errors(os.path.join(DATA_DIR, f"import_errors_{time.strftime('%Y%m%d_%H%M%S')}.csv"))
+    if error_path:
+        msg += f"\n错误报告：{error_path}"
+    await bot.send(event, Message([MessageSegment.text(msg)]))
+
+# 整班改课可修改的字段
+CLASS_CHANGE_FIELDS = {"教师": "teacher", "老师": "teacher", "teacher": "teacher",
+                       "教室": "classroom", "地点": "classroom", "classroom": "classroom",
+                       "周次": "weeks", "weeks": "weeks"}
+
+class_change_matcher = on_command("class_change", aliases={"整班改课"}, permission=SUPERUSER)
+@class_change_matcher.handle()
+async def class_change(bot: Bot, event: Event, state: T_State):
+    """整班改课：修改某位同学所在班级共享课程表中的课程，引用同一课程表的同学一并生效"""
+    args = event.get_plaintext().split()[1:]
+    weekdays = [a for a in args[2:] if re.fullmatch(r"(?:周|星期)[一二三四五六日天]", a)]
+    fields = dict(a.split("=", 1) for a in args[2:] if "=" in a)
+    changes = {CLASS_CHANGE_FIELDS.get(k.strip()): v.strip() for k, v in fields.items()}
+    if len(args) < 3 or not changes or None in changes:
+        await bot.send(event, Message([MessageSegment.text(
+            "用法：/class_change <同学QQ> <课程名> [星期] 教师=新老师 教室=新教室 周次=新周次\n"
+            "例如：/class_change 123456 高等数学 周三 教室=教2-305"
+        )]))
+        return
+
+    user_id, course_name = args[0], args[1]
+    digest = schedule_store.schedule_digest(user_id)
+    if digest is None:
+        await bot.send(event, Message([MessageSegment.text(f"同学 {user_id} 还没有上传课程表。")]))
+        return
+    weekdays = {"周" + w[-1].replace("天", "日") for w in weekdays}
+    targets = {
+        course_identity(c): changes for c in schedule_store.get_raw_schedule(digest)
+        if c.get("course") == course_name and (not weekdays or c.get("weekday") in weekdays)
+    }
+    if not targets:
+        await bot.send(event, Message([MessageSegment.text(f"课程表中没有找到课程：{course_name}")]))
+        return
+    schedule_store.apply_class_change(digest, targets)
+    await asyncio.get_running_loop().run_in_executor(None, refresh_calendars)
+    await bot.send(event, Message([MessageSegment.text(
+        f"已修改 {len(targets)} 节「{course_name}」，引用该课程表的同学均已生效。"
+    )]))
+
 # 添加新的命令处理器
-@on_command("schedule", aliases={"课表"})
+show_schedule_matcher = on_command("schedule", aliases={"课表"})
+@show_schedule_matcher.handle()
 async def show_schedule(bot: Bot, event: Event, state: T_State):
     """显示完整课程表"""
     user_id = str(event.get_user_id())
@@ -792,16 +1075,37 @@ async def show_schedule(bot: Bot, event: Event, state: T_State):
         await bot.send(event, Message([MessageSegment.text("你还没有上传课程表，请发送课程表。")]))
         return
         
-    msg = "📚 你的课程表：\n\n"
-    for course in user_data["courses"]:
-        msg += f"📅 {course['weekday']} {course['time']}\n"
-        msg += f"📖 {course['course']}\n"
-        msg += f"📍 {course['classroom']}\n"
-        msg += f"👨‍🏫 {course['teacher']}\n\n"
+    msg = "📚 你的课程表：\n\n" + SCHEDULE_ENTRY.render_courses(user_data["courses"])
     
     await bot.send(event, Message([MessageSegment.text(msg)]))
 
-@on_command("today", aliases={"今日课程"})
+export_calendar_matcher = on_command("ics", aliases={"日历"})
+@export_calendar_matcher.handle()
+async def export_calendar(bot: Bot, event: Event, state: T_State):
+    """导出日历文件，可导入或订阅到手机日历"""
+    user_id = str(event.get_user_id())
+    if ics_exporter is None:
+        await bot.send(event, Message([MessageSegment.text("管理员尚未配置学期开始日期，暂不支持导出日历。")]))
+        return
+
+    path = ics_exporter.export(user_id)
+    if path is None:
+        await bot.send(event, Message([MessageSegment.text("你还没有上传课程表，请发送课程表。")]))
+        return
+
+    msg = "📅 已生成课程日历，可导入手机日历；课程表更新后日历会随之更新。"
+    if CONFIG["ics_base_url"]:
+        msg += f"\n订阅地址：{CONFIG['ics_base_url'].rstrip('/')}/{os.path.basename(path)}"
+    try:
+        # go-cqhttp / NapCat 等实现提供的上传文件接口
+        await bot.call_api("upload_private_file", user_id=int(user_id), file=os.path.abspath(path), name="课程表.ics")
+    except Exception as e:
+        logger.error(f"上传日历文件失败: {str(e)}")
+        msg += f"\n文件发送失败，文件位置：{path}"
+    await bot.send(event, Message([MessageSegment.text(msg)]))
+
+show_today_matcher = on_command("today", aliases={"今日课程"})
+@show_today_matcher.handle()
 async def show_today(bot: Bot, event: Event, state: T_State):
     """显示今日课程"""
     user_id = str(event.get_user_id())
@@ -819,10 +1123,6 @@ async def show_today(bot: Bot, event: Event, state: T_State):
     if not today_courses:
         msg = f"今天({today})没有课程安排，可以好好休息啦！😊"
     else:
-        msg = f"📚 今日({today})课程安排：\n\n"
-        for course in today_courses:
-            msg += f"⏰ {course['time']} {course['course']}\n"
-            msg += f"📍 {course['classroom']}\n"
-            msg += f"👨‍🏫 {course['teacher']}\n\n"
+        msg = f"📚 今日({today})课程安排：\n\n" + TODAY_ENTRY.render_courses(today_courses)
     
     await bot.send(event, Message([MessageSegment.text(msg)])) 
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+插件内置指标
+计数器、仪表盘与直方图，支持导出为 Prometheus 文本格式；未启用时所有记录操作直接返回
+"""
+import asyncio
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple, List, Optional, Iterator, Callable
+
+logger = logging.getLogger(__name__)
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (
+        f'{k}="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in items
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _write_text(path: str, text: str) -> Optional[str]:
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        logger.error(f"写入指标文件失败: {str(e)}")
+        return None
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """根据分桶估算分位数（取所在桶的上界）"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    指标注册表。指标名与标签在首次记录时自动创建，无需预先声明。
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        series = self._counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def add(self, name: str, delta: float, **labels):
+        """仪表盘增减（例如队列深度）"""
+        if not self.enabled:
+            return
+        series = self._gauges.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + delta
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        series = self._histograms.setdefault(name, {})
+        key = _label_key(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = _Histogram(buckets)
+        hist.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """统计代码块耗时（秒）到直方图"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, name: str, **labels) -> Callable:
+        """装饰器版本的 timer，同时支持普通函数与协程函数"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await func(*args, **kwargs)
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.observe(name, time.perf_counter() - start, **labels)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        self._counters.clear()
+        self._gauges.clear()
+        self._histograms.clear()
+
+    def render_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines: List[str] = []
+        for kind, registry in (("counter", self._counters), ("gauge", self._gauges)):
+            for name, series in sorted(registry.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(self._histograms.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, hist in series.items():
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {hist.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    async def write_prometheus(self, data_dir: str, filename: str = "metrics.prom") -> Optional[str]:
+        """
+        写入数据目录，先写临时文件再替换，避免采集端读到半个文件；
+        快照在事件循环中生成，文件写入放到线程池，不阻塞事件循环
+        """
+        if not self.enabled:
+            return None
+        text = self.render_prometheus()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _write_text, os.path.join(data_dir, filename), text)
+
+    def summary(self) -> str:
+        """生成适合在聊天中展示的简要汇总"""
+        if not self.enabled:
+            return "指标统计未启用。"
+        lines = ["📊 运行指标："]
+        for name, series in sorted(self._counters.items()):
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} = {value:g}")
+        for name, series in sorted(self._gauges.items()):
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} = {value:g}")
+        for name, series in sorted(self._histograms.items()):
+            for key, hist in series.items():
+                avg = hist.sum / hist.count if hist.count else 0
+                lines.append(
+                    f"{name}{_format_labels(key)}: n={hist.count} avg={avg * 1000:.1f}ms "
+                    f"p50≤{hist.quantile(0.5) * 1000:g}ms p99≤{hist.quantile(0.99) * 1000:g}ms"
+                )
+        return "\n".join(lines)
+
+
+# 全局指标实例，由插件根据配置启用
+metrics = Metrics()
+
+metrics.describe("kccj_scheduler_tick_seconds", "提醒调度每轮耗时")
+metrics.describe("kccj_scheduler_lag_seconds", "提醒实际发出时间相对应发时间的延迟")
+metrics.describe("kccj_reminders_total", "提醒数量，按状态(due/sent/failed)区分")
+metrics.describe("kccj_parse_seconds", "课程表解析耗时，按格式区分")
+metrics.describe("kccj_parse_tier_total", "各级解析器(template/regex/ai)识别出的课程数")
+metrics.describe("kccj_parse_ai_skipped_total", "本地解析即完整识别、无需调用AI的次数")
+metrics.describe("kccj_ai_request_seconds", "AI请求耗时")
+metrics.describe("kccj_ai_tokens_total", "AI请求消耗的token数")
+metrics.describe("kccj_ai_singleflight_leader_total", "实际发出的AI请求数（相同请求合并后的首个调用者）")
+metrics.describe("kccj_ai_singleflight_follower_total", "合并到进行中相同请求、未重复发出的AI调用数")
+metrics.describe("kccj_ai_parse_chunks_total", "长课程表切分后并发交给AI解析的块数")
+metrics.describe("kccj_storage_seconds", "用户数据读写耗时")
+metrics.describe("kccj_messages_total", "收到的消息数，按路由结果(schedule/confirm/media/ignored等)区分")
+metrics.describe("kccj_import_users_total", "批量导入的用户数")
+metrics.describe("kccj_send_queue_depth", "正在发送中的消息数")
+metrics.describe("kccj_loop_lag_seconds", "事件循环调度延迟（心跳实际醒来时间相对预期的延迟）")
+metrics.describe("kccj_loop_stalls_total", "事件循环被阻塞超过阈值的次数")
@@ -2,8 +2,8 @@
 课程表解析模块
 支持多种格式：Word、Excel、图片、纯文本
 """
-from typing import List, Dict, Optional
-import docx
+from typing import List, Dict, Optional, Any
+from bisect import bisect_right
 import aiohttp
 import re
 import os
@@ -12,53 +12,86 @@ import openpyxl
 import logging
 from PIL import Image
 import io
+from .metrics import metrics
+from .profiling import profiler
+from .docx_stream import iter_word_courses
 
 logger = logging.getLogger(__name__)
 
+# 看起来像课程表的文本才值得交给AI解析
+SCHEDULE_HINT_PATTERN = re.compile(r"周[一二三四五六日]|星期[一二三四五六日]|第\d+-\d+节")
+
+# 模板格式（插件提示用户发给豆包的课程消息模板），一门课程占多行
+TEMPLATE_PATTERN = re.compile(
+    r"星期([一二三四五六日])[^\n]*\n上课时间：([^\n]+)\n课程名称：([^\n]+)\n教师：([^\n]+)\n上课地点：([^\n]+)\n周次：([^\n]+)",
+    re.MULTILINE
+)
+
+# 单行文本格式，按顺序尝试
+TEXT_LINE_PATTERNS = [
+    # 格式1：课程名 星期 时间 教室 教师
+    re.compile(r'(.+?)\s+(周[一二三四五六日])\s+(第\d+-\d+节)\s+(.+?)\s+(.+)'),
+    # 格式2：星期 时间 课程名 教室 教师
+    re.compile(r'(周[一二三四五六日])\s+(第\d+-\d+节)\s+(.+?)\s+(.+?)\s+(.+)'),
+    # 格式3：课程名 星期时间 教室 教师
+    re.compile(r'(.+?)\s+(周[一二三四五六日]第\d+-\d+节)\s+(.+?)\s+(.+)'),
+]
+
+CONFIDENCE_FIELDS = ("weekday", "time", "course", "classroom", "teacher")
+
+@metrics.timed("kccj_parse_seconds", format="word")
+@profiler.profiled("parse")
 def parse_word(file_path: str) -> List[Dict]:
-    """解析Word课程表"""
+    """解析Word课程表：流式读取文档XML，支持每行一门课程的列表与星期×节次的网格两种表格"""
     try:
-        result = []
-        doc = docx.Document(file_path)
-        for table in doc.tables:
-            for row in table.rows[1:]:  # 跳过表头
-                cells = [cell.text.strip() for cell in row.cells]
-                if len(cells) >= 4:
-                    result.append({
-                        "weekday": extract_weekday(cells[1]),
-                        "time": cells[1],
-                        "course": cells[0],
-                        "classroom": cells[2],
-                        "teacher": cells[3]
-                    })
-        return result
+        return list(iter_word_courses(file_path))
     except Exception as e:
         logger.error(f"解析Word文件失败: {str(e)}")
         return []
 
+@metrics.timed("kccj_parse_seconds", format="xlsx")
+@profiler.profiled("parse")
 def parse_xlsx(file_path: str) -> List[Dict]:
     """解析Excel课程表"""
     try:
-        result = []
         wb = openpyxl.load_workbook(file_path)
         ws = wb.active
-        for i, row in enumerate(ws.iter_rows(values_only=True)):
-            if i == 0:
-                continue  # 跳过表头
-            cells = [str(cell).strip() if cell is not None else '' for cell in row]
-            if len(cells) >= 4:
-                result.append({
-                    "weekday": extract_weekday(cells[1]),
-                    "time": cells[1],
-                    "course": cells[0],
-                    "classroom": cells[2],
-                    "teacher": cells[3]
-                })
-        return result
+        return _parse_sheet_rows(ws.iter_rows(values_only=True))
     except Exception as e:
         logger.error(f"解析Excel文件失败: {str(e)}")
         return []
 
+@metrics.timed("kccj_parse_seconds", format="xlsx")
+def parse_xlsx_sheets(file_path: str) -> Dict[str, List[Dict]]:
+    """解析包含多个班级课程表的工作簿，每个工作表一个班级，返回 {工作表名: 课程列表}"""
+    result = {}
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        for ws in wb.worksheets:
+            result[ws.title.strip()] = _parse_sheet_rows(ws.iter_rows(values_only=True))
+    finally:
+        wb.close()
+    return result
+
+def _parse_sheet_rows(rows) -> List[Dict]:
+    """表格行格式：课程名 | 时间 | 教室 | 教师，第一行为表头"""
+    result = []
+    for i, row in enumerate(rows):
+        if i == 0:
+            continue  # 跳过表头
+        cells = [str(cell).strip() if cell is not None else '' for cell in row]
+        if len(cells) >= 4 and any(cells[:4]):  # 跳过空行
+            result.append({
+                "weekday": extract_weekday(cells[1]),
+                "time": cells[1],
+                "course": cells[0],
+                "classroom": cells[2],
+                "teacher": cells[3]
+            })
+    return result
+
+@metrics.timed("kccj_parse_seconds", format="image")
+@profiler.profiled("parse")
 async def parse_image(file_path: str, ocr_api_url: str, ocr_api_key: str = None) -> List[Dict]:
     """通过OCR识别图片课程表"""
     try:
@@ -85,6 +118,8 @@ async def parse_image(file_path: str, ocr_api_url: str, ocr_api_key: str = None)
         logger.error(f"解析图片失败: {str(e)}")
         return []
 
+@metrics.timed("kccj_parse_seconds", format="text")
+@profiler.profiled("parse")
 def parse_text_schedule(text_content: str) -> List[Dict]:
     """解析纯文本课程表"""
     try:
@@ -92,52 +127,178 @@ def parse_text_schedule(text_content: str) -> List[Dict]:
         lines = [line.strip() for line in text_content.split('\n') if line.strip()]
         
         for line in lines:
-            # 尝试多种格式匹配
-            patterns = [
-                # 格式1：课程名 星期 时间 教室 教师
-                r'(.+?)\s+(周[一二三四五六日])\s+(第\d+-\d+节)\s+(.+?)\s+(.+)',
-                # 格式2：星期 时间 课程名 教室 教师
-                r'(周[一二三四五六日])\s+(第\d+-\d+节)\s+(.+?)\s+(.+?)\s+(.+)',
-                # 格式3：课程名 星期时间 教室 教师
-                r'(.+?)\s+(周[一二三四五六日]第\d+-\d+节)\s+(.+?)\s+(.+)',
-            ]
-            
-            for pattern in patterns:
-                m = re.match(pattern, line)
-                if m:
-                    groups = m.groups()
-                    if len(groups) == 5:  # 格式1或2
-                        if "课程" in groups[0]:  # 格式1
-                            result.append({
-                                "weekday": groups[1],
-                                "time": groups[2],
-                                "course": groups[0],
-                                "classroom": groups[3],
-                                "teacher": groups[4]
-                            })
-                        else:  # 格式2
-                            result.append({
-                                "weekday": groups[0],
-                                "time": groups[1],
-                                "course": groups[2],
-                                "classroom": groups[3],
-                                "teacher": groups[4]
-                            })
-                    elif len(groups) == 4:  # 格式3
-                        result.append({
-                            "weekday": extract_weekday(groups[1]),
-                            "time": groups[1],
-                            "course": groups[0],
-                            "classroom": groups[2],
-                            "teacher": groups[3]
-                        })
-                    break
+            course = parse_text_line(line)
+            if course:
+                result.append(course)
                     
         return result
     except Exception as e:
         logger.error(f"解析文本失败: {str(e)}")
         return []
 
+def parse_text_line(line: str) -> Optional[Dict]:
+    """按单行文本格式解析一门课程，无法识别时返回 None"""
+    for pattern in TEXT_LINE_PATTERNS:
+        m = pattern.match(line)
+        if not m:
+            continue
+        groups = m.groups()
+        if len(groups) == 5:  # 格式1或2
+            if "课程" in groups[0]:  # 格式1
+                return {
+                    "weekday": groups[1],
+                    "time": groups[2],
+                    "course": groups[0],
+                    "classroom": groups[3],
+                    "teacher": groups[4]
+                }
+            # 格式2
+            return {
+                "weekday": groups[0],
+                "time": groups[1],
+                "course": groups[2],
+                "classroom": groups[3],
+                "teacher": groups[4]
+            }
+        # 格式3
+        return {
+            "weekday": extract_weekday(groups[1]),
+            "time": groups[1],
+            "course": groups[0],
+            "classroom": groups[2],
+            "teacher": groups[3]
+        }
+    return None
+
+def course_confidence(course: Dict[str, Any]) -> float:
+    """按必填字段的填充情况给单门课程打分（0~1），星期无法识别时减半"""
+    filled = sum(1 for field in CONFIDENCE_FIELDS if str(course.get(field) or "").strip())
+    score = filled / len(CONFIDENCE_FIELDS)
+    if not re.fullmatch(r"(周|星期)[一二三四五六日]", str(course.get("weekday") or "")):
+        score *= 0.5
+    return score
+
+class ParseResult:
+    """
+    分级解析的结果：记录每一行是否已被本地解析器识别，
+    未识别且看起来像课程表的连续行组成剩余文本，只有这部分需要交给AI
+    """
+    def __init__(self, text: str):
+        self.lines = text.replace("\r\n", "\n").split("\n")
+        self.courses: List[Dict] = []
+        self.confidences: List[float] = []
+        self.tiers: Dict[str, int] = {}
+        self.consumed = set()
+
+    def add(self, tier: str, course: Dict, line_numbers=(), confidence: Optional[float] = None):
+        self.courses.append(course)
+        self.confidences.append(course_confidence(course) if confidence is None else confidence)
+        self.tiers[tier] = self.tiers.get(tier, 0) + 1
+        self.consumed.update(line_numbers)
+
+    def remainder_blocks(self) -> List[List[int]]:
+        blocks, current = [], []
+        for i, line in enumerate(self.lines):
+            if i in self.consumed or not line.strip():
+                if current:
+                    blocks.append(current)
+                    current = []
+                continue
+            current.append(i)
+        if current:
+            blocks.append(current)
+        return [b for b in blocks if any(SCHEDULE_HINT_PATTERN.search(self.lines[i]) for i in b)]
+
+    @property
+    def remainder(self) -> str:
+        """本地解析器未能识别的课程相关文本"""
+        return "\n".join(
+            "\n".join(self.lines[i].strip() for i in block) for block in self.remainder_blocks()
+        )
+
+    @property
+    def needs_ai(self) -> bool:
+        return bool(self.remainder_blocks())
+
+    def take_remainder(self) -> str:
+        """取出剩余文本交给AI，这些行随后视为已处理"""
+        text = self.remainder
+        for block in self.remainder_blocks():
+            self.consumed.update(block)
+        return text
+
+    @property
+    def coverage(self) -> float:
+        """已识别行数占（已识别 + 待AI解析）行数的比例"""
+        pending = sum(len(block) for block in self.remainder_blocks())
+        consumed = len(self.consumed)
+        return consumed / (consumed + pending) if consumed + pending else 0.0
+
+    @property
+    def confidence(self) -> float:
+        if not self.confidences:
+            return 0.0
+        return self.coverage * sum(self.confidences) / len(self.confidences)
+
+@metrics.timed("kccj_parse_seconds", format="cascade")
+@profiler.profiled("parse")
+def cascade_parse(text: str, min_course_confidence: float = 0.6) -> ParseResult:
+    """
+    分级解析：先用模板格式、再用单行正则解析，每门课程按字段填充情况打分，
+    低于 min_course_confidence 的课程不采用，其所在行留给AI解析
+    """
+    result = ParseResult(text)
+    normalized = "\n".join(result.lines)
+    line_starts = [0]
+    for line in result.lines[:-1]:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+
+    for m in TEMPLATE_PATTERN.finditer(normalized):
+        day, time, name, teacher, location, weeks = (g.strip() for g in m.groups())
+        course = {
+            "weekday": f"周{day}",
+            "time": time,
+            "course": name,
+            "classroom": location,
+            "teacher": teacher,
+            "weeks": weeks
+        }
+        score = course_confidence(course)
+        if score < min_course_confidence:
+            continue
+        first = bisect_right(line_starts, m.start()) - 1
+        last = bisect_right(line_starts, m.end() - 1) - 1
+        result.add("template", course, range(first, last + 1), score)
+
+    for i, line in enumerate(result.lines):
+        if i in result.consumed or not line.strip():
+            continue
+        course = parse_text_line(line.strip())
+        if course is None:
+            continue
+        score = course_confidence(course)
+        if score >= min_course_confidence:
+            result.add("regex", course, (i,), score)
+
+    for tier, count in result.tiers.items():
+        metrics.inc("kccj_parse_tier_total", count, tier=tier)
+    return result
+
+async def ingest_schedule(text: str, ai_service=None, min_course_confidence: float = 0.6) -> ParseResult:
+    """分级解析完整流程：本地解析后，只把剩余文本交给AI"""
+    result = cascade_parse(text, min_course_confidence)
+    if not result.needs_ai:
+        metrics.inc("kccj_parse_ai_skipped_total")
+        return result
+    if ai_service is None:
+        return result
+    courses = await ai_service.parse_course_schedule(result.take_remainder()) or []
+    for course in courses:
+        result.add("ai", course)
+    if courses:
+        metrics.inc("kccj_parse_tier_total", len(courses), tier="ai")
+    return result
+
 def extract_weekday(time_str: str) -> str:
     """从时间字符串中提取星期信息"""
     weekday_pattern = r'周[一二三四五六日]'
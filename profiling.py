@@ -0,0 +1,222 @@
+"""
+按需性能剖析
+管理员指定目标（提醒轮询 / 消息处理 / 课程表解析）与次数后，接下来的 N 次调用会在
+cProfile 与 tracemalloc 下运行，结束后在线程池中生成报告并写入数据目录；未开启时只有一次字典查找的开销。
+开启后超过 arm_timeout 秒仍未完成的剖析会自动结束，不会让 tracemalloc 一直开着
+"""
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+PROFILE_TARGETS = {
+    "tick": "提醒轮询",
+    "message": "消息处理",
+    "parse": "课程表解析",
+}
+
+
+class _Session:
+    def __init__(self, target: str, count: int, top_n: int):
+        self.target = target
+        self.remaining = count
+        self.count = count
+        self.top_n = top_n
+        self.profile = cProfile.Profile()
+        self.elapsed = 0.0
+        self.baseline = tracemalloc.take_snapshot()
+
+
+class Profiler:
+    # 开启后多久仍未完成就自动结束（秒）
+    arm_timeout = 600
+
+    def __init__(self, report_dir: str = "."):
+        self.report_dir = report_dir
+        self._sessions: Dict[str, _Session] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._running: Optional[str] = None
+        self._owns_tracemalloc = False
+        # tracemalloc 的开关可能发生在生成报告的线程中
+        self._tracing_lock = threading.Lock()
+        self._pending: Set["asyncio.Future"] = set()
+        self.last_reports: Dict[str, str] = {}
+
+    def arm(self, target: str, count: int = 10, top_n: int = 20, timeout: Optional[float] = None):
+        """开启剖析：接下来 count 次 target 调用会被记录，超过 timeout 秒未完成时按已记录的部分结束"""
+        if target not in PROFILE_TARGETS:
+            raise ValueError(f"未知的剖析目标：{target}，可选：{'/'.join(PROFILE_TARGETS)}")
+        if target in self._sessions:
+            self._finish(self._pop(target))
+        with self._tracing_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                self._owns_tracemalloc = True
+        self._sessions[target] = _Session(target, max(1, count), top_n)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timers[target] = loop.call_later(timeout or self.arm_timeout, self._expire, target)
+
+    def disarm(self, target: Optional[str] = None) -> List[str]:
+        """取消剖析（不生成报告），不指定目标时取消全部；返回被取消的目标"""
+        targets = [target] if target else list(self._sessions)
+        cancelled = [t for t in targets if self._pop(t) is not None]
+        self._stop_tracing()
+        return cancelled
+
+    def _pop(self, target: str) -> Optional[_Session]:
+        timer = self._timers.pop(target, None)
+        if timer is not None:
+            timer.cancel()
+        return self._sessions.pop(target, None)
+
+    def _expire(self, target: str):
+        self._timers.pop(target, None)
+        if self._running == target:
+            # 正在记录中的调用结束后再收尾
+            self._sessions[target].remaining = 1
+            return
+        session = self._sessions.pop(target, None)
+        if session is None:
+            return
+        logger.info(f"{PROFILE_TARGETS[target]}剖析超时，按已记录的 {session.count - session.remaining} 次调用结束")
+        if session.remaining < session.count:
+            self._finish(session)
+        else:
+            self._stop_tracing()
+
+    def _stop_tracing(self):
+        """由剖析器开启的 tracemalloc 在没有进行中的剖析时关闭"""
+        with self._tracing_lock:
+            if self._owns_tracemalloc and not self._sessions:
+                tracemalloc.stop()
+                self._owns_tracemalloc = False
+
+    def status(self) -> str:
+        if not self._sessions:
+            if self._pending:
+                return "剖析已完成，报告生成中。"
+            return "当前没有进行中的性能剖析。"
+        return "\n".join(
+            f"{PROFILE_TARGETS[s.target]}({s.target})：剩余 {s.remaining}/{s.count} 次"
+            for s in self._sessions.values()
+        )
+
+    @contextmanager
+    def section(self, target: str) -> Iterator[None]:
+        """
+        在剖析开启时记录代码块；可以跨越 await 使用，
+        此时期间运行的其他协程也会被计入（cProfile 只能同时有一个处于激活状态）
+        """
+        session = self._sessions.get(target)
+        if session is None or self._running is not None:
+            yield
+            return
+
+        self._running = target
+        started = time.perf_counter()
+        session.profile.enable()
+        try:
+            yield
+        finally:
+            session.profile.disable()
+            session.elapsed += time.perf_counter() - started
+            self._running = None
+            session.remaining -= 1
+            if session.remaining <= 0 and self._sessions.get(target) is session:
+                self._finish(self._pop(target))
+
+    def profiled(self, target: str) -> Callable:
+        """装饰器版本的 section，同时支持普通函数与协程函数"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if target not in self._sessions:
+                        return await func(*args, **kwargs)
+                    with self.section(target):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if target not in self._sessions:
+                    return func(*args, **kwargs)
+                with self.section(target):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish(self, session: _Session):
+        """内存快照、统计与写文件都较慢，在线程池中完成，不阻塞事件循环"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_report(session)
+            return
+        future = loop.run_in_executor(None, self._write_report, session)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+    def _write_report(self, session: _Session):
+        try:
+            try:
+                # 剖析已被全部取消时 tracemalloc 可能已经关闭
+                snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            finally:
+                self._stop_tracing()
+
+            stats_stream = io.StringIO()
+            stats = pstats.Stats(session.profile, stream=stats_stream)
+            stats.sort_stats("cumulative").print_stats(session.top_n)
+
+            alloc_lines = []
+            if snapshot is not None:
+                for stat in snapshot.compare_to(session.baseline, "lineno")[:session.top_n]:
+                    alloc_lines.append(str(stat))
+
+            done = session.count - session.remaining
+            stamp = time.strftime("%Y%m%d_%H%M%S")
+            path = os.path.join(self.report_dir, f"profile_{session.target}_{stamp}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"目标：{session.target}  次数：{done}  总耗时：{session.elapsed:.3f}s\n\n")
+                f.write("== 累计耗时 Top ==\n")
+                f.write(stats_stream.getvalue())
+                f.write("\n== 内存分配增量 Top ==\n")
+                f.write("\n".join(alloc_lines))
+
+            self.last_reports[session.target] = self._summarize(session, stats, alloc_lines, done, path)
+            logger.info(f"性能剖析报告已写入：{path}")
+        except Exception as e:
+            logger.error(f"生成性能剖析报告失败: {str(e)}")
+
+    def _summarize(self, session: _Session, stats: pstats.Stats, alloc_lines, done: int, path: str) -> str:
+        lines = [
+            f"🔍 {PROFILE_TARGETS[session.target]}剖析完成：{done} 次，共 {session.elapsed * 1000:.1f}ms",
+            "耗时最多的函数："
+        ]
+        # stats.stats: {(file, line, func): (cc, nc, tt, ct, callers)}
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:5]
+        for (filename, lineno, func), (_, ncalls, _, cumtime, _) in top:
+            lines.append(f"• {func} ({os.path.basename(filename)}:{lineno}) {cumtime * 1000:.1f}ms / {ncalls}次")
+        if alloc_lines:
+            lines.append("内存分配最多的位置：")
+            lines.extend(f"• {line}" for line in alloc_lines[:3])
+        lines.append(f"完整报告：{path}")
+        return "\n".join(lines)
+
+
+# 全局剖析器，由插件设置报告目录
+profiler = Profiler()
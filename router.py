@@ -0,0 +1,129 @@
+"""
+消息路由
+所有消息先经过会话状态与廉价的文本预筛选，只有可能是课程表、确认回复或需要处理的文件时
+才进入解析流程；普通聊天消息不读取用户数据、不运行解析器，也不回复
+"""
+import re
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .metrics import metrics
+from .parser import SCHEDULE_HINT_PATTERN
+
+# 路由结果
+ROUTE_MEDIA = "media"
+ROUTE_SCHEDULE = "schedule"
+ROUTE_CONFIRM = "confirm"
+ROUTE_CANCEL = "cancel"
+
+# 会话状态：等待用户发送课程表 / 等待用户确认
+EXPECT_SCHEDULE = "schedule"
+EXPECT_CONFIRM = "confirm"
+
+# 课程表文本至少包含其中之一；先用子串判断，命中后才运行正则
+HINT_TOKENS = ("周", "星期", "节")
+
+
+# 群聊中主动识别课程表需要的证据：多行、多处节次，且节次与星期成行出现或涉及多个星期
+GROUP_MIN_LINES = 3
+WEEKDAY_PATTERN = re.compile(r"(?:周|星期|礼拜)([一二三四五六日天])")
+SECTION_PATTERN = re.compile(r"第?\s*[\d一二三四五六七八九十]+\s*(?:[-~至]\s*[\d一二三四五六七八九十]+\s*)?节|\d{1,2}[:：]\d{2}")
+
+
+def looks_like_schedule(text: str) -> bool:
+    return any(token in text for token in HINT_TOKENS) and SCHEDULE_HINT_PATTERN.search(text) is not None
+
+
+def looks_like_group_schedule(text: str) -> bool:
+    """
+    群聊里 "周五交作业"、"周三第3-4节在哪上课" 这样的聊天很常见，只凭一个星期或节次不能判断为课程表：
+    至少 GROUP_MIN_LINES 行同时包含星期与节次，或者（如模板格式中星期单独成行）
+    至少 GROUP_MIN_LINES 处节次且涉及两个以上的星期
+    """
+    if text.count("\n") < GROUP_MIN_LINES - 1 or not looks_like_schedule(text):
+        return False
+    sections = 0
+    paired_lines = 0
+    weekdays = set()
+    for line in text.splitlines():
+        line_sections = len(SECTION_PATTERN.findall(line))
+        line_weekdays = WEEKDAY_PATTERN.findall(line)
+        sections += line_sections
+        weekdays.update(line_weekdays)
+        if line_sections and line_weekdays:
+            paired_lines += 1
+    if sections < GROUP_MIN_LINES:
+        return False
+    return paired_lines >= GROUP_MIN_LINES or len(weekdays) >= 2
+
+
+def asked_for_schedule(private: bool, expecting: Optional[str]) -> bool:
+    """用户是否在主动发送课程表；否则（群聊中被自动识别）解析失败时不回复"""
+    return private or expecting == EXPECT_SCHEDULE
+
+
+def classify(text: str, has_media: bool = False, private: bool = True, expecting: Optional[str] = None,
+             confirm_words: Iterable[str] = ("是",), cancel_words: Iterable[str] = ()) -> Optional[str]:
+    """
+    根据会话状态与消息内容决定处理流程，返回 None 表示忽略该消息：
+    - 文件/图片只在私聊或正在等待课程表时处理，避免下载群里的每一张图片
+    - 确认/取消在等待确认时处理；确认词在私聊中总是处理（会话状态只保存在内存中，重启后也能确认）
+    - 等待课程表时任何文本都尝试解析，否则私聊中解析看起来像课程表的文本，
+      群聊中只解析有充分证据的课程表（looks_like_group_schedule）
+    """
+    if has_media:
+        return ROUTE_MEDIA if private or expecting == EXPECT_SCHEDULE else None
+    if not text:
+        return None
+    if text in confirm_words and (private or expecting == EXPECT_CONFIRM):
+        return ROUTE_CONFIRM
+    if text in cancel_words and expecting == EXPECT_CONFIRM:
+        return ROUTE_CANCEL
+    if expecting == EXPECT_SCHEDULE:
+        return ROUTE_SCHEDULE
+    if looks_like_schedule(text) if private else looks_like_group_schedule(text):
+        return ROUTE_SCHEDULE
+    return None
+
+
+class MessageRouter:
+    """
+    保存每个会话的状态（带过期时间，只在内存中），并据此路由消息。
+    会话为 (用户ID, 群号)，私聊的群号为 None：同一位同学在一个群里发送的课程表，
+    只有在该群里的回复才会被当作确认；expect 时可附带上下文（如课程表发送所在的群）
+    """
+    def __init__(self, confirm_words: Iterable[str] = ("是",), cancel_words: Iterable[str] = (),
+                 ttl: float = 86400):
+        self.confirm_words = frozenset(confirm_words)
+        self.cancel_words = frozenset(cancel_words)
+        self.ttl = ttl
+        self._states: Dict[Tuple[str, Optional[str]], Tuple[str, float, Dict[str, Any]]] = {}
+
+    def expect(self, user_id: str, state: str, chat_id: Optional[str] = None, **context: Any):
+        self._states[(user_id, chat_id)] = (state, time.time() + self.ttl, context)
+
+    def clear(self, user_id: str, chat_id: Optional[str] = None):
+        self._states.pop((user_id, chat_id), None)
+
+    def _entry(self, user_id: str, chat_id: Optional[str]) -> Optional[Tuple[str, float, Dict[str, Any]]]:
+        key = (user_id, chat_id)
+        entry = self._states.get(key)
+        if entry is not None and entry[1] < time.time():
+            del self._states[key]
+            return None
+        return entry
+
+    def state(self, user_id: str, chat_id: Optional[str] = None) -> Optional[str]:
+        entry = self._entry(user_id, chat_id)
+        return entry[0] if entry else None
+
+    def context(self, user_id: str, chat_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """expect 时附带的上下文，会话不存在或已过期时返回 None"""
+        entry = self._entry(user_id, chat_id)
+        return entry[2] if entry else None
+
+    def route(self, user_id: str, text: str, has_media: bool = False, chat_id: Optional[str] = None) -> Optional[str]:
+        route = classify(text, has_media, chat_id is None, self.state(user_id, chat_id),
+                         self.confirm_words, self.cancel_words)
+        metrics.inc("kccj_messages_total", route=route or "ignored")
+        return route
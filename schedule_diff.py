@@ -0,0 +1,103 @@
+"""
+课程表增量对比
+以 (星期, 节次, 课程名) 为键比较新旧课程表，只把新增/删除/变更的课程应用到存储与调度，
+未变化的课程保留原对象与已有状态（提醒认领记录等）
+"""
+from typing import Any, Dict, List, Tuple
+
+from .storage import canonical_course, course_identity
+
+# 课程变更摘要中展示的字段名
+FIELD_LABELS = {
+    "teacher": "教师",
+    "classroom": "教室",
+    "location": "教室",
+    "weeks": "周次",
+}
+
+
+def _as_dict(course: Any) -> Dict[str, Any]:
+    return course if isinstance(course, dict) else course.to_dict()
+
+
+class ScheduleDiff:
+    """
+    added/removed 为课程列表，changed 为 (旧课程, 新课程) 列表；
+    unchanged 保留旧课程表中的原对象
+    """
+    def __init__(self):
+        self.added: List[Any] = []
+        self.removed: List[Any] = []
+        self.changed: List[Tuple[Any, Any]] = []
+        self.unchanged: List[Any] = []
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
+    @property
+    def change_count(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    @staticmethod
+    def changed_fields(old: Any, new: Any) -> Dict[str, Any]:
+        old_d, new_d = canonical_course(old), canonical_course(new)
+        return {k: v for k, v in new_d.items() if old_d.get(k) != v}
+
+    def apply(self) -> List[Any]:
+        """返回应用变更后的课程表：未变化课程沿用旧对象，变更课程替换为新对象"""
+        return self.unchanged + [new for _, new in self.changed] + self.added
+
+    def summary(self) -> str:
+        """生成紧凑的变更说明，只列出有变化的课程"""
+        if self.is_empty:
+            return "课程表没有变化。"
+        lines = [
+            f"课程表已更新：新增 {len(self.added)} 门，删除 {len(self.removed)} 门，"
+            f"变更 {len(self.changed)} 门，{len(self.unchanged)} 门未变。"
+        ]
+        for course in self.added:
+            lines.append(f"➕ {_describe(course)}")
+        for course in self.removed:
+            lines.append(f"➖ {_describe(course)}")
+        for old, new in self.changed:
+            parts = []
+            old_d = _as_dict(old)
+            for key, value in self.changed_fields(old, new).items():
+                parts.append(f"{FIELD_LABELS.get(key, key)}：{old_d.get(key, '')}→{value}")
+            lines.append(f"✏️ {_describe(new)}（{'，'.join(parts)}）")
+        return "\n".join(lines)
+
+
+def _describe(course: Any) -> str:
+    d = _as_dict(course)
+    weekday = d.get("weekday", d.get("day", ""))
+    if weekday and not weekday.startswith(("周", "星期")):
+        weekday = "星期" + weekday
+    return f"{weekday} {d.get('time', '')} {d.get('course', d.get('name', ''))}"
+
+
+def diff_schedules(old: List[Any], new: List[Any]) -> ScheduleDiff:
+    """比较新旧课程表；同一键出现多次时按出现顺序一一对应"""
+    diff = ScheduleDiff()
+    # 先规范化空白与星期写法，避免 "星期一"/"周一" 被当作不同课程
+    old_by_key: Dict[str, List[Tuple[Any, Dict[str, Any]]]] = {}
+    for course in old:
+        canonical = canonical_course(course)
+        old_by_key.setdefault(course_identity(canonical), []).append((course, canonical))
+
+    for course in new:
+        canonical = canonical_course(course)
+        candidates = old_by_key.get(course_identity(canonical))
+        if not candidates:
+            diff.added.append(course)
+            continue
+        previous, previous_canonical = candidates.pop(0)
+        if previous_canonical == canonical:
+            diff.unchanged.append(previous)
+        else:
+            diff.changed.append((previous, course))
+
+    for candidates in old_by_key.values():
+        diff.removed.extend(course for course, _ in candidates)
+    return diff
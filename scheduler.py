@@ -0,0 +1,488 @@
+"""
+提醒调度
+统一的提醒分发循环，以及多进程/多实例部署时基于 SQLite 租约的用户分片与提醒认领。
+调度代码通过可注入的时钟读取当前时间与等待，仿真时换成虚拟时钟即可快速回放整个学期
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 节次对应的上课时间
+SECTION_TIMES = {
+    1: "8:00", 2: "8:55", 3: "10:00", 4: "10:55",
+    5: "14:00", 6: "14:55", 7: "16:00", 8: "16:55",
+    9: "19:00", 10: "19:55", 11: "20:50"
+}
+
+WEEKDAY_MAP = {"周一": 0, "周二": 1, "周三": 2, "周四": 3, "周五": 4, "周六": 5, "周日": 6}
+
+# 每轮调度都要换算上课时间，预先解析作息表，避免反复调用 strptime
+_SECTION_START = {section: datetime.strptime(t, "%H:%M").time() for section, t in SECTION_TIMES.items()}
+_SECTION_PATTERN = re.compile(r"(\d+)\s*(?:-\s*\d+)?\s*节")
+
+
+class SystemClock:
+    """真实时钟"""
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    虚拟时钟：时间只在仿真驱动调用 advance_to 或调度循环调用 sleep 时前进，
+    sleep 不会真正等待，只让出一次事件循环
+    """
+    def __init__(self, start: datetime):
+        self._now = start
+
+    def now(self) -> datetime:
+        return self._now
+
+    def time(self) -> float:
+        return self._now.timestamp()
+
+    def advance_to(self, when: datetime):
+        if when > self._now:
+            self._now = when
+
+    async def sleep(self, seconds: float):
+        self._now += timedelta(seconds=seconds)
+        await asyncio.sleep(0)
+
+
+system_clock = SystemClock()
+
+
+def seconds_until_next_tick(clock, interval: float = 60) -> float:
+    """
+    距下一个 interval 整数倍时刻（默认即下一个整分钟）的秒数。轮询循环按此等待而不是固定 sleep(interval)，
+    每轮处理耗时不会累积成漂移，也就不会跳过 23:00 这样按整分钟判断的时刻
+    """
+    return interval - clock.time() % interval
+
+
+def get_course_start_time(course: Dict[str, Any], now: datetime) -> Optional[datetime]:
+    """
+    计算课程在 now 当天的上课时间，无法识别时返回 None
+    """
+    time_str = course["time"]
+    if "节" in time_str:
+        # 处理"1-2节"、"第1-2节"这样的格式
+        m = _SECTION_PATTERN.search(time_str)
+        start_time = _SECTION_START.get(int(m.group(1))) if m else None
+        if start_time is None:
+            return None
+    else:
+        # 处理"8:00-9:40"这样的格式
+        start_time = datetime.strptime(time_str.split("-")[0], "%H:%M").time()
+    return datetime.combine(now.date(), start_time)
+
+
+def should_send_reminder(course: Dict[str, Any], now: Optional[datetime] = None,
+                         advance_minutes: int = 30) -> bool:
+    """
+    判断是否需要发送课程提醒
+    """
+    try:
+        now = now or datetime.now()
+
+        # 如果今天不是课程日，不发送提醒
+        course_weekday = WEEKDAY_MAP.get(course["weekday"])
+        if course_weekday is None or now.weekday() != course_weekday:
+            return False
+
+        start_time = get_course_start_time(course, now)
+        if start_time is None:
+            return False
+        time_diff = start_time - now
+
+        # 在提前提醒时间内发送提醒
+        return 0 <= time_diff.total_seconds() <= advance_minutes * 60
+
+    except Exception as e:
+        logger.error(f"判断提醒时间时发生错误: {str(e)}")
+        return False
+
+
+def reminder_key(user_id: str, course: Dict[str, Any], day) -> str:
+    """同一用户同一天同一门课的提醒只发一次"""
+    return f"remind|{user_id}|{day}|{course['weekday']}|{course['time']}|{course['course']}"
+
+
+class LocalClaims:
+    """
+    单进程部署：所有用户都归本进程，提醒认领记录保存在内存中
+    """
+    def __init__(self, clock=None):
+        self.clock = clock or system_clock
+        self._claimed: Dict[str, float] = {}
+        self._last_prune = self.clock.time()
+
+    async def heartbeat(self):
+        # 清理两天前的认领记录
+        now = self.clock.time()
+        if now - self._last_prune > 3600:
+            cutoff = now - 2 * 86400
+            self._claimed = {k: t for k, t in self._claimed.items() if t >= cutoff}
+            self._last_prune = now
+
+    def owns(self, shard_key: str) -> bool:
+        return True
+
+    async def claim_many(self, keys: Iterable[str]) -> Set[str]:
+        now = self.clock.time()
+        claimed = set()
+        for key in keys:
+            if key not in self._claimed:
+                self._claimed[key] = now
+                claimed.add(key)
+        return claimed
+
+    async def unclaim_many(self, keys: Iterable[str]):
+        for key in keys:
+            self._claimed.pop(key, None)
+
+    async def release(self):
+        pass
+
+
+class ShardCoordinator:
+    """
+    多进程/多实例部署：各 worker 通过共享 SQLite 数据库续租，
+    用户按会合哈希（rendezvous hashing）分配给当前存活的 worker；
+    worker 停止续租超过 lease_seconds 后，其用户自动分摊给其余 worker。
+    每条提醒发送前都要在数据库中认领，重新分片的过渡期内也不会重复发送。
+
+    数据库操作（最长要等待 10 秒的写锁）都在线程池中执行，不阻塞事件循环；
+    每轮的全部认领在一个事务里批量完成。
+    """
+    def __init__(self, db_path: str, worker_id: Optional[str] = None, lease_seconds: float = 180):
+        self.db_path = db_path
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self._workers: List[str] = [self.worker_id]
+        self._last_prune = 0.0
+        # 同一个连接会被线程池中的不同线程使用，逐个执行
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reminder_claims ("
+            "claim_key TEXT PRIMARY KEY, worker_id TEXT NOT NULL, claimed_at REAL NOT NULL)"
+        )
+
+    async def _run(self, func: Callable, *args):
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    async def heartbeat(self):
+        """续租并刷新存活 worker 列表，每轮调度开始时调用"""
+        await self._run(self._heartbeat)
+
+    def _heartbeat(self):
+        now = time.time()
+        try:
+            self._conn.execute(
+                "INSERT INTO workers (worker_id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.worker_id, now)
+            )
+            rows = self._conn.execute(
+                "SELECT worker_id FROM workers WHERE heartbeat >= ? ORDER BY worker_id",
+                (now - self.lease_seconds,)
+            ).fetchall()
+            workers = [row[0] for row in rows]
+            if workers != self._workers:
+                logger.info(f"提醒分片重新分配，当前存活 worker：{len(workers)} 个")
+            self._workers = workers or [self.worker_id]
+            if now - self._last_prune > 3600:
+                self._conn.execute("DELETE FROM reminder_claims WHERE claimed_at < ?", (now - 2 * 86400,))
+                self._conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - 86400,))
+                self._last_prune = now
+        except sqlite3.Error as e:
+            logger.error(f"分片续租失败: {str(e)}")
+
+    @staticmethod
+    def _weight(worker_id: str, user_id: str) -> int:
+        digest = hashlib.blake2b(f"{worker_id}|{user_id}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def owns(self, shard_key: str) -> bool:
+        owner = max(self._workers, key=lambda w: self._weight(w, shard_key))
+        return owner == self.worker_id
+
+    async def claim_many(self, keys: Iterable[str]) -> Set[str]:
+        """批量认领，返回本 worker 认领成功的键"""
+        keys = list(keys)
+        if not keys:
+            return set()
+        return await self._run(self._claim_many, keys)
+
+    def _claim_many(self, keys: List[str]) -> Set[str]:
+        now = time.time()
+        claimed = set()
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO reminder_claims (claim_key, worker_id, claimed_at) VALUES (?, ?, ?)",
+                        (key, self.worker_id, now)
+                    )
+                    if cursor.rowcount == 1:
+                        claimed.add(key)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.error(f"认领提醒失败: {str(e)}")
+            return set()
+        return claimed
+
+    async def unclaim_many(self, keys: Iterable[str]):
+        """发送失败时撤销认领，下一轮可以重试"""
+        keys = [(key,) for key in keys]
+        if keys:
+            await self._run(self._unclaim_many, keys)
+
+    def _unclaim_many(self, keys: List[tuple]):
+        try:
+            self._conn.executemany("DELETE FROM reminder_claims WHERE claim_key = ?", keys)
+        except sqlite3.Error as e:
+            logger.error(f"撤销提醒认领失败: {str(e)}")
+
+    async def release(self):
+        """正常退出时注销，其余 worker 下一轮即可接管"""
+        await self._run(self._release)
+
+    def _release(self):
+        try:
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        except sqlite3.Error as e:
+            logger.error(f"注销分片失败: {str(e)}")
+
+
+class ReminderJob:
+    """
+    一次待发送的提醒；kind 为 summary / reminder / group。
+    群提醒的 keys 依次为群级别的键与 user_ids 中每位同学的提醒键
+    """
+    __slots__ = ("kind", "user_ids", "payload", "keys", "group_id")
+
+    def __init__(self, kind: str, user_id: str, payload: Any, key: str, group_id: Optional[str] = None):
+        self.kind = kind
+        self.user_ids = [user_id]
+        self.payload = payload
+        self.keys = [key]
+        self.group_id = group_id
+
+
+def group_fanin_key(group_id: str, course: Dict[str, Any], day) -> str:
+    """同一群、同一天、同一时间地点的同一门课只发一条群提醒"""
+    return f"group|{group_id}|{day}|{course['weekday']}|{course['time']}|{course['course']}|{course.get('classroom', '')}"
+
+
+class ReminderDispatcher:
+    """
+    提醒分发循环：每轮遍历本 worker 负责的用户，认领并发送到期的课程提醒与每日汇总。
+    发送方式与数据读取都通过回调注入，便于在不同的机器人框架或测试中复用。
+
+    提供 send_group_reminder 时启用群聊合并：在同一个群里开启提醒、且课程/时间/地点都相同的
+    多名同学只会收到一条群提醒（可 @ 所有相关同学），而不是每人一条私聊。
+    此时用户按所在的群分片，同一个群的全部成员由同一个 worker 收集，认领群提醒的 worker
+    总能 @ 到所有相关同学。group_index 返回用户ID到所在群的索引（如 ScheduleStore.user_groups），
+    索引中的用户不属于本 worker 时不读取其数据；不在索引中的用户仍读取数据后再判断。
+
+    clock 默认为真实时钟；传入 VirtualClock 时 run() 不会真正等待，可用于仿真。
+    """
+    def __init__(self,
+                 list_users: Callable[[], Iterable[str]],
+                 load_user: Callable[[str], Dict[str, Any]],
+                 send_reminder: Callable[[str, Dict[str, Any], datetime], Awaitable[None]],
+                 send_summary: Callable[[str, List[Dict[str, Any]]], Awaitable[None]],
+                 claims=None,
+                 advance_minutes: int = 30,
+                 summary_time: tuple = (23, 0),
+                 max_concurrent_sends: int = 32,
+                 send_group_reminder: Optional[Callable[[str, Dict[str, Any], List[str], datetime], Awaitable[None]]] = None,
+                 min_group_size: int = 2,
+                 group_index: Optional[Callable[[], Dict[str, Optional[str]]]] = None,
+                 clock=None):
+        self.list_users = list_users
+        self.load_user = load_user
+        self.send_reminder = send_reminder
+        self.send_summary = send_summary
+        self.send_group_reminder = send_group_reminder
+        self.min_group_size = min_group_size
+        self.group_index = group_index
+        self.claims = claims or LocalClaims()
+        self.advance_minutes = advance_minutes
+        self.summary_time = summary_time
+        self.clock = clock or system_clock
+        self._send_semaphore = asyncio.Semaphore(max_concurrent_sends)
+
+    def shard_key(self, user_id: str, group_id: Optional[str]) -> str:
+        """启用群聊合并时，同一个群的同学归同一个 worker"""
+        if self.send_group_reminder is not None and group_id:
+            return f"group|{group_id}"
+        return user_id
+
+    def due_jobs(self, now: datetime) -> List[ReminderJob]:
+        """找出本 worker 负责的、本轮到期的提醒（尚未认领）"""
+        jobs = []
+        summary_due = (now.hour, now.minute) == tuple(self.summary_time)
+        # 同班同学共用同一个课程列表对象（课程表按内容共享存储），每个列表每轮只判断一次
+        due_by_list: Dict[int, tuple] = {}
+        groups = self.group_index() if self.send_group_reminder is not None and self.group_index else {}
+        for user_id in self.list_users():
+            if self.send_group_reminder is None:
+                if not self.claims.owns(user_id):
+                    continue
+                user_data = self.load_user(user_id)
+            else:
+                if user_id in groups and not self.claims.owns(self.shard_key(user_id, groups[user_id])):
+                    continue
+                # 不在索引中的用户需要先读出所在的群；索引可能落后于用户文件，读出后以文件为准
+                user_data = self.load_user(user_id)
+                if not self.claims.owns(self.shard_key(user_id, user_data.get("group_id"))):
+                    continue
+            if not user_data.get("reminder_enabled"):
+                continue
+            courses = user_data.get("courses", [])
+            if summary_due:
+                jobs.append(ReminderJob("summary", user_id, courses, f"summary|{user_id}|{now.date()}"))
+            cached = due_by_list.get(id(courses))
+            if cached is None or cached[0] is not courses:
+                cached = due_by_list[id(courses)] = (
+                    courses, [c for c in courses if should_send_reminder(c, now, self.advance_minutes)]
+                )
+            for course in cached[1]:
+                jobs.append(ReminderJob("reminder", user_id, course, reminder_key(user_id, course, now.date()),
+                                        user_data.get("group_id")))
+        return jobs
+
+    async def collect_due(self, now: datetime) -> List[ReminderJob]:
+        """找出本轮需要发送的提醒，合并群提醒后在一次批量操作中认领"""
+        # 遍历用户会读取大量文件，放到线程中执行，避免阻塞事件循环
+        jobs = self.fan_in(await asyncio.to_thread(self.due_jobs, now), now)
+        claimed = await self.claims.claim_many(key for job in jobs for key in job.keys)
+        result = []
+        for job in jobs:
+            if job.kind != "group":
+                if job.keys[0] in claimed:
+                    result.append(job)
+                continue
+            # 已经单独提醒过的同学（群内人数在提醒窗口中途才达到合并阈值）不再 @
+            members = [(user_id, key) for user_id, key in zip(job.user_ids, job.keys[1:]) if key in claimed]
+            if job.keys[0] in claimed and len(members) >= self.min_group_size:
+                job.user_ids = [user_id for user_id, _ in members]
+                job.keys = job.keys[:1] + [key for _, key in members]
+                result.append(job)
+            else:
+                # 群提醒已由其他 worker 发出或剩余人数不足，其余同学单独提醒
+                result.extend(ReminderJob("reminder", user_id, job.payload, key, job.group_id)
+                              for user_id, key in members)
+        return result
+
+    async def forget(self, user_id: str, courses: Iterable[Dict[str, Any]], day):
+        """
+        课程表增量更新后调用：撤销变更课程当天的提醒认领，使更新后的课程信息可以重新提醒；
+        未变化课程的认领保持不变，不会重复提醒
+        """
+        await self.claims.unclaim_many(reminder_key(user_id, course, day) for course in courses)
+
+    def fan_in(self, jobs: List[ReminderJob], now: datetime) -> List[ReminderJob]:
+        """
+        把同一群内相同课程、时间、地点的提醒合并为一条群提醒，群提醒同时认领群级别的键与每位同学的键，
+        每位同学无论收到群提醒还是私聊提醒都只提醒一次；
+        群的全部成员都在本 worker 上，不会因为另一个 worker 先认领而漏掉 @
+        """
+        if self.send_group_reminder is None:
+            return jobs
+        result = []
+        buckets: Dict[tuple, ReminderJob] = {}
+        for job in jobs:
+            if job.kind != "reminder" or not job.group_id:
+                result.append(job)
+                continue
+            course = job.payload
+            bucket_key = (job.group_id, course["weekday"], course["time"], course["course"], course.get("classroom", ""))
+            bucket = buckets.get(bucket_key)
+            if bucket is None:
+                buckets[bucket_key] = job
+            else:
+                bucket.user_ids.extend(job.user_ids)
+                bucket.keys.extend(job.keys)
+
+        for job in buckets.values():
+            if len(job.user_ids) >= self.min_group_size:
+                # 重新分片的过渡期内两个 worker 可能都收集了这个群，群提醒本身也要认领
+                job.kind = "group"
+                job.keys.insert(0, group_fanin_key(job.group_id, job.payload, now.date()))
+            result.append(job)
+        return result
+
+    async def _run_job(self, job: ReminderJob, now: datetime):
+        async with self._send_semaphore:
+            try:
+                if job.kind == "summary":
+                    await self.send_summary(job.user_ids[0], job.payload)
+                    return
+                metrics.inc("kccj_reminders_total", len(job.user_ids), status="due")
+                start_time = get_course_start_time(job.payload, now)
+                if job.kind == "group":
+                    await self.send_group_reminder(job.group_id, job.payload, job.user_ids, start_time)
+                    metrics.inc("kccj_group_reminders_total")
+                    metrics.inc("kccj_reminders_total", len(job.user_ids), status="merged")
+                else:
+                    await self.send_reminder(job.user_ids[0], job.payload, start_time)
+                metrics.inc("kccj_reminders_total", len(job.user_ids), status="sent")
+                due_time = start_time - timedelta(minutes=self.advance_minutes)
+                metrics.observe("kccj_scheduler_lag_seconds", max(0.0, (self.clock.now() - due_time).total_seconds()))
+            except Exception as e:
+                if job.kind != "summary":
+                    metrics.inc("kccj_reminders_total", len(job.user_ids), status="failed")
+                await self.claims.unclaim_many(job.keys)
+                logger.error(f"发送提醒失败({job.kind}, {job.group_id or job.user_ids[0]}): {str(e)}")
+
+    async def tick(self, now: datetime):
+        tick_started = time.perf_counter()
+        await self.claims.heartbeat()
+        jobs = await self.collect_due(now)
+        if jobs:
+            await asyncio.gather(*(self._run_job(job, now) for job in jobs))
+        metrics.observe("kccj_scheduler_tick_seconds", time.perf_counter() - tick_started, loop="dispatcher")
+
+    async def run(self, interval: float = 60):
+        """每轮对齐到 interval 的整数倍时刻（整分钟）"""
+        while True:
+            try:
+                await self.tick(self.clock.now())
+            except Exception as e:
+                logger.error(f"提醒服务发生错误: {str(e)}")
+            await self.clock.sleep(seconds_until_next_tick(self.clock, interval))
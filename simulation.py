@@ -0,0 +1,341 @@
+"""
+虚拟时钟仿真
+在虚拟时钟上运行 ReminderDispatcher.run()：调度循环照常每个整分钟等待一次，时钟只在可能发生事件的
+轮询（提醒窗口开始/结束、每日汇总）处唤醒它，几秒内回放数千名同学一整个学期的提醒；输出完整的发送记录，
+并与按课程表独立推算的应发提醒、每日汇总对比，统计漏发、重复与迟发，可直接放进 CI。
+
+    python -m kccj.simulation --users 2000 --weeks 16 --send-log sends.jsonl
+
+存在漏发/重复/迟发时以非零状态退出。
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .scheduler import (
+    LocalClaims, ReminderDispatcher, SECTION_TIMES, VirtualClock, WEEKDAY_MAP,
+    get_course_start_time, reminder_key
+)
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = list(WEEKDAY_MAP)
+# 仿真课程使用的节次（每两节一门课）
+SIM_SECTIONS = [s for s in (1, 3, 5, 7, 9) if s + 1 in SECTION_TIMES]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+def build_users(users: int, class_size: int = 40, courses_per_class: int = 12,
+                group_share: float = 0.5, seed: int = 0) -> Dict[str, Dict[str, Any]]:
+    """生成同学数据：同班同学共用一份课程表（同一个列表对象），部分同学在班级群里开启提醒"""
+    rng = random.Random(seed)
+    schedules: Dict[int, List[Dict[str, str]]] = {}
+    data = {}
+    for index in range(users):
+        class_index = index // class_size
+        if class_index not in schedules:
+            slots = rng.sample([(d, s) for d in WEEKDAYS for s in SIM_SECTIONS],
+                               min(courses_per_class, len(WEEKDAYS) * len(SIM_SECTIONS)))
+            schedules[class_index] = [
+                {
+                    "weekday": weekday,
+                    "time": f"第{section}-{section + 1}节",
+                    "course": f"课程{class_index}-{n}",
+                    "classroom": f"教{class_index % 9 + 1}-{100 + n}",
+                    "teacher": f"老师{n}",
+                }
+                for n, (weekday, section) in enumerate(sorted(slots))
+            ]
+        user = {"courses": schedules[class_index], "reminder_enabled": True}
+        if rng.random() < group_share:
+            user["group_id"] = str(900_000 + class_index)
+        data[str(10_000_000 + index)] = user
+    return data
+
+
+def poll_times(users: Dict[str, Dict[str, Any]], first_day: date, days: int, advance_minutes: int,
+               summary_time: Tuple[int, int], interval: int = 60, offset: int = 0) -> List[datetime]:
+    """
+    真实调度循环在每个整分钟轮询一次，offset 为每次唤醒相对整分钟的延迟（秒）。只回放可能发生事件的轮询：
+    每个提醒窗口内的第一次与最后一次轮询，以及每日汇总时刻的轮询；其余轮询不会发出任何消息
+    """
+    starts: Set[Tuple[int, str]] = set()
+    for user in users.values():
+        for course in user.get("courses", []):
+            weekday = WEEKDAY_MAP.get(course["weekday"])
+            if weekday is not None:
+                starts.add((weekday, course["time"]))
+
+    def first_poll_at_or_after(when: datetime) -> datetime:
+        base = when.replace(second=0, microsecond=0) + timedelta(seconds=offset)
+        return base if base >= when else base + timedelta(seconds=interval)
+
+    def last_poll_at_or_before(when: datetime) -> datetime:
+        base = when.replace(second=0, microsecond=0) + timedelta(seconds=offset)
+        return base if base <= when else base - timedelta(seconds=interval)
+
+    times = set()
+    for n in range(days):
+        day = first_day + timedelta(days=n)
+        midnight = datetime.combine(day, datetime.min.time())
+        for weekday, time_str in starts:
+            if weekday != day.weekday():
+                continue
+            start = get_course_start_time({"time": time_str}, midnight)
+            if start is None:
+                continue
+            times.add(first_poll_at_or_after(start - timedelta(minutes=advance_minutes)))
+            times.add(last_poll_at_or_before(start))
+        times.add(first_poll_at_or_after(midnight.replace(hour=summary_time[0], minute=summary_time[1])))
+    return sorted(times)
+
+
+class EventClock(VirtualClock):
+    """
+    只在给定的轮询时刻唤醒调度循环的虚拟时钟：sleep 到期后跳到不早于到期时刻的下一个轮询时刻，
+    中间不会发出任何消息的轮询直接跳过。轮询时刻用完后 finished 被置位，调度循环停在最后一次 sleep 中。
+
+    每轮从唤醒到下一次 sleep 的实际耗时（即每轮调度的处理时间）记入 tick_seconds，并计入虚拟时间，
+    调度循环按推进后的时间计算下一次等待
+    """
+    def __init__(self, start: datetime, wakeups: List[datetime]):
+        super().__init__(start)
+        self.wakeups = wakeups
+        self.finished = asyncio.Event()
+        self.tick_seconds: List[float] = []
+        self._woke: Optional[float] = None
+
+    async def sleep(self, seconds: float):
+        if self._woke is not None:
+            elapsed = time.perf_counter() - self._woke
+            self.tick_seconds.append(elapsed)
+            self._now += timedelta(seconds=elapsed)
+        index = bisect.bisect_left(self.wakeups, self._now + timedelta(seconds=seconds))
+        if index == len(self.wakeups):
+            self.finished.set()
+            await asyncio.Future()
+        self._now = self.wakeups[index]
+        await asyncio.sleep(0)
+        self._woke = time.perf_counter()
+
+
+class SendLog:
+    """记录每一条发出的消息（虚拟时间），并按用户展开群提醒"""
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.entries: List[Dict[str, Any]] = []
+        self.reminders: Dict[str, List[datetime]] = {}  # reminder_key -> 各次送达时间
+        self.summaries: Dict[str, int] = {}  # "用户|日期" -> 次数
+
+    def _reminded(self, user_id: str, course: Dict[str, Any], at: datetime):
+        self.reminders.setdefault(reminder_key(user_id, course, at.date()), []).append(at)
+
+    async def send_reminder(self, user_id: str, course: Dict[str, Any], start_time: datetime):
+        at = self.clock.now()
+        self.entries.append({"at": at.isoformat(), "kind": "private", "to": user_id,
+                             "course": course["course"], "start": start_time.isoformat()})
+        self._reminded(user_id, course, at)
+
+    async def send_group_reminder(self, group_id: str, course: Dict[str, Any], user_ids: List[str],
+                                  start_time: datetime):
+        at = self.clock.now()
+        self.entries.append({"at": at.isoformat(), "kind": "group", "to": group_id, "users": list(user_ids),
+                             "course": course["course"], "start": start_time.isoformat()})
+        for user_id in user_ids:
+            self._reminded(user_id, course, at)
+
+    async def send_summary(self, user_id: str, courses: List[Dict[str, Any]]):
+        at = self.clock.now()
+        self.entries.append({"at": at.isoformat(), "kind": "summary", "to": user_id})
+        key = f"{user_id}|{at.date()}"
+        self.summaries[key] = self.summaries.get(key, 0) + 1
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def verify(users: Dict[str, Dict[str, Any]], log: SendLog, first_day: date, days: int,
+           advance_minutes: int) -> Dict[str, Any]:
+    """按课程表独立推算每条应发提醒与每位同学每天的汇总，与发送记录逐条对比"""
+    expected = 0
+    missed: List[str] = []
+    expected_summaries = 0
+    missed_summaries: List[str] = []
+    late: List[str] = []
+    lateness: List[float] = []
+    for n in range(days):
+        day = first_day + timedelta(days=n)
+        midnight = datetime.combine(day, datetime.min.time())
+        for user_id, user in users.items():
+            if not user.get("reminder_enabled"):
+                continue
+            expected_summaries += 1
+            if f"{user_id}|{day}" not in log.summaries:
+                missed_summaries.append(f"summary|{user_id}|{day}")
+            for course in user.get("courses", []):
+                if WEEKDAY_MAP.get(course["weekday"]) != day.weekday():
+                    continue
+                start = get_course_start_time(course, midnight)
+                if start is None:
+                    continue
+                expected += 1
+                key = reminder_key(user_id, course, day)
+                sent = log.reminders.get(key)
+                if not sent:
+                    missed.append(key)
+                    continue
+                due = start - timedelta(minutes=advance_minutes)
+                lateness.append((sent[0] - due).total_seconds())
+                if not due <= sent[0] <= start:
+                    late.append(key)
+    duplicates = [key for key, sent in log.reminders.items() if len(sent) > 1]
+    return {
+        "expected": expected,
+        "delivered": sum(len(sent) for sent in log.reminders.values()),
+        "missed": len(missed),
+        "duplicates": len(duplicates),
+        "late": len(late),
+        "lateness_p50_s": _percentile(lateness, 0.5),
+        "lateness_p99_s": _percentile(lateness, 0.99),
+        "lateness_max_s": max(lateness, default=0.0),
+        "summaries_expected": expected_summaries,
+        "summaries": sum(log.summaries.values()),
+        "summary_missed": len(missed_summaries),
+        "summary_duplicates": sum(1 for count in log.summaries.values() if count > 1),
+        "examples": {"missed": missed[:5], "duplicates": duplicates[:5], "late": late[:5],
+                     "summary_missed": missed_summaries[:5]},
+    }
+
+
+async def simulate_semester(users: int = 2000, weeks: int = 16, semester_start: Optional[date] = None,
+                            class_size: int = 40, courses_per_class: int = 12, group_share: float = 0.5,
+                            advance_minutes: int = 30, summary_time: Tuple[int, int] = (23, 0),
+                            poll_offset: int = 0, fan_in: bool = True, seed: int = 0,
+                            send_log_path: Optional[str] = None) -> Dict[str, Any]:
+    semester_start = semester_start or date.today()
+    first_day = semester_start - timedelta(days=semester_start.weekday())
+    days = weeks * 7
+    data = build_users(users, class_size, courses_per_class, group_share, seed)
+
+    if not 0 <= poll_offset < 60:
+        raise ValueError("poll_offset 必须在 0-59 秒之间")
+    events = poll_times(data, first_day, days, advance_minutes, summary_time, offset=poll_offset)
+    clock = EventClock(datetime.combine(first_day, datetime.min.time()) + timedelta(seconds=poll_offset), events)
+    log = SendLog(clock)
+    dispatcher = ReminderDispatcher(
+        list_users=data.keys,
+        load_user=data.__getitem__,
+        send_reminder=log.send_reminder,
+        send_summary=log.send_summary,
+        send_group_reminder=log.send_group_reminder if fan_in else None,
+        claims=LocalClaims(clock),
+        advance_minutes=advance_minutes,
+        summary_time=summary_time,
+        clock=clock,
+    )
+
+    started = time.perf_counter()
+    runner = asyncio.ensure_future(dispatcher.run())
+    try:
+        await clock.finished.wait()
+    finally:
+        runner.cancel()
+        try:
+            await runner
+        except asyncio.CancelledError:
+            pass
+    elapsed = time.perf_counter() - started
+    tick_seconds = clock.tick_seconds
+
+    if send_log_path:
+        log.write(send_log_path)
+    report = verify(data, log, first_day, days, advance_minutes)
+    report.update({
+        "users": users,
+        "weeks": weeks,
+        "first_day": first_day.isoformat(),
+        "ticks": len(tick_seconds),
+        "messages": len(log.entries),
+        "group_messages": sum(1 for e in log.entries if e["kind"] == "group"),
+        "seconds": elapsed,
+        "virtual_days_per_second": days / elapsed if elapsed else 0.0,
+        "tick_p50_ms": _percentile(tick_seconds, 0.5) * 1000,
+        "tick_p99_ms": _percentile(tick_seconds, 0.99) * 1000,
+        "tick_max_ms": max(tick_seconds, default=0.0) * 1000,
+    })
+    if send_log_path:
+        report["send_log"] = send_log_path
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"仿真：{report['users']} 名同学 × {report['weeks']} 周（自 {report['first_day']} 起），"
+        f"{report['ticks']} 次轮询，耗时 {report['seconds']:.2f}s（{report['virtual_days_per_second']:.0f} 虚拟天/秒）",
+        f"发出消息 {report['messages']} 条（群提醒 {report['group_messages']} 条），"
+        f"应发提醒 {report['expected']}，送达 {report['delivered']}",
+        f"漏发 {report['missed']}，重复 {report['duplicates']}，迟发 {report['late']}；"
+        f"每日汇总应发 {report['summaries_expected']}，送达 {report['summaries']} 条"
+        f"（漏发 {report['summary_missed']}，重复 {report['summary_duplicates']}）",
+        f"送达时间相对提醒时刻：p50 {report['lateness_p50_s']:.0f}s，p99 {report['lateness_p99_s']:.0f}s，"
+        f"max {report['lateness_max_s']:.0f}s",
+        f"每轮调度耗时：p50 {report['tick_p50_ms']:.1f}ms，p99 {report['tick_p99_ms']:.1f}ms，max {report['tick_max_ms']:.1f}ms",
+    ]
+    for kind, keys in report["examples"].items():
+        if keys:
+            lines.append(f"{kind} 示例：" + "；".join(keys))
+    if "send_log" in report:
+        lines.append(f"发送记录已写入：{report['send_log']}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="kccj 学期提醒仿真")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--weeks", type=int, default=16)
+    parser.add_argument("--semester-start", default=None, help="学期第一周的任意一天，如 2025-09-01，默认本周")
+    parser.add_argument("--class-size", type=int, default=40)
+    parser.add_argument("--courses-per-class", type=int, default=12)
+    parser.add_argument("--group-share", type=float, default=0.5, help="在群里开启提醒的比例")
+    parser.add_argument("--advance-minutes", type=int, default=30)
+    parser.add_argument("--summary-time", default="23:00")
+    parser.add_argument("--poll-offset", type=int, default=0, help="调度循环每次唤醒相对整分钟的延迟（0-59 秒）")
+    parser.add_argument("--no-fan-in", action="store_true", help="关闭群提醒合并")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--send-log", default=None, help="把完整发送记录写入该 JSONL 文件")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出报告")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    hour, minute = (int(x) for x in args.summary_time.split(":"))
+    report = asyncio.run(simulate_semester(
+        users=args.users, weeks=args.weeks,
+        semester_start=datetime.strptime(args.semester_start, "%Y-%m-%d").date() if args.semester_start else None,
+        class_size=args.class_size, courses_per_class=args.courses_per_class, group_share=args.group_share,
+        advance_minutes=args.advance_minutes, summary_time=(hour, minute), poll_offset=args.poll_offset,
+        fan_in=not args.no_fan_in, seed=args.seed, send_log_path=args.send_log
+    ))
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+    failed = (report["missed"] or report["duplicates"] or report["late"]
+              or report["summary_missed"] or report["summary_duplicates"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
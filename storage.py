@@ -0,0 +1,428 @@
+"""
+课程表存储
+课程表按规范化后的内容哈希只保存一份，用户文件只记录引用和个人改动；
+同班同学上传相同课程表时，磁盘、内存和索引都只随不同课程表的数量增长
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WEEKDAY_ORDER = {"一": 0, "二": 1, "三": 2, "四": 3, "五": 4, "六": 5, "日": 6, "天": 6}
+
+
+def _normalize_value(value: Any) -> Any:
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    return value
+
+
+def _normalize_weekday(value: str) -> str:
+    # "星期一" / "礼拜一" / "周一" 统一为 "周一"
+    m = re.fullmatch(r"(?:星期|礼拜|周)([一二三四五六日天])", value)
+    if m:
+        return "周" + ("日" if m.group(1) == "天" else m.group(1))
+    return value
+
+
+def course_identity(course: Dict[str, Any]) -> str:
+    """课程的稳定标识：星期|节次|课程名，同时兼容两种字段命名"""
+    weekday = course.get("weekday", course.get("day", ""))
+    name = course.get("course", course.get("name", ""))
+    return f"{weekday}|{course.get('time', '')}|{name}"
+
+
+def _sort_key(course: Dict[str, Any]):
+    weekday = course.get("weekday", course.get("day", ""))
+    section = re.search(r"\d+", course.get("time", ""))
+    return (
+        WEEKDAY_ORDER.get(weekday[-1:] if weekday else "", 7),
+        int(section.group(0)) if section else 99,
+        json.dumps(course, ensure_ascii=False, sort_keys=True),
+    )
+
+
+def canonical_course(course: Any) -> Dict[str, Any]:
+    """单门课程的规范形式：统一空白与星期写法；也接受带 to_dict 的课程对象"""
+    if not isinstance(course, dict):
+        course = course.to_dict()
+    normalized = {k: _normalize_value(v) for k, v in course.items()}
+    if isinstance(normalized.get("weekday"), str):
+        normalized["weekday"] = _normalize_weekday(normalized["weekday"])
+    return normalized
+
+
+def normalize_schedule(courses: List[Any]) -> List[Dict[str, Any]]:
+    """规范化课程表：统一空白与星期写法、按星期和节次排序，使语义相同的课程表得到同一个哈希"""
+    result = [canonical_course(c) for c in courses]
+    result.sort(key=_sort_key)
+    return result
+
+
+def schedule_hash(courses: List[Dict[str, Any]]) -> str:
+    canonical = json.dumps(courses, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:20]
+
+
+def _write_json(path: str, data: Any, indent: Optional[int] = None):
+    """先写入同目录下唯一的临时文件再原子替换，多线程/多进程同时写入也不会读到半个文件"""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ScheduleStore:
+    """
+    数据目录结构：
+        <data_dir>/<prefix><user_id>.json   用户文件：{"schedule": 哈希, "overrides": {...}, 其他字段}
+        <data_dir>/schedules/<哈希>.json     共享课程表
+        <data_dir>/schedules/index.json      整班改课产生的哈希重定向
+        <data_dir>/schedules/groups.json     用户所在群的索引，保存用户文件时维护，按群分片时无需读取用户文件
+
+    load_user 返回的 courses 在没有个人改动时是同一份共享列表，调用方不应原地修改；
+    wrap 可以把课程字典转换为其他对象（例如 Course），同样按哈希只转换一次，
+    转换结果按最近使用保留 cache_size 份。
+
+    整班改课之后重新上传旧版课程表的同学，用户文件中标记 pinned，引用其上传的内容而不沿重定向解析。
+    """
+    cache_size = 1024
+
+    def __init__(self, data_dir: str, prefix: str = "", wrap: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        self.data_dir = data_dir
+        self.prefix = prefix
+        self.wrap = wrap
+        self.schedules_dir = os.path.join(data_dir, "schedules")
+        os.makedirs(self.schedules_dir, exist_ok=True)
+        self._index_path = os.path.join(self.schedules_dir, "index.json")
+        self._index_mtime: Optional[int] = None
+        self._aliases: Dict[str, str] = {}
+        self._refresh_index()
+        self._groups_path = os.path.join(self.schedules_dir, "groups.json")
+        self._groups_mtime: Optional[int] = None
+        self._groups: Dict[str, Optional[str]] = {}
+        self._cache: "OrderedDict[str, List[Any]]" = OrderedDict()
+        # 提醒扫描在线程中读取用户数据，与事件循环上的读写共用缓存
+        self._cache_lock = threading.Lock()
+
+    # ---------- 共享课程表 ----------
+    def _load_index(self) -> Dict[str, str]:
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("aliases", {})
+        except Exception as e:
+            logger.error(f"加载课程表索引失败: {str(e)}")
+            return {}
+
+    def _refresh_index(self):
+        """索引文件变化时（其他进程或存储实例整班改课）重新加载重定向"""
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self._index_mtime:
+            self._index_mtime = mtime
+            self._aliases = self._load_index() if mtime is not None else {}
+
+    def _cache_get(self, key: str) -> Optional[List[Any]]:
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+            return cached
+
+    def _cache_put(self, key: str, courses: List[Any]) -> List[Any]:
+        with self._cache_lock:
+            # 另一个线程已经放入同一份课程表时沿用它，保证同一内容只有一个列表对象
+            courses = self._cache.setdefault(key, courses)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return courses
+
+    def resolve(self, digest: str) -> str:
+        """沿整班改课的重定向找到最新的课程表哈希"""
+        self._refresh_index()
+        seen = set()
+        while digest in self._aliases and digest not in seen:
+            seen.add(digest)
+            digest = self._aliases[digest]
+        return digest
+
+    def _schedule_path(self, digest: str) -> str:
+        return os.path.join(self.schedules_dir, f"{digest}.json")
+
+    def put_schedule(self, courses: List[Any]) -> str:
+        normalized = normalize_schedule(courses)
+        digest = schedule_hash(normalized)
+        path = self._schedule_path(digest)
+        if not os.path.exists(path):
+            _write_json(path, normalized)
+        return digest
+
+    def _read_schedule(self, digest: str) -> List[Dict[str, Any]]:
+        path = self._schedule_path(digest)
+        if not os.path.exists(path):
+            logger.error(f"课程表 {digest} 不存在")
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def get_raw_schedule(self, digest: str) -> List[Dict[str, Any]]:
+        return self._read_schedule(self.resolve(digest))
+
+    def _load_schedule(self, digest: str) -> List[Any]:
+        cached = self._cache_get(digest)
+        if cached is None:
+            raw = self._read_schedule(digest)
+            cached = self._cache_put(digest, [self.wrap(c) for c in raw] if self.wrap else raw)
+        return cached
+
+    def get_schedule(self, digest: str) -> List[Any]:
+        return self._load_schedule(self.resolve(digest))
+
+    def apply_class_change(self, digest: str, changes: Dict[str, Dict[str, Any]]) -> str:
+        """
+        整班改课（例如换老师、换教室）：按课程标识修改字段后生成新课程表，
+        并把旧哈希重定向到新哈希，所有引用旧课程表的同学一次写入即可生效
+        """
+        courses = [dict(c) for c in self.get_raw_schedule(digest)]
+        for course in courses:
+            course.update(changes.get(course_identity(course), {}))
+        new_digest = self.put_schedule(courses)
+        old_digest = self.resolve(digest)
+        if new_digest != old_digest:
+            self._aliases[old_digest] = new_digest
+            _write_json(self._index_path, {"aliases": self._aliases})
+        return new_digest
+
+    def _user_digest(self, data: Dict[str, Any]) -> str:
+        """用户实际引用的课程表哈希：pinned 的引用不沿整班改课的重定向解析"""
+        return data["schedule"] if data.get("pinned") else self.resolve(data["schedule"])
+
+    def _set_schedule(self, record: Dict[str, Any], digest: str):
+        """
+        让用户引用新上传的课程表。该内容恰好是某次整班改课之前的旧版本时，
+        用户上传的就是这份内容，不应再被重定向到改课后的课程表
+        """
+        record["schedule"] = digest
+        record["overrides"] = {}
+        if self.resolve(digest) != digest:
+            record["pinned"] = True
+        else:
+            record.pop("pinned", None)
+
+    def schedule_digest(self, user_id: str) -> Optional[str]:
+        """用户引用的共享课程表哈希（不含个人改动），旧格式或用户不存在时返回 None"""
+        data = self._read_user(user_id)
+        if not isinstance(data, dict) or "schedule" not in data:
+            return None
+        return self._user_digest(data)
+
+    # ---------- 用户数据 ----------
+    def user_path(self, user_id: str) -> str:
+        return os.path.join(self.data_dir, f"{self.prefix}{user_id}.json")
+
+    def _refresh_groups(self):
+        try:
+            mtime = os.stat(self._groups_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._groups_mtime:
+            return
+        self._groups_mtime = mtime
+        self._groups = {}
+        if mtime is None:
+            return
+        try:
+            with open(self._groups_path, "r", encoding="utf-8") as f:
+                self._groups = json.load(f).get("groups", {})
+        except Exception as e:
+            logger.error(f"加载用户群索引失败: {str(e)}")
+
+    def user_groups(self) -> Dict[str, Optional[str]]:
+        """
+        用户ID -> 所在群号（未在群里开启提醒为 None），只包含新格式保存过的用户；
+        调用方不应修改返回的字典
+        """
+        self._refresh_groups()
+        return self._groups
+
+    def _write_users(self, records: Iterable[Tuple[str, Dict[str, Any]]]):
+        """写入用户文件，所在群有变化时同步更新群索引（批量写入只更新一次）"""
+        self._refresh_groups()
+        changed = False
+        for user_id, record in records:
+            _write_json(self.user_path(user_id), record, indent=2)
+            group_id = record.get("group_id")
+            if user_id not in self._groups or self._groups[user_id] != group_id:
+                self._groups = {**self._groups, user_id: group_id}
+                changed = True
+        if changed:
+            _write_json(self._groups_path, {"groups": self._groups})
+            self._groups_mtime = os.stat(self._groups_path).st_mtime_ns
+
+    def _read_user(self, user_id: str) -> Any:
+        path = self.user_path(user_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """返回用户数据（courses 已解析为课程列表），用户不存在时返回 None"""
+        data = self._read_user(user_id)
+        if data is None:
+            return None
+        if isinstance(data, list):
+            # 旧格式：文件内容直接是课程列表
+            data = {"courses": data}
+        if "schedule" in data:
+            data["courses"] = self._resolve_courses(self._user_digest(data), data.get("overrides") or {})
+        elif self.wrap:
+            # 旧格式：课程内嵌在用户文件中，下次保存时迁移
+            data["courses"] = [self.wrap(c) for c in data.get("courses", [])]
+        return data
+
+    def schedule_ref(self, user_id: str) -> Optional[str]:
+        """
+        用户课程表内容的标识（共享课程表哈希，加上个人改动），只读取用户文件、不解析课程，
+        可作为派生数据（如日历导出）的缓存键；旧格式或用户不存在时返回 None
+        """
+        data = self._read_user(user_id)
+        if not isinstance(data, dict) or "schedule" not in data:
+            return None
+        digest = self._user_digest(data)
+        overrides = data.get("overrides") or {}
+        if overrides:
+            return self._override_cache_key(digest, overrides)
+        return digest
+
+    def _resolve_courses(self, digest: str, overrides: Dict[str, Any]) -> List[Any]:
+        """digest 为已解析（_user_digest）的课程表哈希"""
+        if not overrides:
+            return self._load_schedule(digest)
+        key = self._override_cache_key(digest, overrides)
+        cached = self._cache_get(key)
+        if cached is None:
+            cached = self._cache_put(key, self._apply_overrides(digest, overrides))
+        return cached
+
+    def _override_cache_key(self, digest: str, overrides: Dict[str, Any]) -> str:
+        return digest + "#" + json.dumps(overrides, ensure_ascii=False, sort_keys=True)
+
+    def _apply_overrides(self, digest: str, overrides: Dict[str, Any]) -> List[Any]:
+        result = []
+        for course in self._read_schedule(digest):
+            override = overrides.get(course_identity(course))
+            if override is None:
+                result.append(course)
+            elif override:
+                # 空字典表示删除该课程
+                result.append({**course, **override})
+        for course in overrides.get("__added__", []):
+            result.append(course)
+        return [self.wrap(c) for c in result] if self.wrap else result
+
+    def save_user(self, user_id: str, data: Dict[str, Any]):
+        """保存用户数据：courses 写入共享课程表，用户文件只保留引用"""
+        record = {k: v for k, v in data.items() if k != "courses"}
+        courses = data.get("courses")
+        if courses is not None and "schedule" in data and \
+                courses is self._resolve_courses(self._user_digest(data), data.get("overrides") or {}):
+            # 课程没有变化（仍是 load_user 返回的同一个列表），保留引用与个人改动
+            record["schedule"] = self._user_digest(data)
+        elif courses is not None:
+            self._set_schedule(record, self.put_schedule(courses))
+        self._write_users([(user_id, record)])
+
+    def save_user_diff(self, user_id: str, data: Dict[str, Any], diff, max_override_ratio: float = 0.5) -> List[Any]:
+        """
+        按课程表差异（schedule_diff.ScheduleDiff）保存用户数据，返回更新后的课程列表。
+        结果与已有共享课程表相同时直接引用；改动较少时只记录为个人改动，不复制共享课程表；
+        否则写入新的共享课程表
+        """
+        courses = diff.apply()
+        record = {k: v for k, v in data.items() if k != "courses"}
+        digest = schedule_hash(normalize_schedule(courses))
+        base = self._read_schedule(self._user_digest(data)) if "schedule" in data else []
+        if os.path.exists(self._schedule_path(digest)) or not base or \
+                diff.change_count > max_override_ratio * len(base):
+            self._set_schedule(record, self.put_schedule(courses))
+            self._write_users([(user_id, record)])
+            return courses
+
+        base_by_key = {course_identity(c): c for c in base}
+        overrides = dict(record.get("overrides") or {})
+        extra = list(overrides.pop("__added__", []))
+        for old in diff.removed + [old for old, _ in diff.changed]:
+            key = course_identity(canonical_course(old))
+            if key in base_by_key:
+                overrides[key] = {}
+            else:
+                extra = [c for c in extra if course_identity(c) != key]
+        for new in diff.added + [new for _, new in diff.changed]:
+            course = canonical_course(new)
+            key = course_identity(course)
+            origin = base_by_key.get(key)
+            if origin is None:
+                extra.append(course)
+                continue
+            fields = {k: v for k, v in course.items() if origin.get(k) != v}
+            if fields:
+                overrides[key] = fields
+            else:
+                overrides.pop(key, None)
+        if extra:
+            overrides["__added__"] = extra
+        record["schedule"] = self._user_digest(data)
+        record["overrides"] = overrides
+        self._write_users([(user_id, record)])
+        return courses
+
+    def assign_schedules(self, assignments: Iterable[Tuple[str, str, Dict[str, Any]]]) -> int:
+        """
+        批量让用户引用已写入的共享课程表（批量导入使用）：assignments 为 (用户ID, 课程表哈希, 其他字段)。
+        只读取用户文件中的原始字段，不解析课程；已有字段保留，个人改动清空
+        """
+        records = []
+        for user_id, digest, fields in assignments:
+            path = self.user_path(user_id)
+            record: Dict[str, Any] = {}
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        existing = json.load(f)
+                    if isinstance(existing, dict):
+                        existing.pop("courses", None)
+                        record = existing
+                except Exception as e:
+                    logger.error(f"读取用户 {user_id} 数据失败，将覆盖: {str(e)}")
+            record.update(fields)
+            self._set_schedule(record, digest)
+            records.append((user_id, record))
+        self._write_users(records)
+        return len(records)
+
+    def list_users(self) -> List[str]:
+        n = len(self.prefix)
+        return [
+            fname[n:-5] for fname in os.listdir(self.data_dir)
+            if fname.startswith(self.prefix) and fname.endswith(".json")
+        ]
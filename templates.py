@@ -0,0 +1,172 @@
+"""
+消息模板引擎
+模板在配置变化时才重新校验与编译；支持一次性渲染整天/整张课程表。
+同一班级的同学共享同一份课程表（同一批课程对象），每日预览按课程对象缓存渲染结果
+"""
+import logging
+from collections import OrderedDict
+from string import Formatter
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+COURSE_FIELDS = {"time", "name", "teacher", "location", "weekday", "weeks", "course", "classroom"}
+
+# 配置项默认值与可用变量，与 _conf_schema.json 保持一致
+DEFAULT_TEMPLATES = {
+    "reminder_template": (
+        "同学你好，待会有课哦\n上课时间：{time}\n课程名称：{name}\n教师：{teacher}\n上课地点：{location}",
+        COURSE_FIELDS,
+    ),
+    "preview_template": (
+        "明天（星期{weekday}）的课程安排：\n\n{courses}",
+        {"weekday", "courses"},
+    ),
+    "course_template": (
+        "• 上课时间：{time}\n课程名称：{name}\n教师：{teacher}\n上课地点：{location}",
+        COURSE_FIELDS,
+    ),
+}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+# 模板变量 -> 课程数据中依次尝试的字段名
+# 兼容 Course 对象（name/location/day）与解析结果字典（course/classroom/weekday），两套字段名在模板中都可以使用
+FIELD_ALIASES = {
+    "time": ("time",),
+    "name": ("name", "course"),
+    "course": ("course", "name"),
+    "teacher": ("teacher",),
+    "location": ("location", "classroom"),
+    "classroom": ("classroom", "location"),
+    "weekday": ("weekday", "day"),
+    "weeks": ("weeks",),
+}
+
+
+def _compile_course_renderer(parts) -> Callable[[Dict[str, Any]], str]:
+    """
+    把模板预先解析为按位置填充的格式串与每个变量依次尝试的字段名，
+    渲染课程时只做字段查找与一次 str.format，省去构造字段字典与解析模板的开销
+    """
+    pieces, lookups = [], []
+    for literal, field_name, format_spec, conversion in parts:
+        pieces.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field_name is None:
+            continue
+        pieces.append("{" + (f"!{conversion}" if conversion else "") + (f":{format_spec}" if format_spec else "") + "}")
+        lookups.append(FIELD_ALIASES.get(field_name, (field_name,)))
+    fmt = "".join(pieces).format
+    primary = [keys[0] for keys in lookups]
+    fallbacks = [(i, keys[1:]) for i, keys in enumerate(lookups) if len(keys) > 1]
+
+    def render(d: Dict[str, Any]) -> str:
+        g = d.get
+        values = [g(key) or "" for key in primary]
+        for i, keys in fallbacks:
+            if not values[i]:
+                values[i] = next(filter(None, map(g, keys)), "")
+        return fmt(*values)
+    return render
+
+
+class CompiledTemplate:
+    """校验通过的模板：通用渲染使用 str.format_map，课程渲染使用预编译的拼接函数"""
+    __slots__ = ("source", "fields", "_format_map", "_render_course")
+
+    def __init__(self, source: str, allowed_fields: Optional[Iterable[str]] = None):
+        fields = set()
+        try:
+            parts = list(Formatter().parse(source))
+        except ValueError as e:
+            raise TemplateError(f"模板格式错误：{str(e)}")
+        for _, field_name, format_spec, _ in parts:
+            if field_name is None:
+                continue
+            # 不允许属性/下标访问以及嵌套格式，避免模板读取任意对象属性
+            if not field_name.isidentifier() or "{" in (format_spec or ""):
+                raise TemplateError(f"模板变量不合法：{{{field_name}}}")
+            fields.add(field_name)
+        if allowed_fields is not None:
+            unknown = fields - set(allowed_fields)
+            if unknown:
+                raise TemplateError(f"模板中存在未知变量：{', '.join(sorted(unknown))}")
+        self.source = source
+        self.fields = fields
+        self._format_map = source.format_map
+        self._render_course = _compile_course_renderer(parts)
+
+    def render(self, **values) -> str:
+        return self._format_map(values)
+
+    def render_map(self, values: Dict[str, Any]) -> str:
+        return self._format_map(values)
+
+    def render_course(self, course: Any) -> str:
+        return self._render_course(course if isinstance(course, dict) else course.__dict__)
+
+    def render_courses(self, courses: Iterable[Any], sep: str = "") -> str:
+        """批量渲染，一次 join 生成整段文本"""
+        render = self._render_course
+        return sep.join([render(c if isinstance(c, dict) else c.__dict__) for c in courses])
+
+
+class TemplateEngine:
+    """
+    从配置读取消息模板并缓存编译结果，配置中的模板文本变化时才重新编译；
+    配置的模板不合法时记录错误并回退到默认模板
+    """
+    # 每日预览渲染结果缓存的条目数上限
+    preview_cache_size = 4096
+
+    def __init__(self, get_config: Callable[[str, Any], Any]):
+        self._get_config = get_config
+        self._cache: Dict[str, CompiledTemplate] = {}
+        self._previews: "OrderedDict[tuple, Tuple[tuple, str]]" = OrderedDict()
+
+    def _configured(self, name: str) -> str:
+        templates = self._get_config("message_templates", None)
+        if isinstance(templates, dict) and templates.get(name):
+            return templates[name]
+        return DEFAULT_TEMPLATES[name][0]
+
+    def get(self, name: str) -> CompiledTemplate:
+        source = self._configured(name)
+        compiled = self._cache.get(name)
+        if compiled is not None and compiled.source == source:
+            return compiled
+        default, allowed = DEFAULT_TEMPLATES[name]
+        try:
+            compiled = CompiledTemplate(source, allowed)
+        except TemplateError as e:
+            logger.error(f"消息模板 {name} 配置错误，已使用默认模板: {str(e)}")
+            compiled = CompiledTemplate(default, allowed)
+            # 以配置文本为缓存键，避免每次都重新报错
+            compiled.source = source
+        self._cache[name] = compiled
+        return compiled
+
+    def render_reminder(self, course: Any) -> str:
+        return self.get("reminder_template").render_course(course)
+
+    def render_preview(self, weekday: str, courses: Iterable[Any]) -> str:
+        """
+        课程对象来自按内容哈希共享的课程表缓存，保存后不会原地修改，因此以模板与课程对象本身为键；
+        缓存条目持有课程对象的引用，保证键中的 id 在条目有效期内不会被复用
+        """
+        course_template, preview_template = self.get("course_template"), self.get("preview_template")
+        courses = tuple(courses)
+        key = (course_template, preview_template, weekday, *map(id, courses))
+        cached = self._previews.get(key)
+        if cached is not None:
+            self._previews.move_to_end(key)
+            return cached[1]
+        body = course_template.render_courses(courses, sep="\n\n")
+        text = preview_template.render(weekday=weekday, courses=body)
+        self._previews[key] = (courses, text)
+        if len(self._previews) > self.preview_cache_size:
+            self._previews.popitem(last=False)
+        return text
@@ -0,0 +1,23 @@
+"""把仓库根目录注册为 kccj 包，使插件模块内的相对导入在测试中可用"""
+import importlib.util
+import os
+import sys
+from importlib.machinery import ModuleSpec
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "kccj" not in sys.modules:
+    module = importlib.util.module_from_spec(ModuleSpec("kccj", None, is_package=True))
+    module.__path__ = [ROOT]
+    sys.modules["kccj"] = module
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _isolated_cwd(tmp_path_factory):
+    """插件与 AstrBot 框架会在工作目录下创建 data/ 等运行时文件，测试在临时目录中运行"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("cwd"))
+    yield
+    os.chdir(cwd)
@@ -0,0 +1,107 @@
+import asyncio
+
+from kccj.ai_resilience import CircuitBreaker, ResilientAIService
+from kccj.ai_service import BaseAIService
+
+
+class FlakyService(BaseAIService):
+    """前 failures 次请求不返回内容，之后正常输出"""
+    model = "flaky"
+
+    def __init__(self, failures=0, delay=0.0):
+        super().__init__()
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+
+    async def _chat_completion(self, messages, temperature, timeout):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return None if self.calls <= self.failures else "ok"
+
+    async def chat_completion_stream(self, messages, temperature=0.7, max_tokens=4096):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.calls <= self.failures:
+            return
+        for delta in ("a", "b", "c"):
+            yield delta
+
+
+def _open_breaker(breaker):
+    breaker.state = CircuitBreaker.HALF_OPEN
+
+
+def test_cancelled_probe_releases_half_open_slot():
+    async def main():
+        service = ResilientAIService(FlakyService(delay=1), max_retries=0)
+        _open_breaker(service.breaker)
+        task = asyncio.ensure_future(service._chat_completion([], 0.7, 30))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return service.breaker.allow_request()
+
+    assert asyncio.run(main())
+
+
+def test_rejected_probe_releases_half_open_slot():
+    async def main():
+        service = ResilientAIService(FlakyService(), max_queue=0, max_retries=0)
+        _open_breaker(service.breaker)
+        result = await service._chat_completion([], 0.7, 30)
+        return result, service.breaker.allow_request()
+
+    assert asyncio.run(main()) == (None, True)
+
+
+def test_stream_retries_before_first_chunk():
+    async def main():
+        inner = FlakyService(failures=1)
+        service = ResilientAIService(inner, max_retries=2)
+        deltas = [delta async for delta in service.chat_completion_stream([])]
+        return inner.calls, deltas, service.stats["retries"]
+
+    assert asyncio.run(main()) == (2, ["a", "b", "c"], 1)
+
+
+def test_stream_releases_slot_while_consumer_is_busy():
+    async def main():
+        service = ResilientAIService(FlakyService(), max_concurrency=1)
+        async for _ in service.chat_completion_stream([]):
+            # 调用方处理片段期间，其他请求仍能拿到并发槽位
+            return await asyncio.wait_for(service._chat_completion([], 0.7, 30), 1)
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_abandoned_stream_releases_probe():
+    async def main():
+        service = ResilientAIService(FlakyService(delay=0.05), max_retries=0)
+        _open_breaker(service.breaker)
+        stream = service.chat_completion_stream([])
+        task = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+        return service.breaker.allow_request()
+
+    assert asyncio.run(main())
+
+
+def test_only_the_probe_releases_the_half_open_slot():
+    async def main():
+        service = ResilientAIService(FlakyService(delay=1), max_retries=0)
+        # 熔断器关闭时发出的普通请求仍在进行中
+        task = asyncio.ensure_future(service._chat_completion([], 0.7, 30))
+        await asyncio.sleep(0.01)
+        _open_breaker(service.breaker)
+        assert service.breaker.admit() is True
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # 普通请求结束不能归还探测名额，探测进行中不再放行第二个探测请求
+        return service.breaker.allow_request()
+
+    assert asyncio.run(main()) is False
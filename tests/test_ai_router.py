@@ -0,0 +1,70 @@
+import asyncio
+
+from kccj import ai_router
+from kccj.ai_router import ProviderRouter, UnconfiguredAIService, create_ai_service
+from kccj.ai_service import OpenAICompatibleService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeProvider(OpenAICompatibleService):
+    def __init__(self, name):
+        super().__init__(api_key="test", api_base="http://127.0.0.1", model=name)
+        self.name = name
+
+    async def _chat_completion(self, messages, temperature, timeout):
+        return self.name
+
+
+def _router(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ai_router, "time", clock)
+    primary, backup = FakeProvider("primary"), FakeProvider("backup")
+    router = ProviderRouter([primary, backup], preferred="primary", explore_rate=0)
+    return clock, router, primary, backup
+
+
+def test_provider_recovers_after_failing_twice(monkeypatch):
+    clock, router, primary, backup = _router(monkeypatch)
+    stats = router.stats["primary"]
+    for _ in range(2):
+        stats.record(False, 1.0, router.failure_threshold, router.cooldown)
+    # 两次失败未达到 failure_threshold，不应被判定为不健康
+    assert stats.healthy
+    assert asyncio.run(router._chat_completion([], 0.7, 30)) == "backup"
+
+    clock.now += 5 * router.stats["primary"].half_life
+    assert asyncio.run(router._chat_completion([], 0.7, 30)) == "primary"
+
+
+def test_provider_returns_after_cooldown(monkeypatch):
+    clock, router, primary, backup = _router(monkeypatch)
+    for _ in range(router.failure_threshold):
+        router.stats["primary"].record(False, 1.0, router.failure_threshold, router.cooldown)
+    assert not router.stats["primary"].healthy
+    assert asyncio.run(router._chat_completion([], 0.7, 30)) == "backup"
+
+    clock.now += router.cooldown + 5 * router.stats["primary"].half_life
+    assert router.stats["primary"].healthy
+    assert asyncio.run(router._chat_completion([], 0.7, 30)) == "primary"
+
+
+def test_missing_api_key_fails_lazily():
+    service = create_ai_service({}.get)
+    assert isinstance(service, UnconfiguredAIService)
+    assert not service.configured
+    assert asyncio.run(service.chat_completion([])) is None
+
+
+def test_parse_settings_come_from_config():
+    config = {"siliconflow_api_key": "test", "ai_parse_chunk_chars": 300, "ai_parse_concurrency": 2,
+              "ai_max_concurrency": 3, "max_ai_retries": 1, "ai_hedge_delay_ms": 250}
+    service = create_ai_service(config.get)
+    assert (service.parse_chunk_chars, service.parse_concurrency) == (300, 2)
+    assert (service.max_retries, service.hedge_delay) == (1, 0.25)
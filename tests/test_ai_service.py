@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from kccj.ai_service import BaseAIService
+
+SCHEDULE = "周一 第1-2节 高等数学 教1-201 张三\n周三 第3-4节 大学英语 教2-305 李四"
+COURSES = [
+    {"weekday": "周一", "time": "1-2节", "course": "高等数学", "classroom": "教1-201", "teacher": "张三"},
+    {"weekday": "周三", "time": "3-4节", "course": "大学英语", "classroom": "教2-305", "teacher": "李四"},
+]
+
+
+class FakeService(BaseAIService):
+    model = "fake"
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+
+    async def chat_completion_stream(self, messages, temperature=0.7, max_tokens=4096):
+        self.requests += 1
+        yield "["
+        for i, course in enumerate(COURSES):
+            await asyncio.sleep(0.01)
+            yield ("," if i else "") + json.dumps(course, ensure_ascii=False)
+        yield "]"
+
+
+async def _collect(service, text):
+    return [course async for course in service.parse_course_schedule_stream(text)]
+
+
+def test_identical_concurrent_stream_parses_make_one_request():
+    async def main():
+        service = FakeService()
+        pastes = [SCHEDULE] * 8 + ["  " + SCHEDULE + "\n", SCHEDULE.replace(" ", "  ")]
+        results = await asyncio.gather(*(_collect(service, text) for text in pastes))
+        return service.requests, results
+
+    requests, results = asyncio.run(main())
+    assert requests == 1
+    assert all(result == results[0] for result in results)
+    assert [c["course"] for c in results[0]] == ["高等数学", "大学英语"]
+
+
+def test_stream_parse_after_completion_makes_new_request():
+    async def main():
+        service = FakeService()
+        await _collect(service, SCHEDULE)
+        await _collect(service, SCHEDULE)
+        return service.requests
+
+    assert asyncio.run(main()) == 2
+
+
+def test_abandoned_leader_does_not_cancel_followers():
+    async def main():
+        service = FakeService()
+
+        async def first_only():
+            async for course in service.parse_course_schedule_stream(SCHEDULE):
+                return course
+
+        first, full = await asyncio.gather(first_only(), _collect(service, SCHEDULE))
+        return service.requests, first, full
+
+    requests, first, full = asyncio.run(main())
+    assert requests == 1
+    assert first["course"] == "高等数学"
+    assert len(full) == 2
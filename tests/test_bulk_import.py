@@ -0,0 +1,24 @@
+import os
+
+from kccj import bulk_import
+from kccj.storage import ScheduleStore
+
+COURSES = [{"weekday": "周一", "time": "第1-2节", "course": "高等数学", "classroom": "教1-201", "teacher": "张三"}]
+
+
+def test_rejects_non_numeric_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_import, "load_timetables", lambda path: {"A1": COURSES})
+    roster = tmp_path / "roster.csv"
+    roster.write_text(
+        "QQ,班级,群号\n10001,A1,123\n../../evil,A1,\n10002,A1,12/3\n10003,A1,\n", encoding="utf-8"
+    )
+    data_dir = tmp_path / "data"
+    store = ScheduleStore(str(data_dir))
+
+    report = bulk_import.import_roster(store, str(roster), "unused")
+
+    assert report.imported == 2
+    assert [row for row, _, _ in report.errors] == [3, 4]
+    assert sorted(store.list_users()) == ["10001", "10003"]
+    assert not any(name.endswith(".tmp") for name in os.listdir(data_dir))
+    assert not (tmp_path / "evil.json").exists()
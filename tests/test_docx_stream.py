@@ -0,0 +1,114 @@
+import zipfile
+from xml.sax.saxutils import escape
+
+import pytest
+
+from kccj.docx_stream import iter_word_courses
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+
+def cell(text="", span=1, vmerge=None):
+    props = f'<w:gridSpan w:val="{span}"/>' if span > 1 else ""
+    if vmerge == "restart":
+        props += '<w:vMerge w:val="restart"/>'
+    elif vmerge:
+        props += "<w:vMerge/>"
+    paragraphs = "".join(f"<w:p><w:r><w:t>{escape(line)}</w:t></w:r></w:p>" for line in text.split("\n"))
+    return f"<w:tc><w:tcPr>{props}</w:tcPr>{paragraphs}</w:tc>"
+
+
+def write_docx(path, *tables):
+    """最小的 .docx：每个表格为若干行，每行为 cell() 列表或纯文字列表"""
+    body = "<w:p><w:r><w:t>课程表</w:t></w:r></w:p>"
+    for rows in tables:
+        body += "<w:tbl>" + "".join(
+            "<w:tr>" + "".join(c if c.startswith("<w:tc>") else cell(c) for c in row) + "</w:tr>" for row in rows
+        ) + "</w:tbl>"
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}<w:sectPr/></w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES)
+        zf.writestr("_rels/.rels", RELS)
+        zf.writestr("word/document.xml", document)
+    return str(path)
+
+
+LEGACY_ROWS = [
+    ["课程名", "时间", "教室", "教师"],
+    ["高等数学", "周一第1-2节", "教1-201", "张三"],
+    ["大学英语", "周三 第3-4节", "教2-305", "李四"],
+    ["体育", "周五第5-6节", "操场", ""],
+]
+
+
+def test_list_table_matches_previous_python_docx_parser(tmp_path):
+    docx = pytest.importorskip("docx")
+    from kccj.parser import extract_weekday
+
+    path = write_docx(tmp_path / "list.docx", LEGACY_ROWS)
+    # 改为流式解析之前 parse_word 的实现
+    legacy = []
+    for table in docx.Document(path).tables:
+        for row in table.rows[1:]:
+            cells = [c.text.strip() for c in row.cells]
+            legacy.append({"weekday": extract_weekday(cells[1]), "time": cells[1], "course": cells[0],
+                           "classroom": cells[2], "teacher": cells[3]})
+
+    assert list(iter_word_courses(path)) == legacy
+
+
+def test_list_table_columns_are_found_by_header(tmp_path):
+    path = write_docx(tmp_path / "header.docx", [
+        ["星期", "节次", "课程名称", "任课教师", "上课地点", "周次"],
+        ["星期二", "第1-2节", "线性代数", "王五", "教3-101", "1-8周"],
+        ["", "", "", "", "", ""],
+    ])
+    assert list(iter_word_courses(path)) == [{
+        "weekday": "周二", "time": "第1-2节", "course": "线性代数",
+        "classroom": "教3-101", "teacher": "王五", "weeks": "1-8周",
+    }]
+
+
+def test_grid_table_with_merged_cells_and_lunch_break(tmp_path):
+    path = write_docx(tmp_path / "grid.docx", [
+        ["节次", "星期一", "星期二", "星期三"],
+        ["第1节", cell("高等数学\n教1-201\n张三\n1-16周", vmerge="restart"), cell("体育\n操场\n赵六", span=2)],
+        ["第2节", cell(vmerge="continue"), "", "大学英语\n教师：李四\n教室：教2-305"],
+        [cell("午休", span=4)],
+        ["第5节", cell("大学物理\n教3-101\n王五", vmerge="restart"), "", ""],
+        ["第6节", cell(vmerge="continue"), "", "形势与政策\n钱七\n\n军事理论\n教4-101"],
+    ])
+    courses = sorted(iter_word_courses(path), key=lambda c: (c["weekday"], c["time"], c["course"]))
+    summary = [(c["weekday"], c["time"], c["course"], c["classroom"], c["teacher"], c["weeks"]) for c in courses]
+    assert summary == sorted([
+        # 纵向合并的连堂课合并为一门课程
+        ("周一", "第1-2节", "高等数学", "教1-201", "张三", "1-16周"),
+        # 午休行打断连堂，之后的合并单元格是另一门课
+        ("周一", "第5-6节", "大学物理", "教3-101", "王五", ""),
+        # 横向合并的单元格覆盖的每个星期各一门
+        ("周二", "第1节", "体育", "操场", "赵六", ""),
+        ("周三", "第1节", "体育", "操场", "赵六", ""),
+        ("周三", "第2节", "大学英语", "教2-305", "李四", ""),
+        # 空行分隔同一单元格中的两门课
+        ("周三", "第6节", "形势与政策", "", "钱七", ""),
+        ("周三", "第6节", "军事理论", "教4-101", "", ""),
+    ])
@@ -0,0 +1,33 @@
+from datetime import date
+
+from kccj.ics_export import IcsExporter
+from kccj.storage import ScheduleStore, course_identity
+
+MATH = {"weekday": "周一", "time": "第1-2节", "course": "高等数学", "classroom": "教1-201", "teacher": "张三", "weeks": "1-16周"}
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_refresh_updates_subscriptions_after_schedule_changes(tmp_path):
+    store = ScheduleStore(str(tmp_path / "data"))
+    exporter = IcsExporter(store, str(tmp_path / "ics"), date(2025, 9, 1))
+    store.save_user("1", {"courses": [MATH]})
+    store.save_user("2", {"courses": [MATH]})
+    path = exporter.export("1")
+    assert "RRULE:FREQ=WEEKLY;INTERVAL=1;COUNT=16" in _read(path)
+    assert "LOCATION:教1-201" in _read(path)
+
+    # 课程表变化后订阅文件随之更新；没有导出过日历的同学不生成文件
+    store.save_user("1", {"courses": [dict(MATH, classroom="教2-305")]})
+    store.save_user("2", {"courses": [dict(MATH, classroom="教2-305")]})
+    exporter.refresh()
+    assert "LOCATION:教2-305" in _read(path)
+    assert len(list((tmp_path / "ics" / "users").iterdir())) == 1
+
+    # 其他进程中的导出器也能读到订阅列表
+    store.apply_class_change(store.schedule_digest("1"), {course_identity(MATH): {"teacher": "王五"}})
+    IcsExporter(store, str(tmp_path / "ics"), date(2025, 9, 1)).refresh(["1"])
+    assert "DESCRIPTION:教师：王五" in _read(path)
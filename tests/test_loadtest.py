@@ -0,0 +1,20 @@
+import asyncio
+
+from kccj import loadtest
+
+
+def test_group_chatter_gets_no_replies_on_either_frontend():
+    report = asyncio.run(loadtest.run_loadtest(
+        users=20, class_size=10, ai_latency_ms=0, ai_jitter_ms=0, send_latency_ms=0,
+        noise_per_user=10, astrbot_users=10, trace_memory=False
+    ))
+
+    assert report["noise"]["messages"] == 200
+    assert report["noise"]["replies"] == 0
+    assert report["noise"]["ai_requests"] == 0
+    astrbot = report["astrbot"]
+    # 每条课程表与"确认"都经 Context.send_message 回复
+    assert astrbot["replies"] == astrbot["messages"] == 20
+    assert astrbot["active_users"] == 10
+    assert astrbot["noise"]["replies"] == 0
+    assert astrbot["noise"]["ai_requests"] == 0
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from kccj.loop_watchdog import LoopWatchdog
+
+
+def _parse_timetable():
+    # 模拟在事件循环中同步解析大文件
+    time.sleep(0.3)
+
+
+def test_blocking_call_is_recorded_with_its_stack():
+    watchdog = LoopWatchdog(interval=0.01, threshold=0.1)
+
+    async def main():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        _parse_timetable()
+        await asyncio.sleep(0.05)
+        await watchdog.stop()
+
+    asyncio.run(main())
+
+    assert len(watchdog.stalls) == 1
+    stall = watchdog.stalls[0]
+    assert stall.duration >= 0.25
+    assert stall.site.startswith("test_loop_watchdog.py:") and stall.site.endswith(" _parse_timetable")
+    # 调用栈从协程一直到阻塞的函数，事件循环本身的帧被略去
+    assert any(line.strip().startswith("test_loop_watchdog.py:") and " main" in line for line in stall.stack)
+    assert not any("asyncio" in line.split()[0] for line in stall.stack)
+
+    assert watchdog.samples > 2
+    assert watchdog.max_lag == stall.duration
+    assert watchdog.percentile(0.5) < 0.1 <= watchdog.percentile(0.99)
+    summary = watchdog.summary()
+    assert "超过 100ms 的卡顿：1 次" in summary
+    assert f"• {stall.site}：1 次" in summary
+    assert f"p99 {watchdog.percentile(0.99) * 1000:.1f}ms" in summary
+
+
+def test_disabled_watchdog_does_not_start():
+    watchdog = LoopWatchdog(threshold=0)
+
+    async def main():
+        watchdog.start()
+        return watchdog.running
+
+    assert asyncio.run(main()) is False
+    assert watchdog.summary() == "事件循环监测未运行。"
@@ -0,0 +1,57 @@
+import asyncio
+
+from kccj.metrics import Metrics
+
+
+def test_render_prometheus_counters_histograms_and_escaping():
+    m = Metrics(enabled=True)
+    m.describe("kccj_sends_total", "发送次数")
+    m.inc("kccj_sends_total", status="sent")
+    m.inc("kccj_sends_total", 2, status="sent")
+    m.inc("kccj_sends_total", error='say "hi"\\\n')
+    m.observe("kccj_tick_seconds", 0.003, buckets=(0.001, 0.01, 1))
+    m.observe("kccj_tick_seconds", 0.5, buckets=(0.001, 0.01, 1))
+
+    lines = m.render_prometheus().splitlines()
+    assert "# HELP kccj_sends_total 发送次数" in lines
+    assert "# TYPE kccj_sends_total counter" in lines
+    assert 'kccj_sends_total{status="sent"} 3' in lines
+    assert 'kccj_sends_total{error="say \\"hi\\"\\\\\\n"} 1' in lines
+    assert "# TYPE kccj_tick_seconds histogram" in lines
+    # 分桶为累计计数
+    assert [line for line in lines if line.startswith("kccj_tick_seconds")] == [
+        'kccj_tick_seconds_bucket{le="0.001"} 0',
+        'kccj_tick_seconds_bucket{le="0.01"} 1',
+        'kccj_tick_seconds_bucket{le="1"} 2',
+        'kccj_tick_seconds_bucket{le="+Inf"} 2',
+        "kccj_tick_seconds_sum 0.503",
+        "kccj_tick_seconds_count 2",
+    ]
+
+
+def test_disabled_metrics_record_and_write_nothing(tmp_path):
+    m = Metrics(enabled=False)
+    m.inc("kccj_sends_total")
+    m.set("kccj_queue_depth", 3)
+    m.add("kccj_queue_depth", 1)
+    m.observe("kccj_tick_seconds", 0.1)
+    with m.timer("kccj_tick_seconds"):
+        pass
+
+    @m.timed("kccj_parse_seconds")
+    async def parse():
+        return "ok"
+
+    assert asyncio.run(parse()) == "ok"
+    assert m.render_prometheus() == "\n"
+    assert asyncio.run(m.write_prometheus(str(tmp_path))) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_prometheus_replaces_file(tmp_path):
+    m = Metrics(enabled=True)
+    m.inc("kccj_sends_total")
+    path = asyncio.run(m.write_prometheus(str(tmp_path)))
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == m.render_prometheus()
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.prom"]
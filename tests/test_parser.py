@@ -0,0 +1,54 @@
+import asyncio
+
+from kccj.parser import cascade_parse, ingest_schedule
+
+LOCAL = "周一 第1-2节 高等数学 教1-201 张三"
+UNKNOWN = "周三 大学英语 教2-305"
+AI_COURSE = {"weekday": "周三", "time": "第3-4节", "course": "大学英语", "classroom": "教2-305", "teacher": "李四"}
+
+
+def _template(name="大学物理", teacher="赵六", location="教3-101"):
+    return f"星期五\n上课时间：第5-6节\n课程名称：{name}\n教师：{teacher}\n上课地点：{location}\n周次：1-16周"
+
+
+class StubAI:
+    def __init__(self, courses=()):
+        self.courses = list(courses)
+        self.texts = []
+
+    async def parse_course_schedule(self, text):
+        self.texts.append(text)
+        return self.courses
+
+
+def test_only_the_unparsed_remainder_goes_to_ai():
+    text = "\n".join([LOCAL, "", "大家记得交作业", "", UNKNOWN, ""])
+    ai = StubAI([AI_COURSE])
+    result = asyncio.run(ingest_schedule(text, ai))
+
+    assert ai.texts == [UNKNOWN]
+    assert result.tiers == {"regex": 1, "ai": 1}
+    assert [c["course"] for c in result.courses] == ["高等数学", "大学英语"]
+    # 取出的剩余文本随后视为已处理
+    assert not result.needs_ai and result.take_remainder() == ""
+
+
+def test_fully_local_schedule_skips_ai():
+    ai = StubAI()
+    result = asyncio.run(ingest_schedule(LOCAL + "\n" + _template(), ai))
+    assert ai.texts == []
+    assert result.tiers == {"regex": 1, "template": 1}
+    assert result.coverage == 1.0
+
+
+def test_courses_below_confidence_threshold_fall_through_to_ai():
+    # 五个字段填了三个，恰好达到 0.6，本地采用
+    result = cascade_parse(_template(teacher=" ", location=" "))
+    assert result.tiers == {"template": 1} and not result.needs_ai
+
+    # 只填了两个（0.4），整段模板交给AI
+    blank = _template(name=" ", teacher=" ", location=" ")
+    ai = StubAI([AI_COURSE])
+    result = asyncio.run(ingest_schedule(LOCAL + "\n\n" + blank, ai))
+    assert result.tiers == {"regex": 1, "ai": 1}
+    assert ai.texts == ["\n".join(line.strip() for line in blank.splitlines())]
@@ -0,0 +1,39 @@
+import asyncio
+import tracemalloc
+
+from kccj.profiling import Profiler
+
+
+def test_arming_timeout_and_disarm_stop_tracemalloc(tmp_path):
+    async def main():
+        profiler = Profiler(str(tmp_path))
+        profiler.arm("tick", 5, timeout=0.05)
+        assert tracemalloc.is_tracing()
+        await asyncio.sleep(0.1)
+        expired = not tracemalloc.is_tracing() and "没有" in profiler.status()
+
+        profiler.arm("message", 5)
+        disarmed = profiler.disarm()
+        return expired, disarmed, tracemalloc.is_tracing()
+
+    assert asyncio.run(main()) == (True, ["message"], False)
+
+
+def test_report_is_written_off_the_loop(tmp_path):
+    async def main():
+        profiler = Profiler(str(tmp_path))
+        profiler.arm("parse", 1)
+
+        @profiler.profiled("parse")
+        def parse():
+            return sum(range(1000))
+
+        parse()
+        pending = list(profiler._pending)
+        await asyncio.gather(*pending)
+        return len(pending), profiler.last_reports.get("parse", "")
+
+    pending, report = asyncio.run(main())
+    assert pending == 1
+    assert "完整报告" in report
+    assert list(tmp_path.iterdir())
@@ -0,0 +1,51 @@
+from kccj.router import classify, MessageRouter, EXPECT_CONFIRM, EXPECT_SCHEDULE, ROUTE_CONFIRM, ROUTE_SCHEDULE
+
+GROUP_CHATTER = [
+    "周五交作业",
+    "周三第3-4节在哪上课",
+    "周一第1-2节的高数换教室了吗？\n好像是教1-201",
+    "星期二下午有课吗\n第5节是什么课\n我忘了",
+]
+
+SCHEDULE = (
+    "周一 第1-2节 高等数学 教1-201 张三\n"
+    "周二 第3-4节 大学英语 教2-305 李四\n"
+    "周四 第5-6节 线性代数 教3-101 王五"
+)
+
+TEMPLATE = (
+    "星期一\n上课时间：第1-2节（08:00-09:40）\n课程名称：高等数学\n"
+    "星期三\n上课时间：第3-4节（10:00-11:40）\n课程名称：大学英语"
+)
+
+
+def test_group_chatter_mentioning_weekdays_is_ignored():
+    for text in GROUP_CHATTER:
+        assert classify(text, private=False) is None, text
+
+
+def test_group_schedules_are_still_recognised():
+    assert classify(SCHEDULE, private=False) == ROUTE_SCHEDULE
+    assert classify(TEMPLATE, private=False) == ROUTE_SCHEDULE
+
+
+def test_private_and_expected_messages_use_weak_evidence():
+    assert classify("周三第3-4节 高等数学", private=True) == ROUTE_SCHEDULE
+    assert classify("周五交作业", private=False, expecting=EXPECT_SCHEDULE) == ROUTE_SCHEDULE
+
+
+def test_session_state_is_per_chat():
+    router = MessageRouter(confirm_words=("是",))
+    router.expect("1", EXPECT_CONFIRM, "100", group_id="100")
+
+    # 只有发送课程表的群里的"是"才是确认，其他群里的同一句话是闲聊
+    assert router.route("1", "是", chat_id="200") is None
+    assert router.route("2", "是", chat_id="100") is None
+    assert router.route("1", "是", chat_id="100") == ROUTE_CONFIRM
+    assert router.context("1", "100") == {"group_id": "100"}
+    # 私聊中的确认总是处理，但没有携带群的上下文
+    assert router.route("1", "是") == ROUTE_CONFIRM
+    assert router.context("1") is None
+
+    router.clear("1", "100")
+    assert router.state("1", "100") is None
@@ -0,0 +1,29 @@
+from kccj.schedule_diff import diff_schedules
+
+MATH = {"weekday": "周一", "time": "第1-2节", "course": "高等数学", "classroom": "教1-201", "teacher": "张三"}
+ENGLISH = {"weekday": "周三", "time": "第3-4节", "course": "大学英语", "classroom": "教2-305", "teacher": "李四"}
+PHYSICS = {"weekday": "周五", "time": "第5-6节", "course": "大学物理", "classroom": "教3-101", "teacher": "赵六"}
+
+
+def test_diff_reports_added_removed_and_changed_courses():
+    moved = dict(ENGLISH, classroom="教2-402")
+    diff = diff_schedules([MATH, ENGLISH], [moved, PHYSICS])
+
+    assert diff.added == [PHYSICS]
+    assert diff.changed == [(ENGLISH, moved)]
+    assert diff.removed == [MATH]
+    assert diff.unchanged == []
+    assert diff.change_count == 3
+    assert diff.changed_fields(ENGLISH, moved) == {"classroom": "教2-402"}
+    assert diff.apply() == [moved, PHYSICS]
+    assert "教室：教2-305→教2-402" in diff.summary()
+
+
+def test_diff_keeps_old_objects_for_unchanged_courses():
+    # 星期写法与空白不同视为同一门课
+    rewritten = dict(MATH, weekday="星期一", classroom=" 教1-201 ")
+    diff = diff_schedules([MATH, ENGLISH], [rewritten, ENGLISH])
+
+    assert diff.is_empty
+    assert diff.unchanged[0] is MATH
+    assert diff.summary() == "课程表没有变化。"
@@ -0,0 +1,192 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from kccj.metrics import metrics
+from kccj.scheduler import LocalClaims, ReminderDispatcher, ShardCoordinator, VirtualClock
+from kccj.storage import ScheduleStore
+
+# 2025-09-01 是周一，第1节 8:00 上课，7:45 时处于提前提醒窗口内
+NOW = datetime(2025, 9, 1, 7, 45)
+COURSE = {"weekday": "周一", "time": "1-2节", "course": "高等数学", "classroom": "教1-201", "teacher": "张三"}
+
+
+def _dispatcher(users, claims, sent, **kwargs):
+    async def send_reminder(user_id, course, start_time):
+        sent.append(("private", user_id))
+
+    async def send_summary(user_id, courses):
+        pass
+
+    return ReminderDispatcher(
+        list_users=lambda: list(users),
+        load_user=lambda user_id: users[user_id],
+        send_reminder=send_reminder,
+        send_summary=send_summary,
+        claims=claims,
+        **kwargs
+    )
+
+
+def test_sharded_workers_remind_each_user_once(tmp_path):
+    db_path = str(tmp_path / "shard.db")
+    users = {str(10000 + i): {"reminder_enabled": True, "courses": [COURSE]} for i in range(20)}
+
+    async def main():
+        workers = [ShardCoordinator(db_path, worker_id=f"w{i}") for i in range(2)]
+        for worker in workers:
+            await worker.heartbeat()
+        # 两个 worker 都看到对方后再开始分发
+        await workers[0].heartbeat()
+        assert {w.owns(u) for w in workers for u in users} == {True, False}
+        sent = []
+        dispatchers = [_dispatcher(users, worker, sent) for worker in workers]
+        # 同一分钟内重复轮询也只发送一次
+        for _ in range(2):
+            await asyncio.gather(*(d.tick(NOW) for d in dispatchers))
+        for worker in workers:
+            await worker.release()
+        return sent
+
+    sent = asyncio.run(main())
+    assert sorted(sent) == [("private", user_id) for user_id in sorted(users)]
+
+
+def test_group_fanin_across_workers_mentions_every_member(tmp_path):
+    db_path = str(tmp_path / "shard.db")
+    members = [str(10000 + i) for i in range(12)]
+    users = {
+        user_id: {"reminder_enabled": True, "group_id": "123", "courses": [COURSE]}
+        for user_id in members
+    }
+    users["99999"] = {"reminder_enabled": True, "courses": [COURSE]}
+
+    async def send_group_reminder(group_id, course, user_ids, start_time):
+        sent.append(("group", tuple(sorted(user_ids))))
+
+    sent = []
+
+    async def main():
+        workers = [ShardCoordinator(db_path, worker_id=f"w{i}") for i in range(2)]
+        for worker in workers:
+            await worker.heartbeat()
+        for worker in workers:
+            await worker.heartbeat()
+        # 群成员按用户 ID 分片时会分布在两个 worker 上
+        assert {w.owns(u) for w in workers for u in members} == {True, False}
+        dispatchers = [_dispatcher(users, worker, sent, send_group_reminder=send_group_reminder) for worker in workers]
+        await asyncio.gather(*(d.tick(NOW) for d in dispatchers))
+        await asyncio.gather(*(d.tick(NOW) for d in dispatchers))
+
+    asyncio.run(main())
+    assert sorted(sent) == [("group", tuple(members)), ("private", "99999")]
+
+
+def test_group_index_skips_reading_users_of_other_workers(tmp_path):
+    store = ScheduleStore(str(tmp_path / "data"))
+    groups = [str(100 + i) for i in range(8)]
+    for i in range(40):
+        store.save_user(str(10000 + i), {"reminder_enabled": True, "group_id": groups[i % 8], "courses": [COURSE]})
+    assert store.user_groups()["10009"] == "101"
+
+    loaded = []
+
+    def load_user(user_id):
+        loaded.append(user_id)
+        return store.load_user(user_id)
+
+    async def send_group_reminder(group_id, course, user_ids, start_time):
+        sent.append((group_id, len(user_ids)))
+
+    sent = []
+
+    async def main():
+        workers = [ShardCoordinator(str(tmp_path / "shard.db"), worker_id=f"w{i}") for i in range(2)]
+        for worker in workers:
+            await worker.heartbeat()
+        await workers[0].heartbeat()
+        dispatcher = ReminderDispatcher(
+            list_users=store.list_users,
+            load_user=load_user,
+            send_reminder=None,
+            send_summary=None,
+            claims=workers[0],
+            send_group_reminder=send_group_reminder,
+            group_index=store.user_groups,
+        )
+        await dispatcher.tick(NOW)
+        return [g for g in groups if workers[0].owns(f"group|{g}")]
+
+    owned = asyncio.run(main())
+    assert 0 < len(owned) < len(groups)
+    # 只读取本 worker 负责的群的成员
+    assert sorted(loaded) == sorted(u for u in store.list_users() if store.user_groups()[u] in owned)
+    assert sorted(sent) == [(g, 5) for g in sorted(owned)]
+
+
+def test_group_crossing_threshold_mid_window_does_not_mention_twice():
+    users = {"1": {"reminder_enabled": True, "group_id": "123", "courses": [COURSE]}}
+    sent = []
+
+    async def send_group_reminder(group_id, course, user_ids, start_time):
+        sent.append(("group", tuple(sorted(user_ids))))
+
+    async def main():
+        dispatcher = _dispatcher(users, LocalClaims(), sent, send_group_reminder=send_group_reminder)
+        await dispatcher.tick(NOW - timedelta(minutes=10))
+        # 窗口中途又有两位同学开启提醒，群内人数达到合并阈值
+        users["2"] = users["3"] = users["1"]
+        for minute in range(3):
+            await dispatcher.tick(NOW + timedelta(minutes=minute))
+
+    enabled = metrics.enabled
+    metrics.enabled = True
+    metrics.reset()
+    try:
+        asyncio.run(main())
+        lines = metrics.render_prometheus().splitlines()
+    finally:
+        metrics.reset()
+        metrics.enabled = enabled
+    assert sent == [("private", "1"), ("group", ("2", "3"))]
+    # 合并计数只在群提醒真正发出时累加，之后的轮询不再计入
+    assert 'kccj_reminders_total{status="merged"} 2' in lines
+
+
+class _Stop(BaseException):
+    pass
+
+
+def test_run_aligns_polls_to_whole_minutes():
+    clock = VirtualClock(datetime(2025, 9, 1, 22, 58, 30))
+    summaries = []
+
+    async def send_summary(user_id, courses):
+        summaries.append(clock.now())
+
+    dispatcher = ReminderDispatcher(
+        list_users=lambda: ["1"],
+        load_user=lambda user_id: {"courses": [], "reminder_enabled": True},
+        send_reminder=None,
+        send_summary=send_summary,
+        claims=LocalClaims(clock),
+        clock=clock,
+    )
+    polls = []
+    tick = dispatcher.tick
+
+    async def slow_tick(now):
+        polls.append(now)
+        await tick(now)
+        # 每轮处理耗时 7 秒，固定 sleep(60) 会使轮询时刻逐轮后移
+        clock.advance_to(now + timedelta(seconds=7))
+        if len(polls) == 4:
+            raise _Stop()
+
+    dispatcher.tick = slow_tick
+    try:
+        asyncio.run(dispatcher.run())
+    except _Stop:
+        pass
+
+    assert [p.strftime("%H:%M:%S") for p in polls] == ["22:58:30", "22:59:00", "23:00:00", "23:01:00"]
+    assert summaries == [datetime(2025, 9, 1, 23, 0)]
@@ -0,0 +1,15 @@
+import asyncio
+from datetime import date
+
+from kccj import simulation
+
+
+def test_run_on_virtual_clock_delivers_every_reminder_and_summary():
+    report = asyncio.run(simulation.simulate_semester(
+        users=40, weeks=1, semester_start=date(2025, 9, 1), class_size=20, poll_offset=15
+    ))
+
+    assert report["expected"] == report["delivered"] > 0
+    assert report["missed"] == report["duplicates"] == report["late"] == 0
+    assert report["summaries_expected"] == report["summaries"] == 40 * 7
+    assert report["summary_missed"] == report["summary_duplicates"] == 0
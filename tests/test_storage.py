@@ -0,0 +1,84 @@
+import os
+
+from kccj.schedule_diff import diff_schedules
+from kccj.storage import ScheduleStore, course_identity
+
+SCHEDULE = [
+    {"weekday": "周一", "time": "第1-2节", "course": "高等数学", "classroom": "教1-201", "teacher": "张三"},
+    {"weekday": "周三", "time": "第3-4节", "course": "大学英语", "classroom": "教2-305", "teacher": "李四"},
+]
+
+
+def _change_teacher(store, digest):
+    return store.apply_class_change(digest, {course_identity(SCHEDULE[0]): {"teacher": "王五"}})
+
+
+def test_class_change_is_seen_by_other_store_instances(tmp_path):
+    first, second = ScheduleStore(str(tmp_path)), ScheduleStore(str(tmp_path))
+    first.save_user("1", {"courses": SCHEDULE})
+    assert second.load_user("1")["courses"][0]["teacher"] == "张三"
+
+    _change_teacher(first, first.schedule_digest("1"))
+    assert second.load_user("1")["courses"][0]["teacher"] == "王五"
+
+
+def test_fresh_upload_of_old_version_is_not_redirected(tmp_path):
+    store = ScheduleStore(str(tmp_path))
+    store.save_user("1", {"courses": SCHEDULE})
+    old_digest = store.schedule_digest("1")
+    new_digest = _change_teacher(store, old_digest)
+
+    # 改课后另一位同学上传了改课前的课程表
+    store.save_user("2", {"courses": SCHEDULE})
+    assert store.schedule_digest("2") == old_digest
+    assert store.load_user("2")["courses"][0]["teacher"] == "张三"
+    assert store.schedule_digest("1") == new_digest
+    assert store.load_user("1")["courses"][0]["teacher"] == "王五"
+
+    # 未修改课程时保存，引用保持不变
+    data = store.load_user("2")
+    data["reminder_enabled"] = True
+    store.save_user("2", data)
+    assert store.load_user("2")["courses"][0]["teacher"] == "张三"
+
+
+def test_schedule_cache_is_bounded(tmp_path):
+    store = ScheduleStore(str(tmp_path))
+    store.cache_size = 3
+    for i in range(10):
+        store.save_user(str(i), {"courses": [dict(SCHEDULE[0], classroom=f"教1-{i}")]})
+        store.load_user(str(i))
+    assert len(store._cache) == 3
+
+
+def test_added_course_override_round_trips(tmp_path):
+    base = SCHEDULE + [
+        {"weekday": "周五", "time": "第5-6节", "course": "大学物理", "classroom": "教3-101", "teacher": "赵六"},
+        {"weekday": "周二", "time": "第7-8节", "course": "体育", "classroom": "操场", "teacher": "钱七"},
+    ]
+    extra = {"weekday": "周四", "time": "第9-10节", "course": "选修课", "classroom": "教4-101", "teacher": "孙八"}
+    store = ScheduleStore(str(tmp_path))
+    store.save_user("1", {"courses": base})
+    digest = store.schedule_digest("1")
+    shared = set(os.listdir(store.schedules_dir))
+
+    def courses_of(s):
+        return sorted(s.load_user("1")["courses"], key=course_identity)
+
+    # 改动少于一半时只记录为个人改动，不写入新的共享课程表
+    data = store.load_user("1")
+    courses = store.save_user_diff("1", data, diff_schedules(data["courses"], base + [extra]))
+    assert store.schedule_digest("1") == digest
+    assert courses_of(store) == sorted(courses, key=course_identity) == sorted(base + [extra], key=course_identity)
+    assert set(os.listdir(store.schedules_dir)) == shared
+
+    # 再次修改个人添加的课程时替换原记录，而不是再追加一门
+    moved = dict(extra, classroom="教4-202")
+    data = store.load_user("1")
+    store.save_user_diff("1", data, diff_schedules(data["courses"], base + [moved]))
+    assert courses_of(store) == courses_of(ScheduleStore(str(tmp_path))) == sorted(base + [moved], key=course_identity)
+
+    data = store.load_user("1")
+    store.save_user_diff("1", data, diff_schedules(data["courses"], base))
+    assert courses_of(store) == sorted(base, key=course_identity)
+    assert "__added__" not in store._read_user("1")["overrides"]
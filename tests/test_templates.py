@@ -0,0 +1,25 @@
+from kccj.templates import CompiledTemplate, TemplateEngine
+
+COURSE = {"day": "一", "time": "第1-2节", "name": "高等数学", "teacher": "张三", "location": "教1-201", "weeks": ""}
+PARSED = {"weekday": "周三", "time": "3-4节", "course": "大学英语", "classroom": "教2-305", "teacher": ""}
+
+
+def test_render_course_matches_format_map():
+    template = CompiledTemplate("{name}@{location}{{x}} {time!r} [{teacher:>4}] {weeks}")
+    assert template.render_course(COURSE) == "高等数学@教1-201{x} '第1-2节' [  张三] "
+
+
+def test_render_course_uses_field_aliases():
+    template = CompiledTemplate("{name} {location} {teacher}|")
+    assert template.render_course(PARSED) == "大学英语 教2-305 |"
+    assert template.render_courses([COURSE, PARSED], sep="/") == "高等数学 教1-201 张三|/大学英语 教2-305 |"
+
+
+def test_preview_cache_follows_template_changes():
+    config = {}
+    engine = TemplateEngine(lambda key, default=None: config.get(key, default))
+    courses = [COURSE]
+    first = engine.render_preview("一", courses)
+    assert engine.render_preview("一", courses) is first
+    config["message_templates"] = {"course_template": "{name}"}
+    assert engine.render_preview("一", courses) == "明天（星期一）的课程安排：\n\n高等数学"